@@ -1,8 +1,7 @@
 import streamlit as st
-import requests
-import xml.etree.ElementTree as ET
-from datetime import datetime, timedelta
+from datetime import datetime
 import pandas as pd
+import numpy as np
 try:
     import plotly.express as px
     import plotly.graph_objects as go
@@ -12,54 +11,23 @@ except ImportError:
     st.warning("Plotly not available. Charts will be disabled.")
 from anthropic import Anthropic
 import time
-import re
+import uuid
+import os
+import tempfile
+import shutil
+import hashlib
 
-# Drug database from uploaded Excel file
-DRUG_DATABASE = [
-    "ABRILADA", "ACETAMINOPHEN, DEXTROMETHORPHAN HBr", "ACETAMINOPHEN, DEXTROMETHORPHAN HBr, PHENYLEPHRINE HCl",
-    "ACETAMINOPHEN, DEXTROMETHORPHAN, PHENYLEPHRINE", "ACETAMINOPHEN, DIPHENHYDRAMINE HCL, PHENYLEPHRINE HCL",
-    "ACULAR LS", "ACUVAIL", "ACZONE", "ADMELOG", "ALOCRIL", "ALPHAGAN P", "AMG 193", "ANTIVENIN", 
-    "ARTHROTEC", "ATAZANAVIR", "AZACTAM", "AZTREONAM", "Acarbose", "Acetaminophen", "Advair", "Advil",
-    "Amlodipine", "Amoxicillin", "Aspirin", "Atorvastatin", "Azithromycin", "Benadryl", "Celebrex",
-    "Crestor", "Cymbalta", "Diovan", "Enbrel", "Fosamax", "Humira", "Humulin", "Ibuprofen", "Insulin",
-    "Keytruda", "Lantus", "Lasix", "Lexapro", "Lipitor", "Lisinopril", "Lyrica", "Metformin", "Nexium",
-    "Norvasc", "OxyContin", "Ozempic", "Plavix", "Pradaxa", "Prednisone", "Prilosec", "Prozac",
-    "Repatha", "Rituxan", "Rybelsus", "Singulair", "Synthroid", "Trulicity", "Tylenol", "Vasotec",
-    "Viagra", "Vioxx", "Warfarin", "Xarelto", "Zantac", "Zepbound", "Zocor", "Zoloft", "Zyprexa",
-    "adalimumab", "alemtuzumab", "bevacizumab", "cetuximab", "daratumumab", "evolocumab", "infliximab",
-    "ipilimumab", "natalizumab", "nivolumab", "obinutuzumab", "ofatumumab", "panitumumab", "pembrolizumab",
-    "pertuzumab", "ramucirumab", "rituximab", "secukinumab", "tocilizumab", "trastuzumab", "ustekinumab",
-    "vedolizumab", "tirzepatide", "semaglutide", "dulaglutide", "liraglutide", "exenatide", "insulin human",
-    "insulin aspart", "insulin glargine", "insulin detemir", "insulin lispro", "metformin", "sitagliptin",
-    "empagliflozin", "canagliflozin", "dapagliflozin", "ertugliflozin", "alogliptin", "linagliptin",
-    "saxagliptin", "vildagliptin", "acarbose", "miglitol", "nateglinide", "repaglinide", "rosiglitazone",
-    "pioglitazone", "glipizide", "glyburide", "glimepiride", "chlorpropamide", "tolbutamide", "tolazamide"
-]
-
-def filter_drug_suggestions(query, drug_list=DRUG_DATABASE, max_suggestions=10):
-    """Filter drug database based on user input"""
-    if not query:
-        return []
-    
-    query_lower = query.lower()
-    suggestions = []
-    
-    # Exact matches first
-    for drug in drug_list:
-        if drug.lower() == query_lower:
-            suggestions.append(drug)
-    
-    # Starts with matches
-    for drug in drug_list:
-        if drug.lower().startswith(query_lower) and drug not in suggestions:
-            suggestions.append(drug)
-    
-    # Contains matches
-    for drug in drug_list:
-        if query_lower in drug.lower() and drug not in suggestions:
-            suggestions.append(drug)
-    
-    return suggestions[:max_suggestions]
+# Search, analysis and scoring live in litscan_core so they can run without Streamlit
+from litscan_core import (
+    AnalysisCache, AnalysisResultIndex, BULK_PAPERS_PER_COMPOUND, BulkScanStore, CLAUDE_MODEL,
+    ClaudeUsageTracker, DEFAULT_ABSTRACTS_PER_REQUEST, DEFAULT_CLAUDE_REQUESTS_PER_MINUTE, DEFAULT_MAX_IN_FLIGHT,
+    DRUG_DATABASE, EXPORT_FORMATS, EutilsClient, MAX_ABSTRACTS_PER_REQUEST, OUTPUT_MODE_TEXT, OUTPUT_MODE_TOOL,
+    PAPERSAFE_DATA_DIR, PubMedArticleStore, SAFETY_DOMAIN_CHOICES, SAFETY_DOMAIN_LABELS,
+    SafetyAggregate, ScanHistoryStore, SurveillanceStore, TokenBucketRateLimiter, build_analysis_table, collect_bulk_scan,
+    filter_drug_suggestions, get_drug_classes, load_bulk_scan_results, message_batches,
+    read_compound_list, report_pubmed_error, run_incremental_scan, run_portfolio_scan,
+    safety_domain_mask, submit_bulk_scan, write_analysis_export
+)
 
 # Page configuration
 st.set_page_config(
@@ -125,487 +93,119 @@ def initialize_session_state():
         st.session_state.analysis_complete = False
     if 'safety_signals' not in st.session_state:
         st.session_state.safety_signals = []
+    if 'results_key' not in st.session_state:
+        st.session_state.results_key = None
+        st.session_state.safety_aggregate = SafetyAggregate()
 
-def search_pubmed(compound_name, max_results=20, therapeutic_area=None, max_years_back=25):
-    """Search PubMed for papers related to the compound using official E-utilities API"""
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
-    
-    # Enhanced search query with safety-related terms and therapeutic area
-    safety_terms = [
-        "adverse event", "side effect", "toxicity", "safety", "pharmacovigilance", 
-        "drug interaction", "contraindication", "warning", "precaution", "risk"
-    ]
-    
-    # Build comprehensive search query
-    compound_query = f'("{compound_name}"[Title/Abstract] OR "{compound_name}"[MeSH Terms])'
-    safety_query = " OR ".join([f'"{term}"[Title/Abstract]' for term in safety_terms])
-    
-    # Add therapeutic area if specified
-    area_query = ""
-    if therapeutic_area and therapeutic_area != "Other":
-        area_terms = {
-            "Oncology": ["cancer", "tumor", "oncology", "chemotherapy", "neoplasm"],
-            "Cardiovascular": ["cardiovascular", "cardiac", "heart", "hypertension", "cholesterol"],
-            "Neuroscience": ["neurological", "brain", "nervous system", "alzheimer", "parkinson"],
-            "Immunology": ["immunology", "autoimmune", "inflammation", "arthritis"],
-            "Metabolic": ["diabetes", "metabolic", "obesity", "glucose", "insulin"]
-        }
-        if therapeutic_area in area_terms:
-            area_query = " AND (" + " OR ".join([f'"{term}"[Title/Abstract]' for term in area_terms[therapeutic_area]]) + ")"
-    
-    search_query = f'({compound_query}) AND ({safety_query}){area_query}'
-    
-    # Calculate date range in days
-    days_back = max_years_back * 365
-    
-    try:
-        st.info(f"🔍 Searching PubMed for: {compound_name} (last {max_years_back} years)")
-        
-        # Search for paper IDs
-        search_url = f"{base_url}esearch.fcgi"
-        search_params = {
-            'db': 'pubmed',
-            'term': search_query,
-            'retmax': max_results,
-            'retmode': 'xml',
-            'sort': 'pub+date',
-            'datetype': 'pdat',
-            'reldate': str(days_back)  # Use calculated days back
-        }
-        
-        search_response = requests.get(search_url, params=search_params, timeout=30)
-        search_response.raise_for_status()
-        
-        search_root = ET.fromstring(search_response.content)
-        
-        # Check for errors
-        error_elem = search_root.find('.//ErrorList')
-        if error_elem is not None:
-            st.warning(f"PubMed search warning: {error_elem.text}")
-        
-        # Extract PMIDs
-        pmids = [id_elem.text for id_elem in search_root.findall('.//Id')]
-        
-        if not pmids:
-            st.warning(f"No papers found for '{compound_name}' with safety-related terms in the last {max_years_back} years. Try expanding the date range or different search terms.")
-            return []
-        
-        st.success(f"✅ Found {len(pmids)} papers from the last {max_years_back} years.")
-        
-        # Fetch paper details in batches to avoid timeouts
-        papers = []
-        batch_size = 10
-        
-        for i in range(0, len(pmids), batch_size):
-            batch_pmids = pmids[i:i+batch_size]
-            
-            fetch_url = f"{base_url}efetch.fcgi"
-            fetch_params = {
-                'db': 'pubmed',
-                'id': ','.join(batch_pmids),
-                'retmode': 'xml',
-                'rettype': 'abstract'
-            }
-            
-            fetch_response = requests.get(fetch_url, params=fetch_params, timeout=30)
-            fetch_response.raise_for_status()
-            
-            fetch_root = ET.fromstring(fetch_response.content)
-            
-            for article in fetch_root.findall('.//PubmedArticle'):
-                try:
-                    # Extract article information with better error handling
-                    title_elem = article.find('.//ArticleTitle')
-                    title = title_elem.text if title_elem is not None and title_elem.text else "No title available"
-                    
-                    # Handle multiple abstract sections with None checks
-                    abstract_texts = []
-                    for abstract_elem in article.findall('.//AbstractText'):
-                        if abstract_elem.text:
-                            label = abstract_elem.get('Label', '')
-                            text = abstract_elem.text
-                            if label:
-                                abstract_texts.append(f"{label}: {text}")
-                            else:
-                                abstract_texts.append(text)
-                    
-                    abstract = " ".join(abstract_texts) if abstract_texts else "No abstract available"
-                    
-                    # Extract authors with affiliations
-                    authors = []
-                    for author in article.findall('.//Author'):
-                        lastname = author.find('.//LastName')
-                        forename = author.find('.//ForeName')
-                        if lastname is not None and forename is not None and lastname.text and forename.text:
-                            authors.append(f"{forename.text} {lastname.text}")
-                    
-                    # Extract comprehensive publication date
-                    pub_date = "Unknown"
-                    pub_year = article.find('.//PubDate/Year')
-                    pub_month = article.find('.//PubDate/Month')
-                    
-                    if pub_year is not None and pub_year.text:
-                        if pub_month is not None and pub_month.text:
-                            pub_date = f"{pub_month.text} {pub_year.text}"
-                        else:
-                            pub_date = pub_year.text
-                    
-                    # Extract PMID
-                    pmid_elem = article.find('.//PMID')
-                    pmid = pmid_elem.text if pmid_elem is not None and pmid_elem.text else "Unknown"
-                    
-                    # Extract journal information
-                    journal_elem = article.find('.//Journal/Title')
-                    journal = journal_elem.text if journal_elem is not None and journal_elem.text else "Unknown Journal"
-                    
-                    # Extract DOI if available
-                    doi_elem = article.find('.//ArticleId[@IdType="doi"]')
-                    doi = doi_elem.text if doi_elem is not None and doi_elem.text else None
-                    
-                    # Ensure title and abstract are strings before concatenation
-                    title_str = str(title) if title else "No title available"
-                    abstract_str = str(abstract) if abstract else "No abstract available"
-                    
-                    papers.append({
-                        'pmid': pmid,
-                        'title': title_str,
-                        'abstract': abstract_str,
-                        'authors': ', '.join(authors[:3]) + (' et al.' if len(authors) > 3 else ''),
-                        'pub_date': pub_date,
-                        'journal': journal,
-                        'doi': doi,
-                        'url': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
-                        'compound_mentioned': compound_name.lower() in (title_str + " " + abstract_str).lower()
-                    })
-                    
-                except Exception as e:
-                    # More specific error logging
-                    pmid_elem = article.find('.//PMID')
-                    pmid = pmid_elem.text if pmid_elem is not None and pmid_elem.text else "Unknown"
-                    st.warning(f"Error parsing article {pmid}: {str(e)}")
-                    continue
-        
-        st.success(f"✅ Successfully retrieved {len(papers)} papers from PubMed")
-        return papers
-        
-    except requests.exceptions.Timeout:
-        st.error("⏰ PubMed search timed out. Please try again with fewer papers or check your internet connection.")
-        return []
-    except requests.exceptions.RequestException as e:
-        st.error(f"🌐 Network error accessing PubMed: {str(e)}")
-        return []
-    except ET.ParseError as e:
-        st.error(f"📄 Error parsing PubMed response: {str(e)}")
-        return []
-    except Exception as e:
-        st.error(f"❌ Unexpected error searching PubMed: {str(e)}")
-        return []
+def streamlit_notify(level, message):
+    """Progress callback that renders status messages with st.info/st.success/st.warning/st.error"""
+    getattr(st, level)(message)
 
-def analyze_with_claude(paper, compound_name, anthropic_client):
-    """Analyze a paper using Claude AI with structured risk assessment"""
-    try:
-        prompt = f"""
-        You are a senior drug safety scientist analyzing scientific literature for pharmaceutical regulatory compliance.
-        
-        Analyze this research paper about the compound "{compound_name}" and provide a structured safety assessment.
-        
-        Title: {paper['title']}
-        Abstract: {paper['abstract']}
-        
-        CRITICAL: I need you to identify and count specific safety signals. Please be thorough and specific.
-        
-        Please provide your analysis in EXACTLY this format:
-        
-        ADVERSE_EVENTS_COUNT: [number]
-        ADVERSE_EVENTS_LIST:
-        - [list each specific adverse event mentioned, one per line]
-        
-        DRUG_INTERACTIONS_COUNT: [number]
-        DRUG_INTERACTIONS_LIST:
-        - [list each specific drug interaction mentioned, one per line]
-        
-        CONTRAINDICATIONS_COUNT: [number]
-        CONTRAINDICATIONS_LIST:
-        - [list each specific contraindication mentioned, one per line]
-        
-        SAFETY_SIGNALS_DETECTED:
-        - [any other safety concerns not covered above]
-        
-        KEY_FINDINGS:
-        - [summarize the main safety-related findings in 2-3 bullet points]
-        
-        REGULATORY_IMPACT:
-        - [assess if this requires 15-day FDA reporting or other regulatory action]
-        
-        SAFETY_DOMAINS:
-        - [categorize into: Hepatic, Cardiac, Neurological, Gastrointestinal, Dermatological, Renal, Hematological, Other]
-        
-        CLINICAL_SIGNIFICANCE:
-        - [brief assessment of clinical relevance and patient impact]
-        
-        IMPORTANT: 
-        - Count EVERY adverse event, drug interaction, and contraindication mentioned
-        - Be specific and thorough in your counting
-        - Include mild, moderate, and severe events
-        - Don't miss any safety signals
-        """
-        
-        message = anthropic_client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1500,
-            temperature=0.1,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        response_text = message.content[0].text
-        return response_text
-        
-    except Exception as e:
-        error_msg = f"Claude API Error: {str(e)}"
-        
-        # Return a fallback analysis
-        return f"""
-        ADVERSE_EVENTS_COUNT: 0
-        ADVERSE_EVENTS_LIST:
-        - Analysis failed due to API error
-        
-        DRUG_INTERACTIONS_COUNT: 0
-        DRUG_INTERACTIONS_LIST:
-        - Analysis failed due to API error
-        
-        CONTRAINDICATIONS_COUNT: 0
-        CONTRAINDICATIONS_LIST:
-        - Analysis failed due to API error
-        
-        SAFETY_SIGNALS_DETECTED:
-        - API Error: {error_msg}
-        
-        KEY_FINDINGS:
-        - Unable to analyze due to API connection issue
-        
-        REGULATORY_IMPACT:
-        - Analysis incomplete due to technical error
-        
-        SAFETY_DOMAINS:
-        - Other
-        
-        CLINICAL_SIGNIFICANCE:
-        - Analysis could not be completed
-        """
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_anthropic_client(api_key):
+    """One Anthropic client (and its connection pool) per API key, shared by every rerun and session"""
+    return Anthropic(api_key=api_key)
 
-def calculate_risk_level(analysis_text):
-    """Calculate risk level based on systematic scoring of safety signals"""
-    try:
-        # Extract counts from Claude's analysis
-        ae_count = 0
-        interaction_count = 0
-        contraindication_count = 0
-        
-        # Extract adverse events count
-        ae_match = re.search(r'ADVERSE_EVENTS_COUNT:\s*(\d+)', analysis_text, re.IGNORECASE)
-        if ae_match:
-            ae_count = int(ae_match.group(1))
-        
-        # Extract drug interactions count
-        interaction_match = re.search(r'DRUG_INTERACTIONS_COUNT:\s*(\d+)', analysis_text, re.IGNORECASE)
-        if interaction_match:
-            interaction_count = int(interaction_match.group(1))
-        
-        # Extract contraindications count
-        contraindication_match = re.search(r'CONTRAINDICATIONS_COUNT:\s*(\d+)', analysis_text, re.IGNORECASE)
-        if contraindication_match:
-            contraindication_count = int(contraindication_match.group(1))
-        
-        # Calculate risk score
-        total_safety_signals = ae_count + interaction_count + contraindication_count
-        
-        # Risk assessment logic
-        if total_safety_signals >= 5 or contraindication_count >= 2 or interaction_count >= 3:
-            risk_level = "HIGH"
-            risk_rationale = f"High risk: {ae_count} adverse events, {interaction_count} drug interactions, {contraindication_count} contraindications"
-        elif total_safety_signals >= 2 or contraindication_count >= 1 or interaction_count >= 1:
-            risk_level = "MEDIUM"
-            risk_rationale = f"Medium risk: {ae_count} adverse events, {interaction_count} drug interactions, {contraindication_count} contraindications"
-        elif total_safety_signals > 0:
-            risk_level = "LOW"
-            risk_rationale = f"Low risk: {ae_count} adverse events, {interaction_count} drug interactions, {contraindication_count} contraindications"
-        else:
-            risk_level = "LOW"
-            risk_rationale = "No specific safety signals identified"
-        
-        # Check for serious adverse events in text (additional risk factors)
-        serious_ae_keywords = [
-            "death", "fatal", "mortality", "life-threatening", "hospitalization", 
-            "serious adverse event", "severe", "toxicity", "black box warning",
-            "discontinuation", "withdrawal", "contraindicated"
-        ]
-        
-        serious_count = sum(1 for keyword in serious_ae_keywords 
-                          if keyword.lower() in analysis_text.lower())
-        
-        # Upgrade risk if serious events mentioned
-        if serious_count >= 3 and risk_level != "HIGH":
-            risk_level = "HIGH"
-            risk_rationale += f" (upgraded due to {serious_count} serious safety terms)"
-        elif serious_count >= 1 and risk_level == "LOW":
-            risk_level = "MEDIUM"
-            risk_rationale += f" (upgraded due to {serious_count} serious safety terms)"
-        
-        return {
-            'risk_level': risk_level,
-            'risk_rationale': risk_rationale,
-            'adverse_events_count': ae_count,
-            'drug_interactions_count': interaction_count,
-            'contraindications_count': contraindication_count,
-            'total_safety_signals': total_safety_signals,
-            'serious_terms_count': serious_count
-        }
-        
-    except Exception as e:
-        return {
-            'risk_level': 'UNKNOWN',
-            'risk_rationale': f'Error calculating risk: {str(e)}',
-            'adverse_events_count': 0,
-            'drug_interactions_count': 0,
-            'contraindications_count': 0,
-            'total_safety_signals': 0,
-            'serious_terms_count': 0
-        }
+@st.cache_resource(show_spinner=False)
+def get_eutils_client():
+    """One NCBI E-utilities client per process, so all sessions together stay within NCBI's request rate"""
+    return EutilsClient()
 
-def parse_claude_analysis(analysis_text):
-    """Parse Claude's analysis into structured data with enhanced risk assessment"""
-    try:
-        # Calculate systematic risk level
-        risk_data = calculate_risk_level(analysis_text)
-        
-        # Extract adverse events list
-        ae_section = re.search(r'ADVERSE_EVENTS_LIST:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        adverse_events = []
-        if ae_section:
-            ae_lines = ae_section.group(1).strip().split('\n')
-            adverse_events = [line.strip('- ').strip() for line in ae_lines if line.strip().startswith('-')]
-        
-        # Extract drug interactions list
-        interaction_section = re.search(r'DRUG_INTERACTIONS_LIST:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        drug_interactions = []
-        if interaction_section:
-            interaction_lines = interaction_section.group(1).strip().split('\n')
-            drug_interactions = [line.strip('- ').strip() for line in interaction_lines if line.strip().startswith('-')]
-        
-        # Extract contraindications list
-        contraindication_section = re.search(r'CONTRAINDICATIONS_LIST:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        contraindications = []
-        if contraindication_section:
-            contraindication_lines = contraindication_section.group(1).strip().split('\n')
-            contraindications = [line.strip('- ').strip() for line in contraindication_lines if line.strip().startswith('-')]
-        
-        # Extract other safety signals
-        signals_section = re.search(r'SAFETY_SIGNALS_DETECTED:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        other_signals = []
-        if signals_section:
-            signal_lines = signals_section.group(1).strip().split('\n')
-            other_signals = [line.strip('- ').strip() for line in signal_lines if line.strip().startswith('-')]
-        
-        # Extract key findings
-        findings_section = re.search(r'KEY_FINDINGS:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        findings = []
-        if findings_section:
-            finding_lines = findings_section.group(1).strip().split('\n')
-            findings = [line.strip('- ').strip() for line in finding_lines if line.strip().startswith('-')]
-        
-        # Extract regulatory impact
-        regulatory_section = re.search(r'REGULATORY_IMPACT:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        regulatory_impact = regulatory_section.group(1).strip() if regulatory_section else "No specific regulatory action identified"
-        
-        # Extract safety domains
-        domains_section = re.search(r'SAFETY_DOMAINS:(.*?)(?=\n[A-Z_]+:|$)', analysis_text, re.DOTALL | re.IGNORECASE)
-        domains = []
-        if domains_section:
-            domain_lines = domains_section.group(1).strip().split('\n')
-            domains = [line.strip('- ').strip() for line in domain_lines if line.strip().startswith('-')]
-        
-        # Combine all safety signals for display
-        all_safety_signals = adverse_events + drug_interactions + contraindications + other_signals
-        
-        return {
-            'risk_level': risk_data['risk_level'],
-            'risk_rationale': risk_data['risk_rationale'],
-            'adverse_events_count': risk_data['adverse_events_count'],
-            'drug_interactions_count': risk_data['drug_interactions_count'],
-            'contraindications_count': risk_data['contraindications_count'],
-            'total_safety_signals': risk_data['total_safety_signals'],
-            'serious_terms_count': risk_data['serious_terms_count'],
-            'adverse_events': adverse_events,
-            'drug_interactions': drug_interactions,
-            'contraindications': contraindications,
-            'safety_signals': all_safety_signals,  # Combined list for backwards compatibility
-            'other_signals': other_signals,
-            'key_findings': findings,
-            'regulatory_impact': regulatory_impact,
-            'safety_domains': domains,
-            'full_analysis': analysis_text
-        }
-        
-    except Exception as e:
-        return {
-            'risk_level': 'UNKNOWN',
-            'risk_rationale': 'Analysis parsing error',
-            'adverse_events_count': 0,
-            'drug_interactions_count': 0,
-            'contraindications_count': 0,
-            'total_safety_signals': 0,
-            'serious_terms_count': 0,
-            'adverse_events': [],
-            'drug_interactions': [],
-            'contraindications': [],
-            'safety_signals': [],
-            'other_signals': [],
-            'key_findings': [],
-            'regulatory_impact': 'Analysis parsing error',
-            'safety_domains': [],
-            'full_analysis': analysis_text
-        }
+@st.cache_resource(show_spinner=False)
+def get_claude_rate_limiter():
+    """One Claude request limiter per process, shared by every session's scans"""
+    return TokenBucketRateLimiter(DEFAULT_CLAUDE_REQUESTS_PER_MINUTE / 60.0, capacity=DEFAULT_MAX_IN_FLIGHT)
 
-def create_safety_dashboard(analyzed_papers):
-    """Create safety signal dashboard"""
-    if not analyzed_papers:
-        return
-    
-    # Count risk levels
-    risk_counts = {'HIGH': 0, 'MEDIUM': 0, 'LOW': 0, 'UNKNOWN': 0}
-    domain_counts = {}
-    all_signals = []
+@st.cache_resource(show_spinner=False)
+def get_bulk_scan_store():
+    """One BulkScanStore connection per process, shared by every rerun and session (the store serializes access)"""
+    return BulkScanStore()
+
+@st.cache_resource(show_spinner=False)
+def get_scan_history_store():
+    """One ScanHistoryStore connection per process, shared by every rerun and session (the store serializes access)"""
+    return ScanHistoryStore()
+
+def store_search_results(papers, aggregate=None):
+    """Keep analyzed papers in the session under a fresh results_key for the cached views below.
+
+    aggregate is the SafetyAggregate kept up to date during the scan; without one it is
+    built here in a single pass, so reruns never recount the papers.
+    """
+    st.session_state.search_results = papers
+    st.session_state.safety_aggregate = aggregate if aggregate is not None else SafetyAggregate(papers)
+    st.session_state.results_key = uuid.uuid4().hex
+
+# Widget changes rerun the whole script; everything derived from a stored result set is
+# cached under its results_key, so the papers themselves are never hashed (leading underscore)
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_analysis_table(results_key, _papers):
+    return build_analysis_table(_papers)
+
+EXPORT_DIR = os.path.join(PAPERSAFE_DATA_DIR, "exports")
+EXPORT_MAX_IDLE_HOURS = 6
+
+def prune_export_dirs(keep):
+    """Remove session export directories unused for EXPORT_MAX_IDLE_HOURS, i.e. those of abandoned sessions"""
+    cutoff = time.time() - EXPORT_MAX_IDLE_HOURS * 3600
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_dir() and entry.path != keep and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def session_export_dir():
+    """This session's own export directory under EXPORT_DIR, so sessions never touch each other's files.
+
+    Every use marks the directory as live; directories left idle by ended sessions are
+    pruned whenever a session creates its own.
+    """
+    export_dir = st.session_state.get('export_dir')
+    if export_dir is None or not os.path.isdir(export_dir):
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        export_dir = st.session_state.export_dir = tempfile.mkdtemp(prefix="session-", dir=EXPORT_DIR)
+        prune_export_dirs(keep=export_dir)
+    os.utime(export_dir)
+    return export_dir
+
+def write_export_file(results_key, export_format, papers, analysis_table):
+    """Write a result set's export to disk in chunks and return its path.
+
+    The session keeps only its latest export; earlier files in its directory are removed.
+    """
+    export_dir = session_export_dir()
+    path = os.path.join(export_dir, f"{results_key}{EXPORT_FORMATS[export_format][1]}")
+    write_analysis_export(papers, analysis_table, path + ".tmp", export_format)
+    os.replace(path + ".tmp", path)
+    for entry in os.scandir(export_dir):
+        if entry.path != path:
+            os.remove(entry.path)
+    return path
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def risk_distribution_figure(risk_items):
+    """Pie chart for a tuple of (risk level, count) pairs with non-zero counts"""
+    risk_df = pd.DataFrame(list(risk_items), columns=['Risk Level', 'Count'])
+    colors = {'HIGH': '#f44336', 'MEDIUM': '#ff9800', 'LOW': '#4caf50', 'UNKNOWN': '#9e9e9e'}
+    color_sequence = [colors.get(level, '#9e9e9e') for level in risk_df['Risk Level']]
     
-    for paper in analyzed_papers:
-        analysis = paper.get('analysis', {})
-        risk_level = analysis.get('risk_level', 'UNKNOWN')
-        risk_counts[risk_level] += 1
-        
-        # Count safety domains
-        domains = analysis.get('safety_domains', [])
-        for domain in domains:
-            domain_counts[domain] = domain_counts.get(domain, 0) + 1
-        
-        # Collect all safety signals
-        signals = analysis.get('safety_signals', [])
-        all_signals.extend(signals)
+    return px.pie(risk_df, values='Count', names='Risk Level', 
+                  color_discrete_sequence=color_sequence,
+                  title="Safety Risk Assessment")
+
+def create_safety_dashboard(aggregate):
+    """Create safety signal dashboard from the SafetyAggregate of the analyzed papers"""
+    risk_counts = aggregate.risk_counts()
+    if not any(risk_counts.values()):
+        return
     
     # Create visualizations
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("Risk Level Distribution")
-        risk_df = pd.DataFrame(list(risk_counts.items()), columns=['Risk Level', 'Count'])
-        risk_df = risk_df[risk_df['Count'] > 0]
+        risk_items = tuple((level, count) for level, count in risk_counts.items() if count > 0)
         
-        if PLOTLY_AVAILABLE and len(risk_df) > 0:
-            colors = {'HIGH': '#f44336', 'MEDIUM': '#ff9800', 'LOW': '#4caf50', 'UNKNOWN': '#9e9e9e'}
-            color_sequence = [colors.get(level, '#9e9e9e') for level in risk_df['Risk Level']]
-            
-            fig_risk = px.pie(risk_df, values='Count', names='Risk Level', 
-                             color_discrete_sequence=color_sequence,
-                             title="Safety Risk Assessment")
-            st.plotly_chart(fig_risk, use_container_width=True)
+        if PLOTLY_AVAILABLE and risk_items:
+            st.plotly_chart(risk_distribution_figure(risk_items), use_container_width=True)
         else:
             # Fallback to simple text display if Plotly not available
             st.markdown("**Risk Level Summary:**")
@@ -616,10 +216,9 @@ def create_safety_dashboard(analyzed_papers):
     
     with col2:
         st.subheader("Safety Domains Affected")
-        if domain_counts:
-            # Sort domains by count (highest first)
-            sorted_domains = sorted(domain_counts.items(), key=lambda x: x[1], reverse=True)
-            
+        # Canonical domains sorted by count (highest first)
+        sorted_domains = aggregate.sorted_domains()
+        if sorted_domains:
             # Show top domains in a clean grid format
             if len(sorted_domains) <= 6:
                 # Small number of domains - show all in clean cards
@@ -703,6 +302,272 @@ def create_safety_dashboard(analyzed_papers):
         else:
             st.info("No safety domains identified in analyzed papers")
 
+def render_bulk_scan_panel(max_years_back):
+    """Sidebar panel for overnight Message Batches scans; jobs are read back from disk on every rerun"""
+    with st.expander("🌙 Overnight Bulk Scan"):
+        st.caption("Submit every compound's analyses as Message Batches - lower cost, results within 24 hours")
+        
+        bulk_compounds = st.multiselect(
+            "Compounds",
+            options=sorted(DRUG_DATABASE),
+            default=sorted(DRUG_DATABASE),
+            key="bulk_compounds"
+        )
+        bulk_papers = st.slider(
+            "Papers per Compound",
+            min_value=5,
+            max_value=200,
+            value=BULK_PAPERS_PER_COMPOUND,
+            key="bulk_papers_per_compound"
+        )
+        
+        bulk_store = get_bulk_scan_store()
+        anthropic_client = st.session_state.get('api_client')
+        
+        if st.button("📦 Submit Bulk Scan", use_container_width=True, disabled=anthropic_client is None or not bulk_compounds):
+            article_store = PubMedArticleStore()
+            analysis_cache = AnalysisCache()
+            try:
+                with st.spinner(f"Retrieving papers for {len(bulk_compounds)} compounds..."):
+                    submit_bulk_scan(
+                        bulk_compounds, message_batches(anthropic_client), bulk_store,
+                        max_results=bulk_papers, max_years_back=max_years_back,
+                        article_store=article_store, cache=analysis_cache, notify=streamlit_notify,
+                        eutils=get_eutils_client()
+                    )
+            except Exception as e:
+                st.error(f"❌ Bulk scan submission failed: {str(e)}")
+            finally:
+                article_store.close()
+                analysis_cache.close()
+        
+        for job in bulk_store.jobs()[:10]:
+            submitted = datetime.fromtimestamp(job['created_at']).strftime("%Y-%m-%d %H:%M")
+            st.markdown(f"**{job['batch_id'][-12:]}** · {submitted}  \n{job['request_count']} requests · {len(job['compounds'])} compounds · `{job['status']}`")
+            
+            if job['status'] == 'collected':
+                if st.button("📂 Load Results", key=f"load_bulk_{job['batch_id']}", use_container_width=True):
+                    bulk_papers_loaded = load_bulk_scan_results(job['batch_id'], bulk_store)
+                    store_search_results(bulk_papers_loaded)
+                    # Loaded bulk results go into the scan history like an interactive scan's
+                    if bulk_papers_loaded:
+                        get_scan_history_store().save_scan(bulk_papers_loaded, settings={
+                            'bulk_batch_id': job['batch_id'], 'max_years_back': max_years_back, 'output_mode': OUTPUT_MODE_TEXT
+                        })
+                    st.session_state.analysis_complete = True
+                    st.rerun()
+            elif anthropic_client is not None:
+                if st.button("🔄 Check Status", key=f"poll_bulk_{job['batch_id']}", use_container_width=True):
+                    analysis_cache = AnalysisCache()
+                    try:
+                        status = collect_bulk_scan(job['batch_id'], message_batches(anthropic_client), bulk_store, analysis_cache)
+                        st.info(f"Batch status: {status}")
+                    except Exception as e:
+                        status = None
+                        st.error(f"❌ Could not check batch: {str(e)}")
+                    finally:
+                        analysis_cache.close()
+                    if status == 'collected':
+                        st.rerun()
+
+HISTORY_FIRST_YEAR = 1975
+
+def render_scan_history_panel():
+    """Sidebar panel to reopen saved scans and to query analyses across all of them"""
+    with st.expander("🗂️ Scan History"):
+        st.caption("Every completed scan is saved locally - reopen it or query across scans without fetching or analyzing again")
+        
+        history_store = get_scan_history_store()
+        loaded_papers = None
+        
+        drug_class = st.selectbox("Drug Class", [""] + sorted(get_drug_classes()), key="history_drug_class")
+        history_compounds = st.multiselect("Compounds", options=sorted(DRUG_DATABASE), key="history_compounds")
+        history_risks = st.multiselect("Risk Levels", ["HIGH", "MEDIUM", "LOW", "UNKNOWN"], key="history_risks")
+        history_domains = st.multiselect("Safety Domains", SAFETY_DOMAIN_CHOICES, key="history_domains")
+        current_year = datetime.now().year
+        year_from, year_to = st.slider(
+            "Publication Years",
+            min_value=HISTORY_FIRST_YEAR,
+            max_value=current_year,
+            value=(HISTORY_FIRST_YEAR, current_year),
+            key="history_years",
+            help="Leave the full range to include papers without a publication year"
+        )
+        
+        if st.button("🔎 Query History", use_container_width=True):
+            year_filtered = (year_from, year_to) != (HISTORY_FIRST_YEAR, current_year)
+            loaded_papers = history_store.query(
+                compounds=history_compounds, drug_class=drug_class or None, risk_levels=history_risks,
+                domains=history_domains, year_from=year_from if year_filtered else None, year_to=year_to if year_filtered else None
+            )
+            if not loaded_papers:
+                st.info("No saved analyses match these filters")
+                loaded_papers = None
+        
+        for scan in history_store.scans(limit=10):
+            scanned = datetime.fromtimestamp(scan['created_at']).strftime("%Y-%m-%d %H:%M")
+            st.markdown(f"**{scan['label']}** · {scanned}  \n{scan['paper_count']} papers · {scan['high_risk']} high risk")
+            if st.button("📂 Reopen", key=f"open_scan_{scan['scan_id']}", use_container_width=True):
+                loaded_papers = history_store.load_scan(scan['scan_id'])
+        
+        if loaded_papers is not None:
+            store_search_results(loaded_papers)
+            st.session_state.analysis_complete = True
+            st.rerun()
+
+RISK_ICONS = {'HIGH': "🔴", 'MEDIUM': "🟡", 'LOW': "🟢"}
+DETAIL_SORT_OPTIONS = ["PubMed order", "Risk level", "Safety signals", "Serious terms", "Title"]
+DETAIL_PAGE_SIZES = [10, 25, 50, 100]
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def detail_search_text(results_key, _analysis_table):
+    """Lower-cased title, authors, compound, PMID, signals and domains per row, for the detail search box"""
+    table = _analysis_table
+    return (
+        table['title'] + ' ' + table['authors'] + ' ' + table['compound'] + ' ' + table['pmid'] + ' '
+        + table['safety_signals'] + ' ' + SAFETY_DOMAIN_LABELS[table['safety_domain_mask'].to_numpy()]
+    ).str.lower()
+
+def select_detail_rows(analysis_table, search_text, risk_filter="All", query="", sort_by="PubMed order", domains=()):
+    """Row positions of the analysis table matching the filters, in display order"""
+    mask = np.ones(len(analysis_table), dtype=bool)
+    if risk_filter != "All":
+        mask &= (analysis_table['risk_level'] == risk_filter).to_numpy()
+    if domains:
+        # Papers touching any of the selected domains: one bitwise AND over the mask column
+        mask &= (analysis_table['safety_domain_mask'].to_numpy() & safety_domain_mask(domains)) != 0
+    if query.strip():
+        mask &= search_text.str.contains(query.strip().lower(), regex=False).to_numpy()
+    rows = np.flatnonzero(mask)
+    
+    # Stable sorts, so ties keep the PubMed order
+    if sort_by == "Risk level":
+        risk_rank = analysis_table['risk_level'].map({'HIGH': 0, 'MEDIUM': 1, 'LOW': 2}).fillna(3).to_numpy()[rows]
+        signals = analysis_table['total_safety_signals'].to_numpy()[rows]
+        rows = rows[np.lexsort((-signals, risk_rank))]
+    elif sort_by == "Safety signals":
+        rows = rows[np.argsort(-analysis_table['total_safety_signals'].to_numpy()[rows], kind='stable')]
+    elif sort_by == "Serious terms":
+        rows = rows[np.argsort(-analysis_table['serious_terms_count'].to_numpy()[rows], kind='stable')]
+    elif sort_by == "Title":
+        rows = rows[np.argsort(analysis_table['title'].str.lower().to_numpy()[rows], kind='stable')]
+    return rows
+
+def reset_detail_page():
+    st.session_state.detail_page = 1
+
+def render_paper_details(paper, risk_level):
+    """Full detail view of one analyzed paper - only rendered for the row that is opened"""
+    analysis = paper.get('analysis', {})
+    risk_color = RISK_ICONS.get(risk_level, "⚪")
+    
+    st.subheader(f"{risk_color} {paper['title']}")
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        st.markdown(f"**Authors:** {paper['authors']}")
+        st.markdown(f"**Publication Date:** {paper['pub_date']}")
+        st.markdown(f"**PMID:** [{paper['pmid']}]({paper['url']})")
+        
+        st.markdown("**Abstract:**")
+        st.markdown(paper['abstract'][:500] + "..." if len(paper['abstract']) > 500 else paper['abstract'])
+    
+    with col2:
+        st.markdown(f"**Risk Level:** {risk_color} {risk_level}")
+        
+        # Show detailed risk breakdown
+        if analysis.get('risk_rationale'):
+            st.markdown("**Risk Assessment:**")
+            st.caption(analysis['risk_rationale'])
+        
+        # Safety signal counts
+        ae_count = analysis.get('adverse_events_count', 0)
+        interaction_count = analysis.get('drug_interactions_count', 0)
+        contraindication_count = analysis.get('contraindications_count', 0)
+        
+        if ae_count > 0 or interaction_count > 0 or contraindication_count > 0:
+            st.markdown("**Safety Signal Counts:**")
+            if ae_count > 0:
+                st.markdown(f"• **{ae_count}** Adverse Events")
+            if interaction_count > 0:
+                st.markdown(f"• **{interaction_count}** Drug Interactions")
+            if contraindication_count > 0:
+                st.markdown(f"• **{contraindication_count}** Contraindications")
+        
+        # Show specific adverse events if available
+        if analysis.get('adverse_events') and len(analysis['adverse_events']) > 0:
+            st.markdown("**Adverse Events:**")
+            for event in analysis['adverse_events'][:3]:  # Show first 3
+                if event.strip():
+                    st.markdown(f"• {event}")
+        
+        # Show drug interactions if available
+        if analysis.get('drug_interactions') and len(analysis['drug_interactions']) > 0:
+            st.markdown("**Drug Interactions:**")
+            for interaction in analysis['drug_interactions'][:2]:  # Show first 2
+                if interaction.strip():
+                    st.markdown(f"• {interaction}")
+        
+        # Show contraindications if available
+        if analysis.get('contraindications') and len(analysis['contraindications']) > 0:
+            st.markdown("**Contraindications:**")
+            for contraindication in analysis['contraindications'][:2]:  # Show first 2
+                if contraindication.strip():
+                    st.markdown(f"• {contraindication}")
+        
+        # Show safety domains
+        if analysis.get('safety_domains'):
+            st.markdown("**Safety Domains:**")
+            for domain in analysis['safety_domains'][:3]:  # Show first 3
+                if domain.strip():
+                    st.markdown(f"• {domain}")
+    
+    # Full analysis details
+    with st.expander("View Full AI Analysis & Risk Calculation"):
+        # Risk calculation details
+        st.markdown("### 🎯 Risk Assessment Details")
+        col_a, col_b, col_c = st.columns(3)
+        with col_a:
+            st.metric("Adverse Events", analysis.get('adverse_events_count', 0))
+        with col_b:
+            st.metric("Drug Interactions", analysis.get('drug_interactions_count', 0))
+        with col_c:
+            st.metric("Contraindications", analysis.get('contraindications_count', 0))
+        
+        st.markdown(f"**Risk Rationale:** {analysis.get('risk_rationale', 'Not available')}")
+        
+        # Show all identified safety signals
+        if analysis.get('adverse_events'):
+            st.markdown("**All Adverse Events Identified:**")
+            for i, event in enumerate(analysis['adverse_events'], 1):
+                if event.strip():
+                    st.markdown(f"{i}. {event}")
+        
+        if analysis.get('drug_interactions'):
+            st.markdown("**All Drug Interactions Identified:**")
+            for i, interaction in enumerate(analysis['drug_interactions'], 1):
+                if interaction.strip():
+                    st.markdown(f"{i}. {interaction}")
+        
+        if analysis.get('contraindications'):
+            st.markdown("**All Contraindications Identified:**")
+            for i, contraindication in enumerate(analysis['contraindications'], 1):
+                if contraindication.strip():
+                    st.markdown(f"{i}. {contraindication}")
+        
+        st.markdown("### 📋 Key Findings")
+        for finding in analysis.get('key_findings', []):
+            if finding.strip():
+                st.markdown(f"• {finding}")
+        
+        st.markdown("### 🏛️ Regulatory Impact")
+        st.markdown(analysis.get('regulatory_impact', 'Not specified'))
+        
+        st.markdown("### 🤖 Complete AI Analysis")
+        # A toggle rather than a nested expander, and the raw text is only sent once requested
+        if st.toggle("Show Raw Analysis Text", key=f"raw_analysis_{paper.get('compound', '')}_{paper['pmid']}"):
+            st.text(analysis.get('full_analysis', 'No analysis available'))
+
 def main():
     initialize_session_state()
     
@@ -748,9 +613,9 @@ def main():
                     with st.spinner("Testing API connection..."):
                         try:
                             # Test the API key
-                            test_client = Anthropic(api_key=api_key)
+                            test_client = get_anthropic_client(api_key)
                             test_message = test_client.messages.create(
-                                model="claude-3-5-sonnet-20241022",
+                                model=CLAUDE_MODEL,
                                 max_tokens=10,
                                 messages=[{"role": "user", "content": "Hello"}]
                             )
@@ -806,9 +671,9 @@ def main():
         # Drug input options
         input_method = st.radio(
             "Input Method",
-            ["Type compound name", "Select from database"],
+            ["Type compound name", "Select from database", "Portfolio"],
             horizontal=True,
-            help="Choose how to enter the drug compound"
+            help="Choose how to enter the drug compound, or scan a whole portfolio of compounds at once"
         )
         
         if input_method == "Type compound name":
@@ -846,7 +711,7 @@ def main():
                                 st.session_state.compound_input = suggestion
                                 st.rerun()
         
-        else:  # Select from database
+        elif input_method == "Select from database":
             compound_name = st.selectbox(
                 "Select Drug Compound",
                 options=[""] + sorted(DRUG_DATABASE),
@@ -855,6 +720,29 @@ def main():
                 key="compound_selectbox"
             )
         
+        else:  # Portfolio of compounds
+            portfolio_compounds = st.multiselect(
+                "Portfolio Compounds",
+                options=sorted(DRUG_DATABASE),
+                help="Compounds scanned together through one shared PubMed and Claude scheduler",
+                key="portfolio_compounds"
+            )
+            portfolio_file = st.file_uploader(
+                "Or upload a compound list",
+                type=["txt", "csv"],
+                help="One compound name per line",
+                key="portfolio_file"
+            )
+            if portfolio_file is not None:
+                portfolio_compounds = portfolio_compounds + read_compound_list(portfolio_file.getvalue().decode('utf-8', errors='replace'))
+            compounds = list(dict.fromkeys(portfolio_compounds))
+            compound_name = compounds[0] if len(compounds) == 1 else (f"Portfolio ({len(compounds)} compounds)" if compounds else "")
+            if compounds:
+                st.caption(f"{len(compounds)} compounds selected")
+        
+        if input_method != "Portfolio":
+            compounds = [compound_name] if compound_name else []
+        
         therapeutic_area = st.selectbox(
             "Therapeutic Area",
             ["Oncology", "Cardiovascular", "Neuroscience", "Immunology", "Metabolic", "Other"]
@@ -877,6 +765,42 @@ def main():
             help="Only analyze papers published within this many years (e.g., 25 = papers from 2000 onwards)"
         )
         
+        max_in_flight = st.slider(
+            "Concurrent Claude Requests",
+            min_value=1,
+            max_value=10,
+            value=DEFAULT_MAX_IN_FLIGHT,
+            help="Number of papers analyzed in parallel; requests are paced by the API's rate-limit headers"
+        )
+        
+        structured_output = st.checkbox(
+            "Structured output (tool use)",
+            value=True,
+            help="Have Claude return a schema-validated record; malformed replies are re-asked only for the missing fields"
+        )
+        output_mode = OUTPUT_MODE_TOOL if structured_output else OUTPUT_MODE_TEXT
+        
+        abstracts_per_request = st.slider(
+            "Abstracts per Claude Request",
+            min_value=1,
+            max_value=MAX_ABSTRACTS_PER_REQUEST,
+            value=DEFAULT_ABSTRACTS_PER_REQUEST,
+            disabled=structured_output,
+            help="Pack several abstracts into one request to share the instruction prompt; short abstracts are grouped more densely (text output only)"
+        )
+        
+        use_analysis_cache = st.checkbox(
+            "Reuse cached analyses",
+            value=True,
+            help="Skip Claude for papers already analyzed for this compound with the current prompt and model"
+        )
+        
+        incremental_scan = st.checkbox(
+            "Only new papers since last scan",
+            value=False,
+            help="Search only papers added to PubMed since each compound's last incremental scan and show them together with the stored earlier results. A compound's first incremental scan only analyzes its newest papers, up to Maximum Papers to Analyze"
+        )
+        
         # Search and Clear buttons with matching styling
         search_button = st.button("🔍 Search & Analyze Literature", type="primary", use_container_width=True)
         clear_button = st.button("🗑️ Clear Results or Stop Scan", type="secondary", use_container_width=True)
@@ -890,6 +814,9 @@ def main():
             st.success("✅ Results cleared! Ready for new search.")
             st.rerun()
         
+        render_bulk_scan_panel(max_years_back)
+        render_scan_history_panel()
+        
         st.markdown("---")
         st.markdown("**About PaperSafe AI**")
         st.markdown("Your safety net for scientific literature")
@@ -934,82 +861,132 @@ def main():
             progress_bar = st.progress(0)
             
             # Create columns for live status - single line metrics
-            status_col1, status_col2, status_col3 = st.columns(3)
+            status_col1, status_col2, status_col3, status_col4 = st.columns(4)
             
             # Initialize metric placeholders
             papers_found_placeholder = status_col1.empty()
             papers_analyzed_placeholder = status_col2.empty()
             claude_responses_placeholder = status_col3.empty()
+            cache_hits_placeholder = status_col4.empty()
             
             # Initial state
             papers_found_placeholder.metric("Papers Found", 0)
             papers_analyzed_placeholder.metric("Papers Analyzed", 0)
             claude_responses_placeholder.metric("Claude Responses", 0)
+            cache_hits_placeholder.metric("Cache Hits", 0)
+            prompt_cache_placeholder = st.empty()
+            live_risk_placeholder = st.empty()
+        
+        # Fetch, analyze and parse as a pipeline - analysis starts with the first paper retrieved
+        article_store = PubMedArticleStore()
+        analysis_cache = AnalysisCache() if use_analysis_cache else None
+        surveillance_store = SurveillanceStore() if incremental_scan else None
+        claude_usage = ClaudeUsageTracker()
+        found_pmids = []
+        analyzed_papers = AnalysisResultIndex()
+        safety_aggregate = SafetyAggregate()
+        papers_completed = 0
+        claude_responses = 0
+        cache_hits = 0
         
-        # Search PubMed
-        papers = search_pubmed(compound_name, max_papers, therapeutic_area, max_years_back)
+        found_by_compound = {}
         
-        if not papers:
+        scan_options = dict(
+            max_results=max_papers, therapeutic_area=therapeutic_area,
+            max_in_flight=max_in_flight, cache=analysis_cache, article_store=article_store,
+            abstracts_per_request=abstracts_per_request, usage=claude_usage, output_mode=output_mode,
+            eutils=get_eutils_client(), rate_limiter=get_claude_rate_limiter()
+        )
+        scan_events = None
+        try:
+            if surveillance_store is not None:
+                scan_events = run_incremental_scan(compounds, anthropic_client, surveillance_store, initial_years_back=max_years_back, **scan_options)
+            else:
+                scan_events = run_portfolio_scan(compounds, anthropic_client, max_years_back=max_years_back, **scan_options)
+            
+            # Every compound shares one scheduler, so a portfolio runs at the APIs' rate limits
+            for event, payload in scan_events:
+                if event == 'notice':
+                    streamlit_notify(*payload)
+                elif event == 'error':
+                    report_pubmed_error(payload[1], streamlit_notify)
+                elif event == 'found':
+                    found_by_compound[payload[0]] = payload[1]
+                    found_pmids = [pmid for compound in compounds for pmid in found_by_compound.get(compound, [])]
+                    papers_found_placeholder.metric("Papers Found", len(found_pmids))
+                    progress_bar.progress(5)
+                elif event == 'analyzed':
+                    paper, source = payload
+                    safety_aggregate.add(paper)
+                    if not analyzed_papers.add(paper):
+                        # PubMed returned the same article twice; the entry was replaced, not counted again
+                        continue
+                    
+                    # Update progress and live metrics as each result completes
+                    papers_completed += 1
+                    if source == 'claude':
+                        claude_responses += 1
+                    elif source == 'cache':
+                        cache_hits += 1
+                    progress_bar.progress(5 + int((papers_completed / max(len(found_pmids), 1)) * 95))
+                    papers_analyzed_placeholder.metric("Papers Analyzed", papers_completed)
+                    claude_responses_placeholder.metric("Claude Responses", claude_responses)
+                    cache_hits_placeholder.metric("Cache Hits", cache_hits, delta=f"{papers_completed - cache_hits} new", delta_color="off")
+                    usage_totals = claude_usage.snapshot()
+                    prompt_cache_placeholder.caption(
+                        f"🧠 Prompt cache: {usage_totals['cache_read_input_tokens']:,} tokens read, "
+                        f"{usage_totals['cache_creation_input_tokens']:,} written, "
+                        f"{usage_totals['input_tokens']:,} uncached input tokens"
+                    )
+                    live_risk = safety_aggregate.summary()
+                    live_risk_placeholder.caption(
+                        f"🔴 {live_risk['high_risk']} high · 🟡 {live_risk['medium_risk']} medium · 🟢 {live_risk['low_risk']} low risk · "
+                        f"{live_risk['fda_reporting']} needing FDA reporting so far"
+                    )
+            
+            if surveillance_store is not None:
+                # Show the new papers first, then everything stored by earlier incremental scans
+                new_papers_count = len(analyzed_papers)
+                # (reorder() below keeps PMIDs not found in this run after the new ones)
+                for paper in surveillance_store.results(compounds):
+                    analyzed_papers.add(paper)
+                    safety_aggregate.add(paper)
+                st.info(f"🆕 {new_papers_count} new papers since the last scan; {len(analyzed_papers) - new_papers_count} earlier results loaded from the surveillance store")
+        finally:
+            # Stop the scan's worker threads before closing the stores they use
+            if scan_events is not None:
+                scan_events.close()
+            article_store.close()
+            if analysis_cache is not None:
+                analysis_cache.close()
+            if surveillance_store is not None:
+                surveillance_store.close()
+        
+        if not analyzed_papers:
             st.warning(f"No papers found for compound '{compound_name}'. Try expanding the date range or different search terms.")
             return
         
-        # Debug info to verify paper count
-        st.info(f"🔍 PubMed returned {len(papers)} papers (requested: {max_papers})")
-        
-        # Trim to exactly the requested number if needed
-        if len(papers) > max_papers:
-            papers = papers[:max_papers]
-            st.warning(f"⚠️ Trimmed to exactly {max_papers} papers as requested")
-        
-        # Update papers found count
-        papers_found_placeholder.metric("Papers Found", len(papers))
-        
-        progress_bar.progress(25)
-        
-        # Analyze papers with Claude - Clean progress display
-        analyzed_papers = []
-        total_papers = len(papers)
-        claude_responses = 0
-        
-        for i, paper in enumerate(papers):
-            # Update progress
-            progress_percentage = 25 + int((i / total_papers) * 75)
-            progress_bar.progress(progress_percentage)
-            
-            # Update live metrics - single line updates
-            papers_analyzed_placeholder.metric("Papers Analyzed", i + 1)
-            
-            # Analyze with Claude
-            analysis_text = analyze_with_claude(paper, compound_name, anthropic_client)
-            analysis_data = parse_claude_analysis(analysis_text)
-            
-            # Update Claude responses count
-            claude_responses += 1
-            claude_responses_placeholder.metric("Claude Responses", claude_responses)
-            
-            paper['analysis'] = analysis_data
-            analyzed_papers.append(paper)
-            
-            # Small delay to prevent API rate limiting
-            time.sleep(0.5)
-            
-            paper['analysis'] = analysis_data
-            analyzed_papers.append(paper)
-            
-            # Small delay to prevent API rate limiting
-            time.sleep(0.5)
+        # Keep the PubMed (publication date) ordering for display
+        analyzed_papers.reorder([(compound, pmid) for compound in compounds for pmid in found_by_compound.get(compound, [])])
+        total_papers = len(analyzed_papers)
         
         progress_bar.progress(100)
         
         # Final success message with verification
-        st.success(f"✅ Analysis complete! Processed **{len(analyzed_papers)}** papers with {claude_responses} AI responses.")
+        st.success(f"✅ Analysis complete! Processed **{len(analyzed_papers)}** papers with {claude_responses} AI responses and {cache_hits} cache hits ({total_papers - cache_hits} cache misses).")
         
         # Verification check
-        if len(analyzed_papers) != max_papers:
-            st.info(f"📊 Note: Analyzed {len(analyzed_papers)} papers (you requested {max_papers}). This may be due to PubMed returning fewer results or parsing issues.")
+        if len(analyzed_papers) != max_papers * len(compounds):
+            st.info(f"📊 Note: Analyzed {len(analyzed_papers)} papers (you requested {max_papers * len(compounds)}). This may be due to PubMed returning fewer results or parsing issues.")
         
         # Store results in session state
-        st.session_state.search_results = analyzed_papers
+        store_search_results(analyzed_papers.papers(), safety_aggregate)
+        
+        # Keep the completed scan in the local history so it survives refreshes and new searches
+        get_scan_history_store().save_scan(st.session_state.search_results, settings={
+            'therapeutic_area': therapeutic_area, 'max_papers': max_papers, 'max_years_back': max_years_back,
+            'output_mode': output_mode, 'incremental': incremental_scan
+        })
         st.session_state.analysis_complete = True
         
         # Clear progress indicators after a moment
@@ -1018,7 +995,7 @@ def main():
     
     # Display results if analysis is complete
     if st.session_state.analysis_complete and st.session_state.search_results:
-        # Use the actual current search results
+        # Stored results are already one entry per unique PMID
         current_analyzed_papers = st.session_state.search_results
         
         # Debug verification 
@@ -1043,20 +1020,21 @@ def main():
         # Key metrics with enhanced risk details
         col1, col2, col3, col4 = st.columns(4)
         
-        high_risk_count = sum(1 for p in current_analyzed_papers if p.get('analysis', {}).get('risk_level') == 'HIGH')
-        medium_risk_count = sum(1 for p in current_analyzed_papers if p.get('analysis', {}).get('risk_level') == 'MEDIUM')
-        total_papers = len(current_analyzed_papers)  # Use current papers count
+        # All summary metrics come from one columnar table of the analyzed papers, cached per result set
+        analysis_table = cached_analysis_table(st.session_state.results_key, current_analyzed_papers)
+        aggregate = st.session_state.safety_aggregate
+        summary = aggregate.summary()
+        high_risk_count = summary['high_risk']
+        medium_risk_count = summary['medium_risk']
+        total_papers = summary['total_papers']
         
-        # Calculate total safety signals across all papers
-        total_adverse_events = sum(p.get('analysis', {}).get('adverse_events_count', 0) for p in current_analyzed_papers)
-        total_interactions = sum(p.get('analysis', {}).get('drug_interactions_count', 0) for p in current_analyzed_papers)
-        total_contraindications = sum(p.get('analysis', {}).get('contraindications_count', 0) for p in current_analyzed_papers)
+        # Total safety signals across all papers
+        total_adverse_events = summary['adverse_events']
+        total_interactions = summary['drug_interactions']
+        total_contraindications = summary['contraindications']
         
         # Count papers requiring FDA reporting (based on high risk or specific regulatory mentions)
-        fda_reporting_count = sum(1 for p in current_analyzed_papers 
-                                 if p.get('analysis', {}).get('risk_level') == 'HIGH' 
-                                 or 'fda' in p.get('analysis', {}).get('regulatory_impact', '').lower() 
-                                 or 'reporting' in p.get('analysis', {}).get('regulatory_impact', '').lower())
+        fda_reporting_count = summary['fda_reporting']
         
         with col1:
             st.metric("Papers Analyzed", total_papers, 
@@ -1079,154 +1057,96 @@ def main():
         with col7:
             st.metric("Contraindications", total_contraindications)
         with col8:
-            total_safety_signals = total_adverse_events + total_interactions + total_contraindications
-            st.metric("Total Safety Signals", total_safety_signals)
+            st.metric("Total Safety Signals", summary['total_safety_signals'])
+        
+        # Portfolio scans get one combined row per compound
+        if aggregate.compound_count() > 1:
+            st.subheader("🧪 Portfolio Summary by Compound")
+            st.dataframe(aggregate.compound_summary(), use_container_width=True)
         
         # Safety Dashboard
         st.header("📈 Safety Signal Dashboard")
-        create_safety_dashboard(current_analyzed_papers)
+        create_safety_dashboard(aggregate)
         
         # Detailed Paper Analysis
         st.header("📋 Detailed Paper Analysis")
         
-        # Filter options
-        risk_filter = st.selectbox(
-            "Filter by Risk Level",
-            ["All", "HIGH", "MEDIUM", "LOW"],
-            key="risk_filter"
+        # Filter, search and sort on the analysis table; only one page of rows reaches the browser
+        filter_col, domain_col, search_col, sort_col, size_col = st.columns([1, 2, 2, 1, 1])
+        with filter_col:
+            risk_filter = st.selectbox(
+                "Filter by Risk Level",
+                ["All", "HIGH", "MEDIUM", "LOW"],
+                key="risk_filter",
+                on_change=reset_detail_page
+            )
+        with domain_col:
+            domain_filter = st.multiselect(
+                "Safety Domains",
+                SAFETY_DOMAIN_CHOICES,
+                key="detail_domains",
+                on_change=reset_detail_page
+            )
+        with search_col:
+            detail_query = st.text_input(
+                "Search papers",
+                placeholder="Title, author, compound, PMID, signal or domain...",
+                key="detail_query",
+                on_change=reset_detail_page
+            )
+        with sort_col:
+            sort_by = st.selectbox("Sort by", DETAIL_SORT_OPTIONS, key="detail_sort", on_change=reset_detail_page)
+        with size_col:
+            page_size = st.selectbox("Papers per page", DETAIL_PAGE_SIZES, index=1, key="detail_page_size", on_change=reset_detail_page)
+        
+        filtered_rows = select_detail_rows(
+            analysis_table, detail_search_text(st.session_state.results_key, analysis_table),
+            risk_filter, detail_query, sort_by, domain_filter
+        )
+        page_count = max(1, -(-len(filtered_rows) // page_size))
+        if st.session_state.get('detail_page', 1) > page_count or st.session_state.get('detail_results_key') != st.session_state.results_key:
+            st.session_state.detail_page = 1
+            st.session_state.detail_results_key = st.session_state.results_key
+        
+        page_col, count_col = st.columns([1, 4])
+        with page_col:
+            page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key="detail_page")
+        page_rows = filtered_rows[(page - 1) * page_size:page * page_size]
+        with count_col:
+            st.caption(f"Showing {len(page_rows)} of {len(filtered_rows)} matching papers (page {page} of {page_count})")
+        
+        page_table = analysis_table.iloc[page_rows]
+        # The table's key names the exact rows it shows, so a search, filter, sort or page
+        # change starts a fresh selection instead of carrying a row index over to other papers
+        page_rows_key = hashlib.sha1(np.asarray(page_rows, dtype=np.int64).tobytes()).hexdigest()[:16]
+        selection = st.dataframe(
+            pd.DataFrame({
+                'Risk': page_table['risk_level'].map(lambda level: f"{RISK_ICONS.get(level, '⚪')} {level}"),
+                'Title': page_table['title'],
+                'Compound': page_table['compound'],
+                'Published': page_table['pub_date'],
+                'Signals': page_table['total_safety_signals'],
+                'Serious Terms': page_table['serious_terms_count'],
+                'PubMed': page_table['url']
+            }),
+            column_config={'PubMed': st.column_config.LinkColumn("PubMed", display_text="Open")},
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key=f"detail_table_{st.session_state.results_key}_{page_rows_key}"
         )
         
-        # Filter papers based on selection - use current papers
-        filtered_papers = current_analyzed_papers
-        if risk_filter != "All":
-            filtered_papers = [p for p in current_analyzed_papers 
-                             if p.get('analysis', {}).get('risk_level') == risk_filter]
-        
-        # Display filtered papers
-        for i, paper in enumerate(filtered_papers):
-            analysis = paper.get('analysis', {})
-            risk_level = analysis.get('risk_level', 'UNKNOWN')
-            
-            # Choose styling based on risk level
-            if risk_level == 'HIGH':
-                card_class = "safety-signal-high"
-                risk_color = "🔴"
-            elif risk_level == 'MEDIUM':
-                card_class = "safety-signal-medium"
-                risk_color = "🟡"
-            elif risk_level == 'LOW':
-                card_class = "safety-signal-low"  
-                risk_color = "🟢"
-            else:
-                card_class = "safety-signal-low"
-                risk_color = "⚪"
-            
-            with st.expander(f"{risk_color} {paper['title'][:100]}... - Risk: {risk_level}"):
-                col1, col2 = st.columns([2, 1])
-                
-                with col1:
-                    st.markdown(f"**Authors:** {paper['authors']}")
-                    st.markdown(f"**Publication Date:** {paper['pub_date']}")
-                    st.markdown(f"**PMID:** [{paper['pmid']}]({paper['url']})")
-                    
-                    st.markdown("**Abstract:**")
-                    st.markdown(paper['abstract'][:500] + "..." if len(paper['abstract']) > 500 else paper['abstract'])
-                
-                with col2:
-                    st.markdown(f"**Risk Level:** {risk_color} {risk_level}")
-                    
-                    # Show detailed risk breakdown
-                    if analysis.get('risk_rationale'):
-                        st.markdown("**Risk Assessment:**")
-                        st.caption(analysis['risk_rationale'])
-                    
-                    # Safety signal counts
-                    ae_count = analysis.get('adverse_events_count', 0)
-                    interaction_count = analysis.get('drug_interactions_count', 0)
-                    contraindication_count = analysis.get('contraindications_count', 0)
-                    
-                    if ae_count > 0 or interaction_count > 0 or contraindication_count > 0:
-                        st.markdown("**Safety Signal Counts:**")
-                        if ae_count > 0:
-                            st.markdown(f"• **{ae_count}** Adverse Events")
-                        if interaction_count > 0:
-                            st.markdown(f"• **{interaction_count}** Drug Interactions")
-                        if contraindication_count > 0:
-                            st.markdown(f"• **{contraindication_count}** Contraindications")
-                    
-                    # Show specific adverse events if available
-                    if analysis.get('adverse_events') and len(analysis['adverse_events']) > 0:
-                        st.markdown("**Adverse Events:**")
-                        for event in analysis['adverse_events'][:3]:  # Show first 3
-                            if event.strip():
-                                st.markdown(f"• {event}")
-                    
-                    # Show drug interactions if available
-                    if analysis.get('drug_interactions') and len(analysis['drug_interactions']) > 0:
-                        st.markdown("**Drug Interactions:**")
-                        for interaction in analysis['drug_interactions'][:2]:  # Show first 2
-                            if interaction.strip():
-                                st.markdown(f"• {interaction}")
-                    
-                    # Show contraindications if available
-                    if analysis.get('contraindications') and len(analysis['contraindications']) > 0:
-                        st.markdown("**Contraindications:**")
-                        for contraindication in analysis['contraindications'][:2]:  # Show first 2
-                            if contraindication.strip():
-                                st.markdown(f"• {contraindication}")
-                    
-                    # Show safety domains
-                    if analysis.get('safety_domains'):
-                        st.markdown("**Safety Domains:**")
-                        for domain in analysis['safety_domains'][:3]:  # Show first 3
-                            if domain.strip():
-                                st.markdown(f"• {domain}")
-                
-                # Full analysis details
-                with st.expander("View Full AI Analysis & Risk Calculation"):
-                    # Risk calculation details
-                    st.markdown("### 🎯 Risk Assessment Details")
-                    col_a, col_b, col_c = st.columns(3)
-                    with col_a:
-                        st.metric("Adverse Events", analysis.get('adverse_events_count', 0))
-                    with col_b:
-                        st.metric("Drug Interactions", analysis.get('drug_interactions_count', 0))
-                    with col_c:
-                        st.metric("Contraindications", analysis.get('contraindications_count', 0))
-                    
-                    st.markdown(f"**Risk Rationale:** {analysis.get('risk_rationale', 'Not available')}")
-                    
-                    # Show all identified safety signals
-                    if analysis.get('adverse_events'):
-                        st.markdown("**All Adverse Events Identified:**")
-                        for i, event in enumerate(analysis['adverse_events'], 1):
-                            if event.strip():
-                                st.markdown(f"{i}. {event}")
-                    
-                    if analysis.get('drug_interactions'):
-                        st.markdown("**All Drug Interactions Identified:**")
-                        for i, interaction in enumerate(analysis['drug_interactions'], 1):
-                            if interaction.strip():
-                                st.markdown(f"{i}. {interaction}")
-                    
-                    if analysis.get('contraindications'):
-                        st.markdown("**All Contraindications Identified:**")
-                        for i, contraindication in enumerate(analysis['contraindications'], 1):
-                            if contraindication.strip():
-                                st.markdown(f"{i}. {contraindication}")
-                    
-                    st.markdown("### 📋 Key Findings")
-                    for finding in analysis.get('key_findings', []):
-                        if finding.strip():
-                            st.markdown(f"• {finding}")
-                    
-                    st.markdown("### 🏛️ Regulatory Impact")
-                    st.markdown(analysis.get('regulatory_impact', 'Not specified'))
-                    
-                    st.markdown("### 🤖 Complete AI Analysis")
-                    with st.expander("Show Raw Analysis Text"):
-                        st.text(analysis.get('full_analysis', 'No analysis available'))
+        # Full analysis text is only rendered for the selected paper
+        selected = selection.selection.rows
+        if selected and 0 <= selected[0] < len(page_rows):
+            row = page_rows[selected[0]]
+            with st.container(border=True):
+                render_paper_details(current_analyzed_papers[row], analysis_table['risk_level'].iat[row])
+        else:
+            st.caption("Select a row to open the full analysis for that paper")
         
+
         # Export functionality
         st.header("📤 Export Results")
         
@@ -1238,7 +1158,7 @@ def main():
                 report_data = {
                     'compound': compound_name,
                     'analysis_date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    'total_papers': len(current_analyzed_papers),
+                    'total_papers': total_papers,
                     'high_risk': high_risk_count,
                     'medium_risk': medium_risk_count,
                     'fda_reporting': fda_reporting_count
@@ -1248,33 +1168,36 @@ def main():
                 st.json(report_data)
         
         with col2:
-            # Download data as CSV
-            if st.button("💾 Download CSV Data"):
-                # Prepare data for CSV
-                csv_data = []
-                for paper in current_analyzed_papers:
-                    analysis = paper.get('analysis', {})
-                    csv_data.append({
-                        'PMID': paper['pmid'],
-                        'Title': paper['title'],
-                        'Authors': paper['authors'],
-                        'Publication_Date': paper['pub_date'],
-                        'Risk_Level': analysis.get('risk_level', ''),
-                        'Safety_Signals': '; '.join(analysis.get('safety_signals', [])),
-                        'Safety_Domains': '; '.join(analysis.get('safety_domains', [])),
-                        'Regulatory_Impact': analysis.get('regulatory_impact', ''),
-                        'URL': paper['url']
-                    })
-                
-                df = pd.DataFrame(csv_data)
-                csv = df.to_csv(index=False)
-                
-                st.download_button(
-                    label="Download Analysis Results",
-                    data=csv,
-                    file_name=f"papersafe_analysis_{compound_name}_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime="text/csv"
-                )
+            # Full typed export, streamed to a file on disk chunk by chunk and served from there
+            export_format = st.selectbox(
+                "Export Format",
+                list(EXPORT_FORMATS),
+                format_func=lambda export_format: EXPORT_FORMATS[export_format][0],
+                help="Every analysis field, signal list, domain and the raw analysis text; Parquet and Arrow keep the column types",
+                key="export_format"
+            )
+            format_label, extension, mime = EXPORT_FORMATS[export_format]
+            # The file is only written when asked for, not on every rerun
+            if st.button(f"📦 Prepare {format_label} Export"):
+                try:
+                    with st.spinner(f"Writing {format_label} export..."):
+                        export_path = write_export_file(st.session_state.results_key, export_format, current_analyzed_papers, analysis_table)
+                    st.session_state.export_file = (st.session_state.results_key, export_format, export_path)
+                except ImportError as e:
+                    st.error(f"{format_label} export needs pyarrow installed ({e})")
+            
+            prepared = st.session_state.get('export_file')
+            if prepared and prepared[:2] == (st.session_state.results_key, export_format) and os.path.exists(prepared[2]):
+                export_path = prepared[2]
+                # Keep this session's exports from being pruned as abandoned
+                session_export_dir()
+                with open(export_path, 'rb') as export_handle:
+                    st.download_button(
+                        label=f"💾 Download {format_label} ({os.path.getsize(export_path) / 1e6:.1f} MB)",
+                        data=export_handle,
+                        file_name=f"papersafe_analysis_{compound_name}_{datetime.now().strftime('%Y%m%d')}{extension}",
+                        mime=mime
+                    )
     
     # Footer
     st.markdown("---")
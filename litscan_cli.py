@@ -0,0 +1,114 @@
+"""Headless PaperSafe AI scan: search PubMed, analyze with Claude and write the results table.
+
+Example:
+    ANTHROPIC_API_KEY=... python litscan_cli.py Humira Keytruda --max-results 50 -o scan.parquet
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import litscan_core as core
+
+def write_results(papers, table, output_path, output_format=None):
+    """Write the full analysis export (format chosen by extension unless given)"""
+    try:
+        return core.write_analysis_export(papers, table, output_path, output_format)
+    except ImportError as e:
+        raise SystemExit(f"{output_format or core.export_format_for_path(output_path)} output needs pyarrow installed ({e}); use a .csv or .jsonl output instead")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scan PubMed literature for drug safety signals with Claude")
+    parser.add_argument("compounds", nargs="*", help="Compound names to scan")
+    parser.add_argument("--compounds-file", help="File with one compound name per line")
+    parser.add_argument("-o", "--output", required=True, help="Output file (.parquet, .arrow, .csv or .jsonl)")
+    parser.add_argument("--format", choices=list(core.EXPORT_FORMATS), help="Output format (default: from the output extension)")
+    parser.add_argument("--max-results", type=int, default=20, help="Papers to analyze per compound")
+    parser.add_argument("--years-back", type=int, default=25, help="Only papers published within this many years")
+    parser.add_argument("--therapeutic-area", choices=["Oncology", "Cardiovascular", "Neuroscience", "Immunology", "Metabolic", "Other"])
+    parser.add_argument("--max-in-flight", type=int, default=core.DEFAULT_MAX_IN_FLIGHT, help="Concurrent Claude requests")
+    parser.add_argument("--abstracts-per-request", type=int, default=core.DEFAULT_ABSTRACTS_PER_REQUEST, help="Abstracts packed per Claude request (text output only)")
+    parser.add_argument("--text-output", action="store_true", help="Use the free-text analysis format instead of structured tool use")
+    parser.add_argument("--no-cache", action="store_true", help="Do not reuse or store cached analyses")
+    parser.add_argument("--incremental", action="store_true", help="Only analyze papers added to PubMed since each compound's last incremental run; the output holds the full stored result set")
+    parser.add_argument("--full-backfill", action="store_true", help="With --incremental, analyze every paper of a compound's first run instead of the newest --max-results (can be thousands of Claude requests)")
+    parser.add_argument("--no-history", action="store_true", help="Do not save this scan to the local scan history")
+    parser.add_argument("--quiet", action="store_true", help="Only log warnings and errors")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format="%(asctime)s %(message)s")
+    
+    compounds = list(args.compounds)
+    if args.compounds_file:
+        with open(args.compounds_file, encoding='utf-8') as handle:
+            compounds.extend(core.read_compound_list(handle.read()))
+    if not compounds:
+        raise SystemExit("No compounds given")
+    
+    api_key = os.environ.get("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise SystemExit("ANTHROPIC_API_KEY is not set")
+    
+    # Imported here so --help and argument errors stay fast
+    from anthropic import Anthropic
+    anthropic_client = Anthropic(api_key=api_key)
+    
+    article_store = core.PubMedArticleStore()
+    analysis_cache = None if args.no_cache else core.AnalysisCache()
+    surveillance_store = core.SurveillanceStore() if args.incremental else None
+    analyzed_count = [0]
+    
+    def progress(event, payload):
+        if event == 'found':
+            core.logger.info(f"{payload[0]}: {len(payload[1])} papers found")
+        elif event == 'analyzed':
+            analyzed_count[0] += 1
+            paper, source = payload
+            core.logger.info(f"[{analyzed_count[0]}] {paper['compound']} PMID {paper['pmid']}: {paper['analysis']['risk_level']} ({source})")
+    
+    scan_options = {'full_backfill': args.full_backfill} if args.incremental else {}
+    
+    started = time.monotonic()
+    try:
+        papers = core.scan_compounds(
+            compounds, anthropic_client, progress=progress, surveillance_store=surveillance_store,
+            max_results=args.max_results, therapeutic_area=args.therapeutic_area, max_years_back=args.years_back,
+            max_in_flight=args.max_in_flight, cache=analysis_cache, article_store=article_store,
+            abstracts_per_request=args.abstracts_per_request,
+            output_mode=core.OUTPUT_MODE_TEXT if args.text_output else core.OUTPUT_MODE_TOOL,
+            **scan_options
+        )
+        if surveillance_store is not None:
+            core.logger.info(f"{len(papers)} new papers analyzed")
+            papers = surveillance_store.results(compounds)
+    finally:
+        article_store.close()
+        if analysis_cache is not None:
+            analysis_cache.close()
+        if surveillance_store is not None:
+            surveillance_store.close()
+    
+    if not args.no_history and papers:
+        history_store = core.ScanHistoryStore()
+        try:
+            scan_id = history_store.save_scan(papers, settings={
+                'therapeutic_area': args.therapeutic_area, 'max_papers': args.max_results, 'max_years_back': args.years_back,
+                'output_mode': core.OUTPUT_MODE_TEXT if args.text_output else core.OUTPUT_MODE_TOOL, 'incremental': args.incremental
+            })
+        finally:
+            history_store.close()
+        core.logger.info(f"Saved to scan history as scan {scan_id}")
+    
+    table = core.build_analysis_table(papers)
+    output_format = write_results(papers, table, args.output, args.format)
+    summary = core.summarize_analysis_table(table)
+    core.logger.info(
+        f"Wrote {summary['total_papers']} papers to {args.output} ({output_format}) in {time.monotonic() - started:.1f}s: "
+        f"{summary['high_risk']} high, {summary['medium_risk']} medium risk, {summary['fda_reporting']} needing FDA reporting"
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
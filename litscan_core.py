@@ -0,0 +1,3107 @@
+"""PaperSafe AI scan core: PubMed search, Claude analysis and risk scoring without a UI.
+
+Everything here is importable without Streamlit or plotly, so scheduled scans and worker
+processes can use it directly (see litscan_cli.py). Status messages go through
+notify(level, message) callbacks and scan events through progress(event, payload).
+"""
+import requests
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+import pandas as pd
+import numpy as np
+import time
+import threading
+import queue
+import os
+import random
+import sqlite3
+import hashlib
+import json
+import logging
+import functools
+from typing import List, NamedTuple
+from collections import deque
+from array import array
+import bisect
+import heapq
+
+logger = logging.getLogger("papersafe")
+
+# Drug database from uploaded Excel file
+DRUG_DATABASE = [
+    "ABRILADA", "ACETAMINOPHEN, DEXTROMETHORPHAN HBr", "ACETAMINOPHEN, DEXTROMETHORPHAN HBr, PHENYLEPHRINE HCl",
+    "ACETAMINOPHEN, DEXTROMETHORPHAN, PHENYLEPHRINE", "ACETAMINOPHEN, DIPHENHYDRAMINE HCL, PHENYLEPHRINE HCL",
+    "ACULAR LS", "ACUVAIL", "ACZONE", "ADMELOG", "ALOCRIL", "ALPHAGAN P", "AMG 193", "ANTIVENIN", 
+    "ARTHROTEC", "ATAZANAVIR", "AZACTAM", "AZTREONAM", "Acarbose", "Acetaminophen", "Advair", "Advil",
+    "Amlodipine", "Amoxicillin", "Aspirin", "Atorvastatin", "Azithromycin", "Benadryl", "Celebrex",
+    "Crestor", "Cymbalta", "Diovan", "Enbrel", "Fosamax", "Humira", "Humulin", "Ibuprofen", "Insulin",
+    "Keytruda", "Lantus", "Lasix", "Lexapro", "Lipitor", "Lisinopril", "Lyrica", "Metformin", "Nexium",
+    "Norvasc", "OxyContin", "Ozempic", "Plavix", "Pradaxa", "Prednisone", "Prilosec", "Prozac",
+    "Repatha", "Rituxan", "Rybelsus", "Singulair", "Synthroid", "Trulicity", "Tylenol", "Vasotec",
+    "Viagra", "Vioxx", "Warfarin", "Xarelto", "Zantac", "Zepbound", "Zocor", "Zoloft", "Zyprexa",
+    "adalimumab", "alemtuzumab", "bevacizumab", "cetuximab", "daratumumab", "evolocumab", "infliximab",
+    "ipilimumab", "natalizumab", "nivolumab", "obinutuzumab", "ofatumumab", "panitumumab", "pembrolizumab",
+    "pertuzumab", "ramucirumab", "rituximab", "secukinumab", "tocilizumab", "trastuzumab", "ustekinumab",
+    "vedolizumab", "tirzepatide", "semaglutide", "dulaglutide", "liraglutide", "exenatide", "insulin human",
+    "insulin aspart", "insulin glargine", "insulin detemir", "insulin lispro", "metformin", "sitagliptin",
+    "empagliflozin", "canagliflozin", "dapagliflozin", "ertugliflozin", "alogliptin", "linagliptin",
+    "saxagliptin", "vildagliptin", "acarbose", "miglitol", "nateglinide", "repaglinide", "rosiglitazone",
+    "pioglitazone", "glipizide", "glyburide", "glimepiride", "chlorpropamide", "tolbutamide", "tolazamide"
+]
+
+# Names that refer to the same compound: brand names, generic names and development codes
+DRUG_SYNONYM_GROUPS = [
+    ("Humira", "adalimumab", "ABRILADA", "D2E7"),
+    ("Keytruda", "pembrolizumab", "MK-3475"),
+    ("Opdivo", "nivolumab", "BMS-936558"),
+    ("Yervoy", "ipilimumab", "MDX-010"),
+    ("Repatha", "evolocumab", "AMG 145"),
+    ("Enbrel", "etanercept"),
+    ("Remicade", "infliximab"),
+    ("Rituxan", "rituximab"),
+    ("Herceptin", "trastuzumab"),
+    ("Avastin", "bevacizumab"),
+    ("Erbitux", "cetuximab"),
+    ("Vectibix", "panitumumab"),
+    ("Perjeta", "pertuzumab"),
+    ("Cyramza", "ramucirumab"),
+    ("Gazyva", "obinutuzumab"),
+    ("Darzalex", "daratumumab"),
+    ("Lemtrada", "Campath", "alemtuzumab"),
+    ("Kesimpta", "Arzerra", "ofatumumab"),
+    ("Tysabri", "natalizumab"),
+    ("Actemra", "tocilizumab"),
+    ("Cosentyx", "secukinumab"),
+    ("Stelara", "ustekinumab"),
+    ("Entyvio", "vedolizumab"),
+    ("Ozempic", "Rybelsus", "Wegovy", "semaglutide"),
+    ("Zepbound", "Mounjaro", "tirzepatide", "LY3298176"),
+    ("Trulicity", "dulaglutide"),
+    ("Victoza", "Saxenda", "liraglutide"),
+    ("Byetta", "Bydureon", "exenatide"),
+    ("Lantus", "insulin glargine"),
+    ("ADMELOG", "Humalog", "insulin lispro"),
+    ("Humulin", "insulin human"),
+    ("NovoLog", "insulin aspart"),
+    ("Levemir", "insulin detemir"),
+    ("Metformin", "Glucophage"),
+    ("Januvia", "sitagliptin"),
+    ("Jardiance", "empagliflozin"),
+    ("Invokana", "canagliflozin"),
+    ("Farxiga", "dapagliflozin"),
+    ("Steglatro", "ertugliflozin"),
+    ("Acarbose", "Precose"),
+    ("Actos", "pioglitazone"),
+    ("Avandia", "rosiglitazone"),
+    ("Tylenol", "Acetaminophen", "paracetamol"),
+    ("Advil", "Ibuprofen", "Motrin"),
+    ("Lipitor", "Atorvastatin"),
+    ("Crestor", "rosuvastatin"),
+    ("Zocor", "simvastatin"),
+    ("Norvasc", "Amlodipine"),
+    ("Plavix", "clopidogrel"),
+    ("Xarelto", "rivaroxaban"),
+    ("Pradaxa", "dabigatran"),
+    ("Warfarin", "Coumadin"),
+    ("Celebrex", "celecoxib"),
+    ("Vioxx", "rofecoxib"),
+    ("Cymbalta", "duloxetine"),
+    ("Lexapro", "escitalopram"),
+    ("Prozac", "fluoxetine"),
+    ("Zoloft", "sertraline"),
+    ("Zyprexa", "olanzapine"),
+    ("Lyrica", "pregabalin"),
+    ("Nexium", "esomeprazole"),
+    ("Prilosec", "omeprazole"),
+    ("Zantac", "ranitidine"),
+    ("Singulair", "montelukast"),
+    ("Synthroid", "levothyroxine"),
+    ("Vasotec", "enalapril"),
+    ("Lisinopril", "Zestril", "Prinivil"),
+    ("Diovan", "valsartan"),
+    ("Lasix", "furosemide"),
+    ("Fosamax", "alendronate"),
+    ("Viagra", "sildenafil"),
+    ("Benadryl", "diphenhydramine"),
+    ("OxyContin", "oxycodone"),
+    ("ACZONE", "dapsone"),
+    ("AZACTAM", "AZTREONAM"),
+    ("ACULAR LS", "ACUVAIL", "ketorolac"),
+    ("ALPHAGAN P", "brimonidine"),
+    ("ALOCRIL", "nedocromil"),
+    ("ATAZANAVIR", "Reyataz")
+]
+
+# Drug classes for scan-history queries; members are expanded to all their synonyms
+DRUG_CLASSES = {
+    "GLP-1 receptor agonist": ("Ozempic", "Zepbound", "Trulicity", "Victoza", "Byetta"),
+    "SGLT2 inhibitor": ("Jardiance", "Invokana", "Farxiga", "Steglatro"),
+    "DPP-4 inhibitor": ("Januvia",),
+    "Insulin": ("Insulin", "Lantus", "ADMELOG", "Humulin", "NovoLog", "Levemir"),
+    "TNF inhibitor": ("Humira", "Enbrel", "Remicade"),
+    "PD-1/CTLA-4 checkpoint inhibitor": ("Keytruda", "Opdivo", "Yervoy"),
+    "Statin": ("Lipitor", "Crestor", "Zocor"),
+    "PCSK9 inhibitor": ("Repatha",),
+    "Anticoagulant / antiplatelet": ("Xarelto", "Pradaxa", "Warfarin", "Plavix"),
+    "NSAID": ("Advil", "Aspirin", "Celebrex", "Vioxx", "ARTHROTEC"),
+    "Antidepressant": ("Lexapro", "Prozac", "Zoloft", "Cymbalta"),
+    "Proton pump inhibitor": ("Nexium", "Prilosec"),
+    "ACE inhibitor / ARB": ("Lisinopril", "Vasotec", "Diovan")
+}
+
+# Claude model and request pacing defaults
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+DEFAULT_CLAUDE_REQUESTS_PER_MINUTE = 50
+DEFAULT_MAX_IN_FLIGHT = 4
+
+# Multi-abstract requests: papers per request adapt to abstract length within these budgets
+DEFAULT_ABSTRACTS_PER_REQUEST = 1
+MAX_ABSTRACTS_PER_REQUEST = 8
+BATCH_INPUT_TOKEN_BUDGET = 12000
+BATCH_OUTPUT_TOKENS_PER_PAPER = 700
+CLAUDE_MAX_OUTPUT_TOKENS = 8192
+
+# Output modes: free-text sections, or a schema-validated tool call
+OUTPUT_MODE_TEXT = "text"
+OUTPUT_MODE_TOOL = "tool"
+ANALYSIS_REPAIR_ATTEMPTS = 2
+
+# Message Batches API limits for the offline bulk-scan mode
+BULK_MAX_REQUESTS_PER_BATCH = 10000
+BULK_PAPERS_PER_COMPOUND = 50
+
+# Portfolio scans: compounds searched concurrently (PubMed calls still share one NCBI rate limit)
+PORTFOLIO_FETCH_WORKERS = 3
+
+# Local storage for caches and stores (override with PAPERSAFE_DATA_DIR)
+PAPERSAFE_DATA_DIR = os.environ.get("PAPERSAFE_DATA_DIR", os.path.join(os.path.expanduser("~"), ".papersafe"))
+ANALYSIS_CACHE_TTL_DAYS = 90
+ANALYSIS_CACHE_MAX_ENTRIES = 50000
+
+# NCBI E-utilities (point PAPERSAFE_EUTILS_URL at a local stand-in server to replay recorded responses)
+EUTILS_BASE_URL = os.environ.get("PAPERSAFE_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/")
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY")
+EFETCH_MIN_BATCH = 50
+EFETCH_INITIAL_BATCH = 200
+EFETCH_MAX_BATCH = 500
+# Incremental searches page through their whole window; esearch returns at most this many ids per call
+ESEARCH_PAGE_SIZE = 10000
+# PubMed's esearch never returns ids past the first 10,000 hits, so larger windows are split by date
+ESEARCH_MAX_RESULTS = 10000
+
+# Optional file of extra serious-event terms (e.g. MedDRA preferred terms), one per line
+SERIOUS_TERMS_FILE = os.environ.get("PAPERSAFE_SERIOUS_TERMS_FILE")
+
+# Optional file of extra drug names for autocomplete (e.g. an Orange Book / RxNorm export), one per line
+DRUG_NAMES_FILE = os.environ.get("PAPERSAFE_DRUG_NAMES_FILE")
+
+# Optional file of extra synonym groups, one group per line with names separated by '|'
+DRUG_SYNONYMS_FILE = os.environ.get("PAPERSAFE_DRUG_SYNONYMS_FILE")
+DRUG_MAX_EDIT_DISTANCE = 2
+
+# Optional file of extra drug classes, one per line as "Class name: drug|drug|..."
+DRUG_CLASSES_FILE = os.environ.get("PAPERSAFE_DRUG_CLASSES_FILE")
+
+# notify() levels mirror Streamlit's message calls
+NOTIFY_LOG_LEVELS = {
+    'info': logging.INFO,
+    'success': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR
+}
+
+class DrugNameIndex:
+    """Autocomplete index over drug names: exact, prefix and substring lookups.
+
+    Names keep their list position as an id, so every tier returns matches in list
+    order exactly like a linear scan would. Prefixes are found by bisecting the sorted
+    lowercase names (a flattened trie), with the first ids of every one- and two-letter
+    prefix precomputed; substrings come from n-gram posting lists (up to trigrams).
+    """
+
+    NGRAM = 3
+    SHORT_PREFIX = 2
+    SHORT_PREFIX_KEEP = 64
+
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(name for name in names if name))
+        self._lower = [name.lower() for name in self.names]
+        
+        self._exact = {}
+        for name_id, name_lower in enumerate(self._lower):
+            self._exact.setdefault(name_lower, []).append(name_id)
+        
+        order = sorted(range(len(self._lower)), key=self._lower.__getitem__)
+        self._sorted_lower = [self._lower[name_id] for name_id in order]
+        self._sorted_ids = array('I', order)
+        
+        # First ids (in list order) for short prefixes, whose bisect ranges are the widest
+        self._short_prefixes = {}
+        for name_id, name_lower in enumerate(self._lower):
+            for length in range(1, min(self.SHORT_PREFIX, len(name_lower)) + 1):
+                ids = self._short_prefixes.setdefault(name_lower[:length], [])
+                if len(ids) < self.SHORT_PREFIX_KEEP:
+                    ids.append(name_id)
+        
+        # n-gram -> ascending name ids containing it
+        postings = {}
+        for name_id, name_lower in enumerate(self._lower):
+            grams = set()
+            for size in range(1, self.NGRAM + 1):
+                grams.update(name_lower[i:i + size] for i in range(len(name_lower) - size + 1))
+            for gram in grams:
+                postings.setdefault(gram, []).append(name_id)
+        self._postings = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix_ids(self, prefix, limit):
+        """First `limit` ids (in list order) whose name starts with prefix"""
+        short = self._short_prefixes.get(prefix) if len(prefix) <= self.SHORT_PREFIX else None
+        if short is not None and (limit <= len(short) or len(short) < self.SHORT_PREFIX_KEEP):
+            return short[:limit]
+        low = bisect.bisect_left(self._sorted_lower, prefix)
+        high = bisect.bisect_left(self._sorted_lower, prefix + "\U0010ffff", low)
+        return heapq.nsmallest(limit, self._sorted_ids[low:high])
+
+    def _substring_ids(self, query, exclude, limit):
+        """Ids (in list order) whose name contains query, skipping those in exclude"""
+        if len(query) <= self.NGRAM:
+            candidates = self._postings.get(query, ())
+        else:
+            # Walk the rarest trigram's postings and verify each candidate
+            grams = [query[i:i + self.NGRAM] for i in range(len(query) - self.NGRAM + 1)]
+            candidates = min((self._postings.get(gram, ()) for gram in grams), key=len)
+        ids = []
+        for name_id in candidates:
+            if name_id not in exclude and query in self._lower[name_id]:
+                ids.append(name_id)
+                if len(ids) >= limit:
+                    break
+        return ids
+
+    def suggest(self, query, max_suggestions=10):
+        """Exact matches, then prefix matches, then substring matches, each in list order"""
+        if not query:
+            return []
+        query_lower = query.lower()
+        
+        ids = list(self._exact.get(query_lower, ()))
+        seen = set(ids)
+        if len(ids) < max_suggestions:
+            for name_id in self._prefix_ids(query_lower, max_suggestions + len(seen)):
+                if name_id not in seen:
+                    ids.append(name_id)
+                    seen.add(name_id)
+        if len(ids) < max_suggestions:
+            ids.extend(self._substring_ids(query_lower, seen, max_suggestions - len(ids)))
+        return [self.names[name_id] for name_id in ids[:max_suggestions]]
+
+def edit_distance(a, b, max_distance):
+    """Levenshtein distance between a and b, or max_distance + 1 once it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+class DrugSynonymIndex:
+    """Synonym groups (brand, generic, development code) plus SymSpell-style typo lookup.
+
+    Every name's deletes (up to max_edit_distance characters removed from its first
+    PREFIX_LENGTH characters) are precomputed, so a misspelled query only generates its
+    own few deletes and verifies the handful of names that share one. The deletes are
+    kept as two sorted numpy columns (string hash, name id) rather than a dict of
+    strings, so large name lists stay compact; hash collisions only add candidates,
+    which are verified anyway.
+    """
+
+    PREFIX_LENGTH = 7
+
+    def __init__(self, groups, names=(), max_edit_distance=DRUG_MAX_EDIT_DISTANCE):
+        self.max_edit_distance = max_edit_distance
+        self._groups = []
+        self._group_of = {}
+        for group in groups:
+            group = list(dict.fromkeys(name.strip() for name in group if name.strip()))
+            # Merge groups that share a name, e.g. a file adding codes to a built-in group
+            existing = [self._group_of[name.lower()] for name in group if name.lower() in self._group_of]
+            if existing:
+                group_id = existing[0]
+                self._groups[group_id] = list(dict.fromkeys(self._groups[group_id] + group))
+            else:
+                group_id = len(self._groups)
+                self._groups.append(group)
+            for name in self._groups[group_id]:
+                self._group_of[name.lower()] = group_id
+        
+        self.names = list(dict.fromkeys(list(names) + [name for group in self._groups for name in group]))
+        self._lower = [name.lower() for name in self.names]
+        delete_hashes = array('q')
+        delete_ids = array('I')
+        prefix_hashes = {}
+        for name_id, name_lower in enumerate(self._lower):
+            # Names sharing a prefix share its deletes
+            prefix = name_lower[:self.PREFIX_LENGTH]
+            hashes = prefix_hashes.get(prefix)
+            if hashes is None:
+                hashes = prefix_hashes[prefix] = array('q', map(hash, self._prefix_deletes(prefix)))
+            delete_hashes.extend(hashes)
+            delete_ids.extend([name_id] * len(hashes))
+        delete_hashes = np.frombuffer(delete_hashes, dtype=np.int64)
+        order = np.argsort(delete_hashes, kind='stable')
+        self._delete_hashes = delete_hashes[order]
+        self._delete_ids = np.frombuffer(delete_ids, dtype=np.uint32)[order]
+
+    def _prefix_deletes(self, word):
+        """The word's prefix with up to max_edit_distance characters removed"""
+        variants = {word[:self.PREFIX_LENGTH]}
+        frontier = variants
+        for _ in range(self.max_edit_distance):
+            frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+            variants |= frontier
+        return variants
+
+    def synonyms(self, name):
+        """All names for the compound, starting with name itself"""
+        group_id = self._group_of.get(name.strip().lower())
+        if group_id is None:
+            return [name]
+        return [name] + [synonym for synonym in self._groups[group_id] if synonym.lower() != name.strip().lower()]
+
+    def fuzzy(self, query, max_suggestions=10):
+        """Names within max_edit_distance of query, closest first, then in list order"""
+        query_lower = query.strip().lower()
+        query_hashes = np.fromiter(map(hash, self._prefix_deletes(query_lower)), dtype=np.int64)
+        starts = np.searchsorted(self._delete_hashes, query_hashes, side='left')
+        ends = np.searchsorted(self._delete_hashes, query_hashes, side='right')
+        candidates = set()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            candidates.update(self._delete_ids[start:end].tolist())
+        scored = []
+        for name_id in candidates:
+            distance = edit_distance(query_lower, self._lower[name_id], self.max_edit_distance)
+            if distance <= self.max_edit_distance:
+                scored.append((distance, name_id))
+        return [self.names[name_id] for _, name_id in heapq.nsmallest(max_suggestions, scored)]
+
+def load_drug_synonym_groups(path=DRUG_SYNONYMS_FILE):
+    """Built-in DRUG_SYNONYM_GROUPS plus any '|'-separated groups from a file"""
+    groups = list(DRUG_SYNONYM_GROUPS)
+    if path:
+        with open(path, encoding='utf-8') as handle:
+            groups.extend(tuple(line.strip().split('|')) for line in handle if line.strip())
+    return groups
+
+def read_compound_list(text):
+    """Compound names from an uploaded list: one per line, blank lines and '#' comments skipped"""
+    names = (line.split('#', 1)[0].strip() for line in text.splitlines())
+    return [name for name in names if name and name.lower() not in ('compound', 'compound_name')]
+
+def load_drug_names(path=DRUG_NAMES_FILE):
+    """Built-in DRUG_DATABASE plus any names from a one-name-per-line file"""
+    names = list(DRUG_DATABASE)
+    if path:
+        with open(path, encoding='utf-8') as handle:
+            names.extend(line.strip() for line in handle if line.strip())
+    return names
+
+@functools.lru_cache(maxsize=None)
+def get_drug_synonym_index():
+    """Synonym and typo index, built once per process and shared by every session"""
+    return DrugSynonymIndex(load_drug_synonym_groups(), load_drug_names())
+
+@functools.lru_cache(maxsize=None)
+def get_drug_name_index():
+    """Drug name index, built once per process and shared by every session"""
+    return DrugNameIndex(get_drug_synonym_index().names)
+
+def drug_synonyms(compound_name):
+    """Brand, generic and code names for compound_name (just the name itself if unknown)"""
+    return get_drug_synonym_index().synonyms(compound_name)
+
+def load_drug_classes(path=DRUG_CLASSES_FILE):
+    """Built-in DRUG_CLASSES plus any "Class name: drug|drug" lines from a file (extending a class of the same name)"""
+    classes = {class_name: list(members) for class_name, members in DRUG_CLASSES.items()}
+    if path:
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                class_name, _, members = line.partition(':')
+                if class_name.strip() and members.strip():
+                    classes.setdefault(class_name.strip(), []).extend(name.strip() for name in members.split('|') if name.strip())
+    return classes
+
+@functools.lru_cache(maxsize=None)
+def get_drug_classes():
+    return load_drug_classes()
+
+def drug_class_members(class_name):
+    """Lower-cased names of every compound in a drug class, synonyms included"""
+    members = set()
+    for name in get_drug_classes().get(class_name, ()):
+        members.update(synonym.strip().lower() for synonym in drug_synonyms(name))
+    return members
+
+def filter_drug_suggestions(query, drug_list=None, max_suggestions=10):
+    """Filter drug database based on user input.
+
+    Exact, prefix and substring matches come first; the rest of the list is filled with
+    synonyms of the exact match and then close misspellings.
+    """
+    if not query:
+        return []
+    
+    index = get_drug_name_index() if drug_list is None else DrugNameIndex(drug_list)
+    suggestions = index.suggest(query, max_suggestions)
+    if len(suggestions) < max_suggestions and drug_list is None:
+        synonym_index = get_drug_synonym_index()
+        for name in synonym_index.synonyms(query.strip())[1:] + synonym_index.fuzzy(query, max_suggestions):
+            if name not in suggestions:
+                suggestions.append(name)
+    return suggestions[:max_suggestions]
+
+class TokenBucketRateLimiter:
+    """Thread-safe token bucket that paces API requests and adapts to rate-limit response headers"""
+
+    def __init__(self, rate_per_second, capacity=None):
+        self.rate = max(float(rate_per_second), 0.01)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1.0):
+        """Block until a request may be sent"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = max(self._blocked_until - now, (tokens - self._tokens) / self.rate)
+            time.sleep(max(wait, 0.01))
+
+    def update_from_headers(self, headers):
+        """Re-tune the bucket from Anthropic rate-limit headers (requests per minute, remaining, reset)"""
+        if not headers:
+            return
+        
+        limit = _header_number(headers, 'anthropic-ratelimit-requests-limit')
+        remaining = _header_number(headers, 'anthropic-ratelimit-requests-remaining')
+        tokens_remaining = _header_number(headers, 'anthropic-ratelimit-tokens-remaining')
+        retry_after = _header_number(headers, 'retry-after')
+        
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            
+            # Limits are expressed per minute and replenished continuously
+            if limit:
+                self.rate = max(limit / 60.0, 0.01)
+            
+            # Never believe we have more budget than the server reports
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+            
+            if remaining == 0:
+                reset_in = _seconds_until(headers.get('anthropic-ratelimit-requests-reset'))
+                self._blocked_until = max(self._blocked_until, now + reset_in)
+            if tokens_remaining == 0:
+                reset_in = _seconds_until(headers.get('anthropic-ratelimit-tokens-reset'))
+                self._blocked_until = max(self._blocked_until, now + reset_in)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+def _header_number(headers, name):
+    """Read a numeric header value, returning None when absent or malformed"""
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _seconds_until(timestamp):
+    """Seconds from now until an RFC 3339 reset timestamp (defaults to one second)"""
+    if not timestamp:
+        return 1.0
+    try:
+        reset_at = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        return max((reset_at - datetime.now(reset_at.tzinfo)).total_seconds(), 0.0)
+    except ValueError:
+        return 1.0
+
+def parse_pubmed_article(article):
+    """Parse a PubmedArticle element into a compound-independent article record"""
+    citation = article.find('MedlineCitation')
+    article_elem = citation.find('Article') if citation is not None else None
+    if article_elem is None:
+        raise ValueError("PubmedArticle has no MedlineCitation/Article")
+    
+    # Extract article information with better error handling
+    title = article_elem.findtext('ArticleTitle') or "No title available"
+    
+    # Handle multiple abstract sections with None checks
+    abstract_texts = []
+    for abstract_elem in article_elem.iterfind('Abstract/AbstractText'):
+        if abstract_elem.text:
+            label = abstract_elem.get('Label', '')
+            text = abstract_elem.text
+            if label:
+                abstract_texts.append(f"{label}: {text}")
+            else:
+                abstract_texts.append(text)
+    
+    abstract = " ".join(abstract_texts) if abstract_texts else "No abstract available"
+    
+    # Extract authors with affiliations
+    authors = []
+    for author in article_elem.iterfind('AuthorList/Author'):
+        lastname = author.findtext('LastName')
+        forename = author.findtext('ForeName')
+        if lastname and forename:
+            authors.append(f"{forename} {lastname}")
+    
+    # Extract comprehensive publication date
+    journal_elem = article_elem.find('Journal')
+    pub_date = "Unknown"
+    pub_year = journal_elem.findtext('JournalIssue/PubDate/Year') if journal_elem is not None else None
+    pub_month = journal_elem.findtext('JournalIssue/PubDate/Month') if journal_elem is not None else None
+    
+    if pub_year:
+        if pub_month:
+            pub_date = f"{pub_month} {pub_year}"
+        else:
+            pub_date = pub_year
+    
+    # Extract PMID
+    pmid = citation.findtext('PMID') or "Unknown"
+    
+    # Extract journal information
+    journal = (journal_elem.findtext('Title') if journal_elem is not None else None) or "Unknown Journal"
+    
+    # Extract DOI if available
+    doi = None
+    for article_id in article.iterfind('PubmedData/ArticleIdList/ArticleId'):
+        if article_id.get('IdType') == 'doi' and article_id.text:
+            doi = article_id.text
+            break
+    
+    # Ensure title and abstract are strings before concatenation
+    title_str = str(title) if title else "No title available"
+    abstract_str = str(abstract) if abstract else "No abstract available"
+    
+    return {
+        'pmid': pmid,
+        'title': title_str,
+        'abstract': abstract_str,
+        'authors': ', '.join(authors[:3]) + (' et al.' if len(authors) > 3 else ''),
+        'pub_date': pub_date,
+        'journal': journal,
+        'doi': doi,
+        'url': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
+    }
+
+def paper_for_compound(record, compound_name):
+    """Build the paper dict used by the analysis pipeline from a stored article record"""
+    paper = dict(record)
+    paper['compound_mentioned'] = compound_name.lower() in (record['title'] + " " + record['abstract']).lower()
+    return paper
+
+class PubMedArticleStore:
+    """Local SQLite store of parsed PubMed records keyed by PMID"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(PAPERSAFE_DATA_DIR, "pubmed_articles.sqlite3")
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                pmid TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                abstract TEXT NOT NULL,
+                authors TEXT NOT NULL,
+                pub_date TEXT NOT NULL,
+                journal TEXT NOT NULL,
+                doi TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, pmids):
+        """Return {pmid: record} for the PMIDs already in the store"""
+        records = {}
+        pmids = list(pmids)
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(pmids), 500):
+                chunk = pmids[i:i+500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT pmid, title, abstract, authors, pub_date, journal, doi FROM articles WHERE pmid IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for pmid, title, abstract, authors, pub_date, journal, doi in rows:
+                    records[pmid] = {
+                        'pmid': pmid,
+                        'title': title,
+                        'abstract': abstract,
+                        'authors': authors,
+                        'pub_date': pub_date,
+                        'journal': journal,
+                        'doi': doi,
+                        'url': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
+                    }
+        return records
+
+    def put_many(self, records):
+        """Insert or refresh parsed records"""
+        now = time.time()
+        rows = [
+            (r['pmid'], r['title'], r['abstract'], r['authors'], r['pub_date'], r['journal'], r['doi'], now)
+            for r in records if r.get('pmid') and r['pmid'] != "Unknown"
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RequestsTransport:
+    """Default E-utilities transport: pooled HTTP connections to the configured base URL"""
+
+    def __init__(self, base_url=EUTILS_BASE_URL, timeout=30):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get(self, endpoint, params):
+        response = self.session.get(f"{self.base_url}{endpoint}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def post(self, endpoint, data):
+        response = self.session.post(f"{self.base_url}{endpoint}", data=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def stream(self, endpoint, data):
+        """POST and return a file-like body that is read as chunks arrive"""
+        response = self.session.post(f"{self.base_url}{endpoint}", data=data, timeout=self.timeout, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return response.raw
+
+class EutilsClient:
+    """NCBI E-utilities client with request pacing, retry with backoff and history-server paging.
+
+    Any object with get(endpoint, params) and post(endpoint, data) methods returning the
+    response body, and stream(endpoint, data) returning a readable file-like body, can be
+    passed as the transport, e.g. one that replays recorded responses.
+    """
+
+    def __init__(self, transport=None, api_key=NCBI_API_KEY, rate_limiter=None, max_retries=4):
+        self.transport = transport or RequestsTransport()
+        self.api_key = api_key
+        self.max_retries = max_retries
+        # NCBI allows 3 requests/second without an API key and 10 with one
+        requests_per_second = 10 if api_key else 3
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter(requests_per_second, capacity=1)
+
+    def _call(self, method, endpoint, params):
+        params = dict(params, tool="papersafe-ai")
+        if self.api_key:
+            params['api_key'] = self.api_key
+        
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return getattr(self.transport, method)(endpoint, params)
+            except requests.exceptions.RequestException as e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt == self.max_retries:
+                    raise
+                # Exponential backoff with jitter
+                time.sleep(min(2 ** attempt, 30) * (0.5 + random.random() / 2))
+
+    def esearch(self, term, retmax, usehistory=False, **extra_params):
+        """Run esearch and return the parsed eSearchResult root"""
+        params = {
+            'db': 'pubmed',
+            'term': term,
+            'retmax': retmax,
+            'retmode': 'xml',
+            **extra_params
+        }
+        if usehistory:
+            params['usehistory'] = 'y'
+        return ET.fromstring(self._call('post', 'esearch.fcgi', params))
+
+    def epost(self, pmids):
+        """Upload PMIDs to the history server, returning (WebEnv, query_key)"""
+        root = ET.fromstring(self._call('post', 'epost.fcgi', {'db': 'pubmed', 'id': ','.join(pmids)}))
+        return root.findtext('WebEnv'), root.findtext('QueryKey')
+
+    def efetch_ids(self, pmids, batch_size=EFETCH_INITIAL_BATCH):
+        """Yield streamed efetch XML bodies for an explicit PMID list"""
+        for i in range(0, len(pmids), batch_size):
+            yield self._call('stream', 'efetch.fcgi', {
+                'db': 'pubmed',
+                'id': ','.join(pmids[i:i+batch_size]),
+                'retmode': 'xml',
+                'rettype': 'abstract'
+            })
+
+    def efetch_history(self, webenv, query_key, total, batch_size=EFETCH_INITIAL_BATCH):
+        """Yield streamed efetch XML bodies paging through a history-server result set.
+
+        The page size adapts to how long NCBI takes to start answering: it grows while
+        pages start quickly and is halved when a page is slow or fails after retries.
+        """
+        retstart = 0
+        while retstart < total:
+            page_size = min(batch_size, total - retstart)
+            started = time.monotonic()
+            try:
+                body = self._call('stream', 'efetch.fcgi', {
+                    'db': 'pubmed',
+                    'WebEnv': webenv,
+                    'query_key': query_key,
+                    'retstart': retstart,
+                    'retmax': page_size,
+                    'retmode': 'xml',
+                    'rettype': 'abstract'
+                })
+            except requests.exceptions.RequestException:
+                if batch_size <= EFETCH_MIN_BATCH:
+                    raise
+                batch_size = max(EFETCH_MIN_BATCH, batch_size // 2)
+                continue
+            
+            time_to_first_byte = time.monotonic() - started
+            if time_to_first_byte < 2:
+                batch_size = min(EFETCH_MAX_BATCH, int(batch_size * 1.5))
+            elif time_to_first_byte > 10:
+                batch_size = max(EFETCH_MIN_BATCH, batch_size // 2)
+            
+            yield body
+            retstart += page_size
+
+def iter_pubmed_records(source, on_error=None):
+    """Incrementally parse an efetch XML body, yielding one article record per PubmedArticle.
+
+    Elements are cleared as soon as they are parsed, so memory stays flat however large
+    the batch is and the first record is available before the body has fully arrived.
+    """
+    root = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag != 'PubmedArticle':
+            continue
+        try:
+            record = parse_pubmed_article(elem)
+        except Exception as e:
+            if on_error is not None:
+                on_error(elem.findtext('MedlineCitation/PMID') or "Unknown", e)
+            record = None
+        # Drop the processed article and everything before it
+        root.clear()
+        if record is not None:
+            yield record
+
+def log_notify(level, message):
+    """Default progress callback: status messages go to the 'papersafe' logger"""
+    logger.log(NOTIFY_LOG_LEVELS.get(level, logging.INFO), message)
+
+def search_entrez_window(eutils, term, mindate, maxdate):
+    """Every PMID matching term that entered PubMed from mindate to maxdate ('YYYY/MM/DD', inclusive).
+
+    Returns (pmids, search_root): the window is paged through on the history server, and
+    when it has more than ESEARCH_MAX_RESULTS hits it is split in half by date and each
+    half searched on its own (newer half first). search_root is the eSearchResult whose
+    history set holds exactly these PMIDs, or None when the window had to be split.
+    Raises RuntimeError when PubMed hands back fewer PMIDs than it counted.
+    """
+    search_root = eutils.esearch(term, ESEARCH_PAGE_SIZE, usehistory=True, sort='pub+date', datetype='edat', mindate=mindate, maxdate=maxdate)
+    window_count = int(search_root.findtext('Count') or 0)
+    if window_count > ESEARCH_MAX_RESULTS:
+        start = datetime.strptime(mindate, "%Y/%m/%d")
+        end = datetime.strptime(maxdate, "%Y/%m/%d")
+        if start >= end:
+            raise RuntimeError(f"{window_count} PubMed hits entered on {mindate} alone, more than esearch can return; narrow the search")
+        middle = start + timedelta(days=(end - start).days // 2)
+        newer_pmids, _ = search_entrez_window(eutils, term, (middle + timedelta(days=1)).strftime("%Y/%m/%d"), maxdate)
+        older_pmids, _ = search_entrez_window(eutils, term, mindate, middle.strftime("%Y/%m/%d"))
+        return list(dict.fromkeys(newer_pmids + older_pmids)), None
+    
+    # Page through the rest of the window's history set until its Count is used up
+    pmids = [id_elem.text for id_elem in search_root.findall('.//Id')]
+    while len(pmids) < window_count:
+        page_root = eutils.esearch(
+            f"#{search_root.findtext('QueryKey')}",
+            ESEARCH_PAGE_SIZE,
+            WebEnv=search_root.findtext('WebEnv'),
+            retstart=len(pmids),
+            sort='pub+date'
+        )
+        page_pmids = [id_elem.text for id_elem in page_root.findall('.//Id')]
+        if not page_pmids:
+            raise RuntimeError(f"PubMed returned only {len(pmids)} of {window_count} PMIDs added {mindate} - {maxdate}")
+        pmids.extend(page_pmids)
+    return pmids, search_root
+
+def iter_pubmed_search(compound_name, max_results=20, therapeutic_area=None, max_years_back=25, article_store=None, fetch_mode="history", eutils=None, notify=log_notify, on_found=None, synonyms=None, date_range=None, skip_pmids=None):
+    """Search PubMed and yield paper dicts as soon as each one is available.
+
+    Papers already in the article store are yielded first, the rest as they stream out of
+    efetch, so downstream stages can start before retrieval finishes. Status messages go to
+    notify(level, message) and the esearch PMID list to on_found(pmids). Network and XML
+    errors are raised to the caller. Any synonyms (brand, generic, code names) are ORed
+    into the compound part of the query.
+
+    date_range=(mindate, maxdate) ('YYYY/MM/DD') searches by the date each record entered
+    PubMed instead of the last max_years_back years; with max_results=None every PMID in
+    that window is searched (see search_entrez_window()), otherwise the newest max_results.
+    PMIDs in skip_pmids are dropped before anything is fetched. Together they drive
+    incremental surveillance runs.
+    """
+    eutils = eutils or EutilsClient()
+    
+    # Enhanced search query with safety-related terms and therapeutic area
+    safety_terms = [
+        "adverse event", "side effect", "toxicity", "safety", "pharmacovigilance", 
+        "drug interaction", "contraindication", "warning", "precaution", "risk"
+    ]
+    
+    # Build comprehensive search query
+    compound_names = list(dict.fromkeys([compound_name] + list(synonyms or [])))
+    compound_query = " OR ".join(f'"{name}"[Title/Abstract] OR "{name}"[MeSH Terms]' for name in compound_names)
+    safety_query = " OR ".join([f'"{term}"[Title/Abstract]' for term in safety_terms])
+    
+    # Add therapeutic area if specified
+    area_query = ""
+    if therapeutic_area and therapeutic_area != "Other":
+        area_terms = {
+            "Oncology": ["cancer", "tumor", "oncology", "chemotherapy", "neoplasm"],
+            "Cardiovascular": ["cardiovascular", "cardiac", "heart", "hypertension", "cholesterol"],
+            "Neuroscience": ["neurological", "brain", "nervous system", "alzheimer", "parkinson"],
+            "Immunology": ["immunology", "autoimmune", "inflammation", "arthritis"],
+            "Metabolic": ["diabetes", "metabolic", "obesity", "glucose", "insulin"]
+        }
+        if therapeutic_area in area_terms:
+            area_query = " AND (" + " OR ".join([f'"{term}"[Title/Abstract]' for term in area_terms[therapeutic_area]]) + ")"
+    
+    search_query = f'({compound_query}) AND ({safety_query}){area_query}'
+    
+    if date_range is not None:
+        # Entrez date, so late-indexed papers with an older publication date are still caught
+        date_params = {'datetype': 'edat', 'mindate': date_range[0], 'maxdate': date_range[1]}
+        window = f"added {date_range[0]} - {date_range[1]}"
+    else:
+        # Calculate date range in days
+        days_back = max_years_back * 365
+        date_params = {'datetype': 'pdat', 'reldate': str(days_back)}
+        window = f"last {max_years_back} years"
+    
+    also_known_as = f" (also {', '.join(compound_names[1:])})" if len(compound_names) > 1 else ""
+    notify('info', f"🔍 Searching PubMed for: {compound_name}{also_known_as} ({window})")
+    
+    # Search for paper IDs
+    if date_range is not None and max_results is None:
+        search_pmids, search_root = search_entrez_window(eutils, search_query, *date_range)
+    else:
+        search_root = eutils.esearch(
+            search_query,
+            max_results,
+            usehistory=(fetch_mode == "history"),
+            sort='pub+date',
+            **date_params
+        )
+        search_pmids = [id_elem.text for id_elem in search_root.findall('.//Id')]
+    
+    # Check for errors
+    error_elem = search_root.find('.//ErrorList') if search_root is not None else None
+    if error_elem is not None:
+        notify('warning', f"PubMed search warning: {error_elem.text}")
+    
+    pmids = [pmid for pmid in search_pmids if pmid not in skip_pmids] if skip_pmids else search_pmids
+    if on_found is not None:
+        on_found(pmids)
+    
+    if not pmids:
+        if search_pmids:
+            notify('info', f"No new papers for '{compound_name}' ({window}); all {len(search_pmids)} were analyzed before.")
+        else:
+            notify('warning', f"No papers found for '{compound_name}' with safety-related terms ({window}). Try expanding the date range or different search terms.")
+        return
+    
+    notify('success', f"✅ Found {len(pmids)} papers ({window}).")
+    
+    # Serve already-parsed records from the local store; only fetch what is missing
+    records = article_store.get_many(pmids) if article_store is not None else {}
+    missing_pmids = [pmid for pmid in pmids if pmid not in records]
+    if records:
+        notify('info', f"📦 {len(records)} papers loaded from the local article store, fetching {len(missing_pmids)} from PubMed")
+    for pmid in pmids:
+        if pmid in records:
+            yield paper_for_compound(records[pmid], compound_name)
+    
+    # Fetch paper details in large batches; reuse the search's history set when nothing is cached
+    if not missing_pmids:
+        fetch_pages = []
+    elif fetch_mode == "history" and search_root is not None and len(missing_pmids) == len(search_pmids):
+        fetch_pages = eutils.efetch_history(search_root.findtext('WebEnv'), search_root.findtext('QueryKey'), len(pmids))
+    elif fetch_mode == "history":
+        webenv, query_key = eutils.epost(missing_pmids)
+        fetch_pages = eutils.efetch_history(webenv, query_key, len(missing_pmids))
+    else:
+        fetch_pages = eutils.efetch_ids(missing_pmids)
+    
+    def report_parse_error(pmid, error):
+        notify('warning', f"Error parsing article {pmid}: {str(error)}")
+    
+    wanted = set(missing_pmids)
+    retrieved_count = len(records)
+    for fetch_body in fetch_pages:
+        fetched_records = []
+        try:
+            for record in iter_pubmed_records(fetch_body, on_error=report_parse_error):
+                fetched_records.append(record)
+                if record['pmid'] in wanted:
+                    wanted.discard(record['pmid'])
+                    retrieved_count += 1
+                    yield paper_for_compound(record, compound_name)
+        finally:
+            fetch_body.close()
+            if article_store is not None:
+                article_store.put_many(fetched_records)
+    
+    notify('success', f"✅ Successfully retrieved {retrieved_count} papers from PubMed")
+    if wanted:
+        notify('warning', f"{len(wanted)} papers for '{compound_name}' could not be retrieved or parsed")
+
+def search_pubmed(compound_name, max_results=20, therapeutic_area=None, max_years_back=25, article_store=None, fetch_mode="history", eutils=None, synonyms=None, notify=log_notify):
+    """Search PubMed for papers related to the compound using official E-utilities API
+
+    fetch_mode "history" keeps the result set on the E-utilities history server and pages
+    through it with large efetch batches; "ids" posts explicit PMID lists instead. Papers
+    naming only a synonym of the compound (e.g. "adalimumab" for "Humira") are included.
+    """
+    try:
+        found_pmids = []
+        papers = list(iter_pubmed_search(
+            compound_name, max_results, therapeutic_area, max_years_back,
+            article_store=article_store, fetch_mode=fetch_mode, eutils=eutils,
+            notify=notify, on_found=found_pmids.extend,
+            synonyms=drug_synonyms(compound_name) if synonyms is None else synonyms
+        ))
+        
+        # Keep the esearch (publication date) ordering
+        order = {pmid: position for position, pmid in enumerate(found_pmids)}
+        papers.sort(key=lambda paper: order.get(paper['pmid'], len(order)))
+        return papers
+        
+    except Exception as e:
+        report_pubmed_error(e, notify)
+        return []
+
+def report_pubmed_error(error, notify):
+    """Turn a PubMed retrieval failure into a user-facing message"""
+    if isinstance(error, requests.exceptions.Timeout):
+        notify('error', "⏰ PubMed search timed out. Please try again with fewer papers or check your internet connection.")
+    elif isinstance(error, requests.exceptions.RequestException):
+        notify('error', f"🌐 Network error accessing PubMed: {str(error)}")
+    elif isinstance(error, ET.ParseError):
+        notify('error', f"📄 Error parsing PubMed response: {str(error)}")
+    else:
+        notify('error', f"❌ Unexpected error searching PubMed: {str(error)}")
+
+ANALYSIS_OUTPUT_FORMAT = """    ADVERSE_EVENTS_COUNT: [number]
+    ADVERSE_EVENTS_LIST:
+    - [list each specific adverse event mentioned, one per line]
+    
+    DRUG_INTERACTIONS_COUNT: [number]
+    DRUG_INTERACTIONS_LIST:
+    - [list each specific drug interaction mentioned, one per line]
+    
+    CONTRAINDICATIONS_COUNT: [number]
+    CONTRAINDICATIONS_LIST:
+    - [list each specific contraindication mentioned, one per line]
+    
+    SAFETY_SIGNALS_DETECTED:
+    - [any other safety concerns not covered above]
+    
+    KEY_FINDINGS:
+    - [summarize the main safety-related findings in 2-3 bullet points]
+    
+    REGULATORY_IMPACT:
+    - [assess if this requires 15-day FDA reporting or other regulatory action]
+    
+    SAFETY_DOMAINS:
+    - [categorize into: Hepatic, Cardiac, Neurological, Gastrointestinal, Dermatological, Renal, Hematological, Other]
+    
+    CLINICAL_SIGNIFICANCE:
+    - [brief assessment of clinical relevance and patient impact]
+    
+"""
+
+# Static instructions, sent as a cached system prompt; only the paper itself changes per request
+ANALYSIS_SYSTEM_PROMPT = """
+    You are a senior drug safety scientist analyzing scientific literature for pharmaceutical regulatory compliance.
+    
+    You will be given a research paper about a named compound. Provide a structured safety assessment of that compound.
+    
+    CRITICAL: I need you to identify and count specific safety signals. Please be thorough and specific.
+    
+    Please provide your analysis in EXACTLY this format:
+    
+""" + ANALYSIS_OUTPUT_FORMAT + """    IMPORTANT: 
+    - Count EVERY adverse event, drug interaction, and contraindication mentioned
+    - Be specific and thorough in your counting
+    - Include mild, moderate, and severe events
+    - Don't miss any safety signals
+    """
+
+ANALYSIS_USER_TEMPLATE = """
+    Analyze this research paper about the compound "{compound_name}" and provide a structured safety assessment.
+    
+    Title: {title}
+    Abstract: {abstract}
+    """
+
+BATCH_ANALYSIS_SYSTEM_PROMPT = """
+    You are a senior drug safety scientist analyzing scientific literature for pharmaceutical regulatory compliance.
+    
+    You will be given several research papers about a named compound, each tagged with its PMID. Provide a separate structured safety assessment for every paper.
+    
+    CRITICAL: I need you to identify and count specific safety signals. Please be thorough and specific.
+    
+    For EACH paper, start its block with the line "=== PMID: <pmid> ===" (using the paper's pmid attribute), then provide your analysis in EXACTLY this format:
+    
+""" + ANALYSIS_OUTPUT_FORMAT + """    IMPORTANT: 
+    - Return exactly one block per paper, in the order given, and assess each paper only from its own title and abstract
+    - Count EVERY adverse event, drug interaction, and contraindication mentioned
+    - Be specific and thorough in your counting
+    - Include mild, moderate, and severe events
+    - Don't miss any safety signals
+    """
+
+BATCH_ANALYSIS_USER_TEMPLATE = """
+    Analyze each of the {paper_count} research papers below about the compound "{compound_name}".
+    
+{papers}
+    """
+
+BATCH_PAPER_TEMPLATE = """    <paper pmid="{pmid}">
+    Title: {title}
+    Abstract: {abstract}
+    </paper>
+"""
+
+SAFETY_DOMAIN_CHOICES = ["Hepatic", "Cardiac", "Neurological", "Gastrointestinal", "Dermatological", "Renal", "Hematological", "Other"]
+
+# Safety domains are stored per paper as a bitmask over SAFETY_DOMAIN_CHOICES (bit i = choice i)
+SAFETY_DOMAIN_BITS = {domain: 1 << i for i, domain in enumerate(SAFETY_DOMAIN_CHOICES)}
+SAFETY_DOMAIN_MASK_COUNT = 1 << len(SAFETY_DOMAIN_CHOICES)
+
+# Words the model uses for each domain; free text matching none of them counts as "Other"
+SAFETY_DOMAIN_WORDS = {
+    'Hepatic': ("hepatic", "liver", "hepatotoxicity", "hepatobiliary", "hepatitis", "transaminase", "dili"),
+    'Cardiac': ("cardiac", "cardiovascular", "heart", "cardiotoxicity", "arrhythmia", "qt", "myocardial", "vascular"),
+    'Neurological': ("neurological", "neurologic", "neuro", "cns", "nervous", "neuropathy", "neurotoxicity", "seizure", "psychiatric"),
+    'Gastrointestinal': ("gastrointestinal", "gi", "gastric", "digestive", "bowel", "intestinal", "pancreatic", "pancreatitis"),
+    'Dermatological': ("dermatological", "dermatologic", "skin", "cutaneous", "dermal", "rash"),
+    'Renal': ("renal", "kidney", "nephrotoxicity", "nephrological", "urinary"),
+    'Hematological': ("hematological", "hematologic", "haematological", "blood", "hematotoxicity", "bleeding", "coagulation"),
+    'Other': ("other",)
+}
+SAFETY_DOMAIN_LOOKUP = {word: domain for domain, words in SAFETY_DOMAIN_WORDS.items() for word in words}
+SAFETY_DOMAIN_LOOKUP.update({domain.lower(): domain for domain in SAFETY_DOMAIN_CHOICES})
+# Answers meaning the paper has no safety domain at all
+SAFETY_DOMAIN_NULL_ANSWERS = frozenset(("none", "n/a", "na", "nil", "not applicable", "not reported", "no safety domain", "no safety domains"))
+
+# Precomputed per mask value: its labels joined for display, and its bits as a 0/1 row for counting
+SAFETY_DOMAIN_LABELS = np.array([
+    '; '.join(domain for domain, bit in SAFETY_DOMAIN_BITS.items() if mask & bit) for mask in range(SAFETY_DOMAIN_MASK_COUNT)
+], dtype=object)
+SAFETY_DOMAIN_BIT_ROWS = (np.arange(SAFETY_DOMAIN_MASK_COUNT)[:, None] >> np.arange(len(SAFETY_DOMAIN_CHOICES))) & 1
+
+@functools.lru_cache(maxsize=4096)
+def normalize_safety_domain(text):
+    """Map one free-text domain from the model ("- hepatic", "Hepatic (ALT elevation)") onto SAFETY_DOMAIN_CHOICES.
+
+    The text before any parenthesis is tried as a whole, then word by word; returns None
+    for empty text and null answers ("None", "N/A", "Not applicable") and "Other" when
+    nothing matches.
+    """
+    head = text.split('(', 1)[0].strip(" \t-*•.:;,").lower()
+    if not head or head in SAFETY_DOMAIN_NULL_ANSWERS or head.startswith(("none ", "no safety domain")):
+        return None
+    if head in SAFETY_DOMAIN_LOOKUP:
+        return SAFETY_DOMAIN_LOOKUP[head]
+    for word in ''.join(c if c.isalnum() else ' ' for c in head).split():
+        if word in SAFETY_DOMAIN_LOOKUP:
+            return SAFETY_DOMAIN_LOOKUP[word]
+    return "Other"
+
+def safety_domain_mask(domains):
+    """Bitmask of the canonical domains in a list of free-text or canonical domain names"""
+    mask = 0
+    for text in domains or ():
+        domain = normalize_safety_domain(text)
+        if domain is not None:
+            mask |= SAFETY_DOMAIN_BITS[domain]
+    return mask
+
+def safety_domain_names(mask):
+    return [domain for domain, bit in SAFETY_DOMAIN_BITS.items() if mask & bit]
+
+def analysis_domain_mask(analysis):
+    """The paper's domain bitmask; analyses stored before masks existed are normalized on the fly"""
+    mask = analysis.get('safety_domain_mask')
+    return safety_domain_mask(analysis.get('safety_domains')) if mask is None else mask
+
+def _string_list_schema(description, **extra):
+    return {"type": "array", "items": dict({"type": "string"}, **extra), "description": description}
+
+# Tool whose input mirrors the dict parse_claude_analysis() builds from the text format
+ANALYSIS_TOOL_NAME = "record_safety_analysis"
+ANALYSIS_TOOL_PROPERTIES = {
+    "adverse_events_count": {"type": "integer", "minimum": 0, "description": "Number of distinct adverse events mentioned"},
+    "adverse_events": _string_list_schema("Each specific adverse event mentioned"),
+    "drug_interactions_count": {"type": "integer", "minimum": 0, "description": "Number of distinct drug interactions mentioned"},
+    "drug_interactions": _string_list_schema("Each specific drug interaction mentioned"),
+    "contraindications_count": {"type": "integer", "minimum": 0, "description": "Number of distinct contraindications mentioned"},
+    "contraindications": _string_list_schema("Each specific contraindication mentioned"),
+    "other_signals": _string_list_schema("Any other safety concerns not covered above"),
+    "key_findings": _string_list_schema("The main safety-related findings, 2-3 items"),
+    "regulatory_impact": {"type": "string", "description": "Whether this requires 15-day FDA reporting or other regulatory action"},
+    "safety_domains": _string_list_schema("Organ systems affected", enum=SAFETY_DOMAIN_CHOICES),
+    "clinical_significance": _string_list_schema("Brief assessment of clinical relevance and patient impact")
+}
+
+def analysis_tool(fields=None):
+    """Tool definition for structured analyses, optionally narrowed to the fields still missing"""
+    fields = list(fields or ANALYSIS_TOOL_PROPERTIES)
+    return {
+        "name": ANALYSIS_TOOL_NAME,
+        "description": "Record the structured drug safety assessment of one research paper.",
+        "input_schema": {
+            "type": "object",
+            "properties": {field: ANALYSIS_TOOL_PROPERTIES[field] for field in fields},
+            "required": fields
+        }
+    }
+
+TOOL_ANALYSIS_SYSTEM_PROMPT = """
+    You are a senior drug safety scientist analyzing scientific literature for pharmaceutical regulatory compliance.
+    
+    You will be given a research paper about a named compound. Provide a structured safety assessment of that compound by calling the record_safety_analysis tool.
+    
+    CRITICAL: I need you to identify and count specific safety signals. Please be thorough and specific.
+    
+    IMPORTANT: 
+    - Count EVERY adverse event, drug interaction, and contraindication mentioned
+    - Each count must equal the length of its list; use 0 and an empty list when none are mentioned
+    - Include mild, moderate, and severe events
+    - Don't miss any safety signals
+    """
+
+class SafetyAnalysis(NamedTuple):
+    """Validated structured analysis, as returned by the record_safety_analysis tool"""
+    adverse_events_count: int
+    adverse_events: List[str]
+    drug_interactions_count: int
+    drug_interactions: List[str]
+    contraindications_count: int
+    contraindications: List[str]
+    other_signals: List[str]
+    key_findings: List[str]
+    regulatory_impact: str
+    safety_domains: List[str]
+    clinical_significance: List[str]
+
+    def to_text(self):
+        """JSON form stored in the analysis cache and read back by parse_claude_analysis()"""
+        return json.dumps(self._asdict())
+
+def validate_analysis_fields(payload):
+    """Coerce a tool input into SafetyAnalysis field values; returns (values, missing_or_invalid_fields)"""
+    values = {}
+    missing = []
+    payload = payload if isinstance(payload, dict) else {}
+    for field, schema in ANALYSIS_TOOL_PROPERTIES.items():
+        value = payload.get(field)
+        if schema["type"] == "integer":
+            if isinstance(value, str) and value.strip().isdigit():
+                value = int(value)
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                missing.append(field)
+                continue
+        elif schema["type"] == "array":
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list):
+                missing.append(field)
+                continue
+            value = [str(item).strip() for item in value if str(item).strip()]
+        elif not isinstance(value, str) or not value.strip():
+            missing.append(field)
+            continue
+        values[field] = value
+    return values, missing
+
+# Changing the prompt invalidates cached analyses produced by older versions
+PROMPT_VERSION = hashlib.sha256((ANALYSIS_SYSTEM_PROMPT + ANALYSIS_USER_TEMPLATE).encode('utf-8')).hexdigest()[:16]
+TOOL_PROMPT_VERSION = hashlib.sha256((TOOL_ANALYSIS_SYSTEM_PROMPT + ANALYSIS_USER_TEMPLATE + json.dumps(analysis_tool(), sort_keys=True)).encode('utf-8')).hexdigest()[:16]
+BATCH_PROMPT_VERSION = hashlib.sha256((BATCH_ANALYSIS_SYSTEM_PROMPT + BATCH_ANALYSIS_USER_TEMPLATE + BATCH_PAPER_TEMPLATE).encode('utf-8')).hexdigest()[:16]
+
+class AnalysisCache:
+    """Persistent SQLite cache of raw Claude analysis text.
+
+    Entries are content-addressed by PMID, compound, model name and prompt version,
+    expire after a TTL and are evicted least-recently-used beyond max_entries.
+    """
+
+    def __init__(self, path=None, ttl_days=ANALYSIS_CACHE_TTL_DAYS, max_entries=ANALYSIS_CACHE_MAX_ENTRIES):
+        self.path = path or os.path.join(PAPERSAFE_DATA_DIR, "analysis_cache.sqlite3")
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                cache_key TEXT PRIMARY KEY,
+                pmid TEXT NOT NULL,
+                compound TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                analysis_text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_last_accessed ON analyses(last_accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(pmid, compound_name, model=CLAUDE_MODEL, prompt_version=PROMPT_VERSION):
+        """Content address for one analysis"""
+        parts = [str(pmid), compound_name.strip().lower(), model, prompt_version]
+        return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, pmid, compound_name, model=CLAUDE_MODEL, prompt_version=PROMPT_VERSION):
+        """Return the cached analysis text, or None on a miss.
+
+        prompt_version may also be a tuple of versions, tried in order.
+        """
+        prompt_versions = prompt_version if isinstance(prompt_version, tuple) else (prompt_version,)
+        now = time.time()
+        with self._lock:
+            for version in prompt_versions:
+                key = self.make_key(pmid, compound_name, model, version)
+                row = self._conn.execute(
+                    "SELECT analysis_text, created_at FROM analyses WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    continue
+                if now - row[1] > self.ttl_seconds:
+                    self._conn.execute("DELETE FROM analyses WHERE cache_key = ?", (key,))
+                    self._conn.commit()
+                    continue
+                self._conn.execute("UPDATE analyses SET last_accessed = ? WHERE cache_key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, pmid, compound_name, analysis_text, model=CLAUDE_MODEL, prompt_version=PROMPT_VERSION):
+        """Store a successful analysis"""
+        if not pmid or pmid == "Unknown":
+            return
+        key = self.make_key(pmid, compound_name, model, prompt_version)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, str(pmid), compound_name.strip().lower(), model, prompt_version, analysis_text, now, now)
+            )
+            self._conn.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 100:
+                self._evict_locked()
+
+    def evict(self):
+        """Drop expired entries and trim to max_entries by least-recent use"""
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        self._writes_since_evict = 0
+        self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._conn.execute("""
+            DELETE FROM analyses WHERE cache_key IN (
+                SELECT cache_key FROM analyses ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ClaudeUsageTracker:
+    """Thread-safe running totals of the token usage reported by Claude responses"""
+
+    FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+    def __init__(self):
+        self.totals = {field: 0 for field in self.FIELDS}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage):
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            for field in self.FIELDS:
+                self.totals[field] += getattr(usage, field, None) or 0
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.totals, requests=self.requests)
+
+def cached_system_prompt(text):
+    """System prompt block marked for Anthropic prompt caching.
+
+    The cached prefix is the tool definitions plus the system prompt. Prefixes below the
+    model's minimum cacheable length are sent uncached at no extra cost, so caching starts
+    working on its own once the instructions grow long enough.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+def build_analysis_params(paper, compound_name):
+    """Messages API parameters for analyzing one paper (shared by interactive and batch modes)"""
+    prompt = ANALYSIS_USER_TEMPLATE.format(
+        compound_name=compound_name,
+        title=paper['title'],
+        abstract=paper['abstract']
+    )
+    return {
+        'model': CLAUDE_MODEL,
+        'max_tokens': 1500,
+        'temperature': 0.1,
+        'system': cached_system_prompt(ANALYSIS_SYSTEM_PROMPT),
+        'messages': [{"role": "user", "content": prompt}]
+    }
+
+def request_claude_analysis(paper, compound_name, anthropic_client, rate_limiter=None, usage=None):
+    """Send one paper to Claude and return the raw analysis text (raises on API errors)"""
+    message = create_claude_message(anthropic_client, rate_limiter, build_analysis_params(paper, compound_name), usage)
+    return message.content[0].text
+
+def _tool_use_block(message):
+    """The record_safety_analysis call in a response, or None"""
+    for block in message.content:
+        if getattr(block, 'type', None) == 'tool_use' and block.name == ANALYSIS_TOOL_NAME:
+            return block
+    return None
+
+def request_claude_structured_analysis(paper, compound_name, anthropic_client, rate_limiter=None, usage=None):
+    """Ask Claude for a record_safety_analysis tool call and validate it into a SafetyAnalysis.
+
+    Fields that are missing or malformed are re-asked for on their own, in the same
+    conversation, rather than analyzing the whole paper again. Raises ValueError if
+    fields are still missing after ANALYSIS_REPAIR_ATTEMPTS follow-ups.
+    """
+    params = build_analysis_params(paper, compound_name)
+    params['system'] = cached_system_prompt(TOOL_ANALYSIS_SYSTEM_PROMPT)
+    params['tools'] = [analysis_tool()]
+    params['tool_choice'] = {"type": "tool", "name": ANALYSIS_TOOL_NAME}
+    
+    values = {}
+    missing = list(ANALYSIS_TOOL_PROPERTIES)
+    for attempt in range(ANALYSIS_REPAIR_ATTEMPTS + 1):
+        message = create_claude_message(anthropic_client, rate_limiter, params, usage)
+        block = _tool_use_block(message)
+        received, _ = validate_analysis_fields(block.input if block is not None else None)
+        values.update({field: value for field, value in received.items() if field in missing})
+        missing = [field for field in missing if field not in values]
+        if not missing or block is None:
+            break
+        
+        # Re-ask only for what is still missing, continuing the same conversation
+        params = dict(params, tools=[analysis_tool(missing)], messages=params['messages'] + [
+            {"role": "assistant", "content": [{"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}]},
+            {"role": "user", "content": [{
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "is_error": True,
+                "content": f"These fields were missing or invalid: {', '.join(missing)}. Call {ANALYSIS_TOOL_NAME} again with only these fields."
+            }]}
+        ])
+    
+    if missing:
+        raise ValueError(f"Structured analysis incomplete, missing fields: {', '.join(missing)}")
+    return SafetyAnalysis(**values)
+
+def create_claude_message(anthropic_client, rate_limiter, params, usage=None):
+    """Call messages.create under the shared rate limiter, feeding it the response's rate-limit headers"""
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    
+    try:
+        raw_response = anthropic_client.messages.with_raw_response.create(**params)
+    except Exception as e:
+        # Rate-limit and overload errors carry the same headers; slow everyone down before re-raising
+        response = getattr(e, 'response', None)
+        if rate_limiter is not None and response is not None:
+            rate_limiter.update_from_headers(response.headers)
+        raise
+    
+    if rate_limiter is not None:
+        rate_limiter.update_from_headers(raw_response.headers)
+    
+    message = raw_response.parse()
+    if usage is not None:
+        usage.add(getattr(message, 'usage', None))
+    return message
+
+def estimate_tokens(text):
+    """Rough token estimate (about four characters per token) used for batch planning"""
+    return len(text) // 4 + 1
+
+def plan_analysis_batches(papers, max_batch_size=MAX_ABSTRACTS_PER_REQUEST, token_budget=BATCH_INPUT_TOKEN_BUDGET):
+    """Greedily group papers so each multi-abstract request stays under the input and output token budgets"""
+    max_batch_size = max(1, min(max_batch_size, CLAUDE_MAX_OUTPUT_TOKENS // BATCH_OUTPUT_TOKENS_PER_PAPER))
+    prompt_overhead = estimate_tokens(BATCH_ANALYSIS_SYSTEM_PROMPT) + estimate_tokens(BATCH_ANALYSIS_USER_TEMPLATE)
+    
+    batches = []
+    current = []
+    current_tokens = prompt_overhead
+    for paper in papers:
+        paper_tokens = estimate_tokens(paper['title']) + estimate_tokens(paper['abstract']) + 20
+        if current and (len(current) >= max_batch_size or current_tokens + paper_tokens > token_budget):
+            batches.append(current)
+            current = []
+            current_tokens = prompt_overhead
+        current.append(paper)
+        current_tokens += paper_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def request_claude_batch_analysis(papers, compound_name, anthropic_client, rate_limiter=None, usage=None):
+    """Analyze several papers in one request; returns the raw reply with one '=== PMID: ... ===' block per paper"""
+    papers_block = "".join(
+        BATCH_PAPER_TEMPLATE.format(pmid=paper['pmid'], title=paper['title'], abstract=paper['abstract'])
+        for paper in papers
+    )
+    prompt = BATCH_ANALYSIS_USER_TEMPLATE.format(
+        paper_count=len(papers),
+        compound_name=compound_name,
+        papers=papers_block
+    )
+    message = create_claude_message(anthropic_client, rate_limiter, {
+        'model': CLAUDE_MODEL,
+        'max_tokens': min(CLAUDE_MAX_OUTPUT_TOKENS, BATCH_OUTPUT_TOKENS_PER_PAPER * len(papers)),
+        'temperature': 0.1,
+        'system': cached_system_prompt(BATCH_ANALYSIS_SYSTEM_PROMPT),
+        'messages': [{"role": "user", "content": prompt}]
+    }, usage)
+    return message.content[0].text
+
+def fallback_analysis(error_msg):
+    """Analysis text used when Claude could not be reached"""
+    return f"""
+    ADVERSE_EVENTS_COUNT: 0
+    ADVERSE_EVENTS_LIST:
+    - Analysis failed due to API error
+    
+    DRUG_INTERACTIONS_COUNT: 0
+    DRUG_INTERACTIONS_LIST:
+    - Analysis failed due to API error
+    
+    CONTRAINDICATIONS_COUNT: 0
+    CONTRAINDICATIONS_LIST:
+    - Analysis failed due to API error
+    
+    SAFETY_SIGNALS_DETECTED:
+    - API Error: {error_msg}
+    
+    KEY_FINDINGS:
+    - Unable to analyze due to API connection issue
+    
+    REGULATORY_IMPACT:
+    - Analysis incomplete due to technical error
+    
+    SAFETY_DOMAINS:
+    - Other
+    
+    CLINICAL_SIGNIFICANCE:
+    - Analysis could not be completed
+    """
+
+def request_analysis_text(paper, compound_name, anthropic_client, rate_limiter=None, usage=None, output_mode=OUTPUT_MODE_TEXT):
+    """Analysis text for one paper in the given output mode (structured analyses as JSON)"""
+    if output_mode == OUTPUT_MODE_TOOL:
+        return request_claude_structured_analysis(paper, compound_name, anthropic_client, rate_limiter, usage).to_text()
+    return request_claude_analysis(paper, compound_name, anthropic_client, rate_limiter, usage)
+
+def analyze_with_claude(paper, compound_name, anthropic_client, rate_limiter=None, output_mode=OUTPUT_MODE_TEXT):
+    """Analyze a paper using Claude AI with structured risk assessment"""
+    try:
+        return request_analysis_text(paper, compound_name, anthropic_client, rate_limiter, output_mode=output_mode)
+    except Exception as e:
+        return fallback_analysis(f"Claude API Error: {str(e)}")
+
+def analyze_paper(paper, compound_name, anthropic_client, rate_limiter, cache=None, usage=None, output_mode=OUTPUT_MODE_TEXT):
+    """Analyze one paper, serving the cache first; returns (analysis_text, source)"""
+    prompt_version = TOOL_PROMPT_VERSION if output_mode == OUTPUT_MODE_TOOL else PROMPT_VERSION
+    if cache is not None:
+        cached_text = cache.get(paper['pmid'], compound_name, prompt_version=prompt_version)
+        if cached_text is not None:
+            return cached_text, 'cache'
+    try:
+        analysis_text = request_analysis_text(paper, compound_name, anthropic_client, rate_limiter, usage, output_mode)
+    except Exception as e:
+        return fallback_analysis(f"Claude API Error: {str(e)}"), 'error'
+    if cache is not None:
+        cache.put(paper['pmid'], compound_name, analysis_text, prompt_version=prompt_version)
+    return analysis_text, 'claude'
+
+def analyze_paper_batch(papers, compound_name, anthropic_client, rate_limiter, cache=None, max_batch_size=MAX_ABSTRACTS_PER_REQUEST, usage=None):
+    """Analyze papers packing several abstracts per request; returns [(paper, analysis_text, source)].
+
+    Papers missing from a multi-abstract reply are re-analyzed one at a time. Cached
+    analyses from either prompt are served, since papers that ended up alone in a group
+    were analyzed (and cached) with the single-paper prompt.
+    """
+    results = []
+    pending = []
+    for paper in papers:
+        cached_text = cache.get(paper['pmid'], compound_name, prompt_version=(BATCH_PROMPT_VERSION, PROMPT_VERSION)) if cache is not None else None
+        if cached_text is not None:
+            results.append((paper, cached_text, 'cache'))
+        else:
+            pending.append(paper)
+    
+    for group in plan_analysis_batches(pending, max_batch_size):
+        if len(group) == 1:
+            analysis_text, source = analyze_paper(group[0], compound_name, anthropic_client, rate_limiter, cache, usage)
+            results.append((group[0], analysis_text, source))
+            continue
+        
+        try:
+            blocks = split_batched_analysis(request_claude_batch_analysis(group, compound_name, anthropic_client, rate_limiter, usage))
+        except Exception as e:
+            error_text = fallback_analysis(f"Claude API Error: {str(e)}")
+            results.extend((paper, error_text, 'error') for paper in group)
+            continue
+        
+        for paper in group:
+            analysis_text = blocks.get(paper['pmid'])
+            if analysis_text is None:
+                analysis_text, source = analyze_paper(paper, compound_name, anthropic_client, rate_limiter, cache, usage)
+                results.append((paper, analysis_text, source))
+                continue
+            if cache is not None:
+                cache.put(paper['pmid'], compound_name, analysis_text, prompt_version=BATCH_PROMPT_VERSION)
+            results.append((paper, analysis_text, 'claude'))
+    
+    return results
+
+_PIPELINE_DONE = object()
+
+class SharedArticleStore:
+    """In-memory layer over an optional PubMedArticleStore, shared by every compound in a scan.
+
+    A paper that several compounds' searches return is fetched from PubMed once per run:
+    get_many() claims the PMIDs the caller will have to fetch, and a concurrent search
+    that needs a claimed PMID waits for put_many() to deliver it instead of fetching it
+    again. Claims a search leaves unfulfilled are dropped by release().
+    """
+
+    CLAIM_WAIT_SECONDS = 120
+
+    def __init__(self, backing_store=None):
+        self.backing_store = backing_store
+        self._records = {}
+        self._claims = {}
+        self._changed = threading.Condition()
+
+    def get_many(self, pmids):
+        owner = threading.get_ident()
+        deadline = time.monotonic() + self.CLAIM_WAIT_SECONDS
+        with self._changed:
+            # Wait for PMIDs another search is already fetching
+            while True:
+                pending = [pmid for pmid in pmids if pmid not in self._records and self._claims.get(pmid, owner) != owner]
+                remaining = deadline - time.monotonic()
+                if not pending or remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            found = {pmid: self._records[pmid] for pmid in pmids if pmid in self._records}
+        
+        missing = [pmid for pmid in pmids if pmid not in found]
+        if missing and self.backing_store is not None:
+            stored = self.backing_store.get_many(missing)
+            found.update(stored)
+        
+        with self._changed:
+            self._records.update((pmid, record) for pmid, record in found.items())
+            for pmid in pmids:
+                if pmid not in found:
+                    self._claims[pmid] = owner
+        return found
+
+    def put_many(self, records):
+        with self._changed:
+            for record in records:
+                self._records[record['pmid']] = record
+                self._claims.pop(record['pmid'], None)
+            self._changed.notify_all()
+        if self.backing_store is not None:
+            self.backing_store.put_many(records)
+
+    def release(self):
+        """Drop the calling thread's unfulfilled claims so waiting searches fetch those PMIDs themselves"""
+        owner = threading.get_ident()
+        with self._changed:
+            for pmid in [pmid for pmid, claimant in self._claims.items() if claimant == owner]:
+                del self._claims[pmid]
+            self._changed.notify_all()
+
+def run_portfolio_scan(compounds, anthropic_client, max_results=20, therapeutic_area=None, max_years_back=25, max_in_flight=DEFAULT_MAX_IN_FLIGHT, cache=None, article_store=None, fetch_mode="history", eutils=None, rate_limiter=None, abstracts_per_request=DEFAULT_ABSTRACTS_PER_REQUEST, usage=None, output_mode=OUTPUT_MODE_TEXT, synonyms=None, fetch_workers=PORTFOLIO_FETCH_WORKERS, date_ranges=None, skip_pmids=None, result_limits=None):
+    """Scan several compounds through one shared scheduler: PubMed fetch -> Claude analysis -> parse.
+
+    fetch_workers threads take compounds from a shared queue and stream their papers into
+    one bounded paper queue; a single pool of max_in_flight workers analyzes papers from
+    every compound as they arrive, and the caller's thread parses the results. All PubMed
+    calls go through one EutilsClient and all Claude calls through one rate limiter, so
+    throughput is bound by the API rate limits rather than by compounds running one after
+    another. Papers returned for several compounds are fetched once and analyzed per
+    compound. With abstracts_per_request > 1 each worker packs up to that many queued
+    papers of the same compound per request; the structured tool-use output mode always
+    sends one paper per request.
+
+    synonyms maps compound -> synonym list (looked up with drug_synonyms() when missing);
+    date_ranges, skip_pmids and result_limits map compound -> iter_pubmed_search()
+    date_range / skip_pmids / max_results (compounds missing from result_limits use max_results).
+    Yields (event, payload) tuples in the caller's thread, so UI updates stay there:
+      ('notice', (level, message))   status message from the fetch stage
+      ('found', (compound, pmids))   esearch result for one compound, in publication-date order
+      ('analyzed', (paper, source))  paper, tagged with its 'compound', with parsed 'analysis' attached
+      ('error', (compound, error))   fetching one compound failed; the other compounds continue
+    """
+    compounds = list(dict.fromkeys(compound.strip() for compound in compounds if compound.strip()))
+    if rate_limiter is None:
+        rate_limiter = TokenBucketRateLimiter(DEFAULT_CLAUDE_REQUESTS_PER_MINUTE / 60.0, capacity=max_in_flight)
+    eutils = eutils or EutilsClient()
+    shared_store = SharedArticleStore(article_store)
+    
+    if output_mode == OUTPUT_MODE_TOOL:
+        abstracts_per_request = 1
+    synonyms = dict(synonyms or {})
+    for compound_name in compounds:
+        if compound_name not in synonyms:
+            synonyms[compound_name] = drug_synonyms(compound_name)
+    
+    worker_count = max(1, max_in_flight)
+    fetch_count = max(1, min(fetch_workers, len(compounds)))
+    compound_queue = queue.Queue()
+    for compound_name in compounds:
+        compound_queue.put(compound_name)
+    paper_queue = queue.Queue(maxsize=worker_count * 2)
+    result_queue = queue.Queue(maxsize=worker_count * 4)
+    stop = threading.Event()
+    fetchers_running = [fetch_count]
+    fetchers_lock = threading.Lock()
+    
+    def put(target, item):
+        # Give up if the consumer went away, so no thread blocks forever on a full queue
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def fetch_stage():
+        try:
+            while not stop.is_set():
+                try:
+                    compound_name = compound_queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    for paper in iter_pubmed_search(
+                        compound_name, (result_limits or {}).get(compound_name, max_results), therapeutic_area, max_years_back,
+                        article_store=shared_store, fetch_mode=fetch_mode, eutils=eutils,
+                        notify=lambda level, message: put(result_queue, ('notice', (level, message))),
+                        on_found=lambda pmids, compound_name=compound_name: put(result_queue, ('found', (compound_name, pmids))),
+                        synonyms=synonyms[compound_name],
+                        date_range=(date_ranges or {}).get(compound_name),
+                        skip_pmids=(skip_pmids or {}).get(compound_name)
+                    ):
+                        paper['compound'] = compound_name
+                        if not put(paper_queue, (compound_name, paper)):
+                            return
+                except Exception as e:
+                    put(result_queue, ('error', (compound_name, e)))
+                finally:
+                    shared_store.release()
+        finally:
+            # The last fetcher to finish releases the analysis workers
+            with fetchers_lock:
+                fetchers_running[0] -= 1
+                last_fetcher = fetchers_running[0] == 0
+            if last_fetcher:
+                for _ in range(worker_count):
+                    put(paper_queue, _PIPELINE_DONE)
+    
+    def analysis_stage():
+        fetch_finished = False
+        try:
+            while not fetch_finished and not stop.is_set():
+                try:
+                    item = paper_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _PIPELINE_DONE:
+                    break
+                
+                # Take whatever else is already queued, up to the batch size
+                batch = [item]
+                while len(batch) < abstracts_per_request:
+                    try:
+                        queued = paper_queue.get(timeout=0.05)
+                    except queue.Empty:
+                        break
+                    if queued is _PIPELINE_DONE:
+                        fetch_finished = True
+                        break
+                    batch.append(queued)
+                
+                try:
+                    if abstracts_per_request > 1:
+                        # Each request covers a single compound
+                        by_compound = {}
+                        for compound_name, paper in batch:
+                            by_compound.setdefault(compound_name, []).append(paper)
+                        results = []
+                        for compound_name, papers in by_compound.items():
+                            results.extend(analyze_paper_batch(papers, compound_name, anthropic_client, rate_limiter, cache, abstracts_per_request, usage))
+                    else:
+                        compound_name, paper = item
+                        analysis_text, source = analyze_paper(paper, compound_name, anthropic_client, rate_limiter, cache, usage, output_mode)
+                        results = [(paper, analysis_text, source)]
+                except Exception as e:
+                    # e.g. a locked shared cache: these papers fail, the worker keeps going
+                    error_text = fallback_analysis(f"Analysis error: {str(e)}")
+                    results = [(paper, error_text, 'error') for _, paper in batch]
+                
+                for result in results:
+                    if not put(result_queue, ('analysis', result)):
+                        return
+        finally:
+            # Always report back, or the consumer would wait for this worker forever
+            put(result_queue, ('worker_done', None))
+    
+    threads = [threading.Thread(target=fetch_stage, name=f"papersafe-fetch-{i}", daemon=True) for i in range(fetch_count)]
+    threads += [threading.Thread(target=analysis_stage, name=f"papersafe-analyze-{i}", daemon=True) for i in range(worker_count)]
+    for thread in threads:
+        thread.start()
+    
+    try:
+        workers_running = worker_count
+        while workers_running:
+            event, payload = result_queue.get()
+            if event == 'worker_done':
+                workers_running -= 1
+            elif event == 'analysis':
+                # Parse stage runs here, in the consumer's thread
+                paper, analysis_text, source = payload
+                paper['analysis'] = parse_claude_analysis(analysis_text)
+                yield 'analyzed', (paper, source)
+            else:
+                yield event, payload
+        
+        # Drain anything the fetch stage reported after the last worker finished
+        while not result_queue.empty():
+            event, payload = result_queue.get_nowait()
+            if event in ('notice', 'found', 'error'):
+                yield event, payload
+    finally:
+        stop.set()
+
+class BulkScanStore:
+    """SQLite record of submitted Message Batches so bulk scans survive app restarts"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(PAPERSAFE_DATA_DIR, "bulk_scans.sqlite3")
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bulk_jobs (
+                batch_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                compounds TEXT NOT NULL,
+                request_count INTEGER NOT NULL,
+                collected_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS bulk_requests (
+                batch_id TEXT NOT NULL,
+                custom_id TEXT NOT NULL,
+                compound TEXT NOT NULL,
+                paper TEXT NOT NULL,
+                analysis_text TEXT,
+                PRIMARY KEY (batch_id, custom_id)
+            );
+        """)
+        self._conn.commit()
+
+    def add_job(self, batch_id, compounds, requests_by_id, cached_analyses=None):
+        """Record a submitted batch, the paper behind each custom_id and any analyses served from cache"""
+        cached_analyses = cached_analyses or {}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bulk_jobs VALUES (?, ?, ?, ?, ?, NULL)",
+                (batch_id, time.time(), 'in_progress', json.dumps(sorted(compounds)), len(requests_by_id))
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO bulk_requests VALUES (?, ?, ?, ?, ?)",
+                [(batch_id, custom_id, compound, json.dumps(paper), None) for custom_id, (compound, paper) in requests_by_id.items()] +
+                [(batch_id, custom_id, compound, json.dumps(paper), analysis_text) for custom_id, (compound, paper, analysis_text) in cached_analyses.items()]
+            )
+            self._conn.commit()
+
+    def jobs(self):
+        """All jobs, newest first, as dicts"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT batch_id, created_at, status, compounds, request_count, collected_at FROM bulk_jobs ORDER BY created_at DESC"
+            ).fetchall()
+        return [
+            {
+                'batch_id': batch_id,
+                'created_at': created_at,
+                'status': status,
+                'compounds': json.loads(compounds),
+                'request_count': request_count,
+                'collected_at': collected_at
+            }
+            for batch_id, created_at, status, compounds, request_count, collected_at in rows
+        ]
+
+    def set_status(self, batch_id, status):
+        with self._lock:
+            self._conn.execute("UPDATE bulk_jobs SET status = ? WHERE batch_id = ?", (status, batch_id))
+            self._conn.commit()
+
+    def request(self, batch_id, custom_id):
+        """Return (compound, paper) for one custom_id, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT compound, paper FROM bulk_requests WHERE batch_id = ? AND custom_id = ?", (batch_id, custom_id)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save_results(self, batch_id, analyses):
+        """Store {custom_id: analysis_text} and mark the job collected"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE bulk_requests SET analysis_text = ? WHERE batch_id = ? AND custom_id = ?",
+                [(analysis_text, batch_id, custom_id) for custom_id, analysis_text in analyses.items()]
+            )
+            self._conn.execute(
+                "UPDATE bulk_jobs SET status = 'collected', collected_at = ? WHERE batch_id = ?", (time.time(), batch_id)
+            )
+            self._conn.commit()
+
+    def results(self, batch_id):
+        """Yield (compound, paper, analysis_text) for every collected request"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT compound, paper, analysis_text FROM bulk_requests WHERE batch_id = ? AND analysis_text IS NOT NULL ORDER BY rowid",
+                (batch_id,)
+            ).fetchall()
+        for compound, paper, analysis_text in rows:
+            yield compound, json.loads(paper), analysis_text
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def message_batches(anthropic_client):
+    """The client's Message Batches resource (GA or beta namespace, depending on SDK version)"""
+    batches = getattr(anthropic_client.messages, 'batches', None)
+    return batches if batches is not None else anthropic_client.beta.messages.batches
+
+def submit_bulk_scan(compounds, batch_client, bulk_store, max_results=BULK_PAPERS_PER_COMPOUND, max_years_back=25, article_store=None, cache=None, notify=log_notify, eutils=None):
+    """Fetch papers for every compound and submit their analyses as Message Batches.
+
+    batch_client is anything with create(requests=...), retrieve(batch_id) and
+    results(batch_id), e.g. message_batches(client) or a local fake for testing.
+    Papers already in the analysis cache are skipped. Returns the submitted batch IDs.
+    """
+    requests_by_id = {}
+    cached_analyses = {}
+    for compound_name in compounds:
+        try:
+            for paper in iter_pubmed_search(compound_name, max_results, None, max_years_back, article_store=article_store, eutils=eutils, notify=lambda level, message: None, synonyms=drug_synonyms(compound_name)):
+                cached_text = cache.get(paper['pmid'], compound_name) if cache is not None else None
+                if cached_text is not None:
+                    cached_analyses[f"cached-{len(cached_analyses)}"] = (compound_name, paper, cached_text)
+                else:
+                    requests_by_id[f"req-{len(requests_by_id)}"] = (compound_name, paper)
+        except Exception as e:
+            notify('warning', f"Skipping {compound_name}: {str(e)}")
+    
+    if not requests_by_id:
+        notify('info', "Nothing to submit - every paper is already analyzed")
+        return []
+    
+    batch_ids = []
+    custom_ids = list(requests_by_id)
+    for i in range(0, len(custom_ids), BULK_MAX_REQUESTS_PER_BATCH):
+        chunk = {custom_id: requests_by_id[custom_id] for custom_id in custom_ids[i:i+BULK_MAX_REQUESTS_PER_BATCH]}
+        batch = batch_client.create(requests=[
+            {'custom_id': custom_id, 'params': build_analysis_params(paper, compound_name)}
+            for custom_id, (compound_name, paper) in chunk.items()
+        ])
+        # Cached analyses ride along with the first batch so its results are complete
+        bulk_store.add_job(batch.id, {compound for compound, _ in chunk.values()}, chunk, cached_analyses if not batch_ids else None)
+        batch_ids.append(batch.id)
+    
+    notify('success', f"✅ Submitted {len(requests_by_id)} analyses in {len(batch_ids)} batch(es)")
+    return batch_ids
+
+def collect_bulk_scan(batch_id, batch_client, bulk_store, cache=None):
+    """Poll a batch; once it has ended, store its results and return the processing status"""
+    batch = batch_client.retrieve(batch_id)
+    if batch.processing_status != 'ended':
+        bulk_store.set_status(batch_id, batch.processing_status)
+        return batch.processing_status
+    
+    analyses = {}
+    for entry in batch_client.results(batch_id):
+        if entry.result.type == 'succeeded':
+            analysis_text = entry.result.message.content[0].text
+            request = bulk_store.request(batch_id, entry.custom_id)
+            if cache is not None and request is not None:
+                cache.put(request[1]['pmid'], request[0], analysis_text)
+        else:
+            analysis_text = fallback_analysis(f"Message Batch request {entry.result.type}")
+        analyses[entry.custom_id] = analysis_text
+    
+    bulk_store.save_results(batch_id, analyses)
+    return 'collected'
+
+def load_bulk_scan_results(batch_id, bulk_store):
+    """Parsed, risk-scored papers from a collected batch, each tagged with its compound"""
+    results = AnalysisResultIndex()
+    for compound_name, paper, analysis_text in bulk_store.results(batch_id):
+        paper['compound'] = compound_name
+        paper['analysis'] = parse_claude_analysis(analysis_text)
+        results.add(paper)
+    return results.papers()
+
+class AnalysisResultIndex:
+    """Ordered collection of analyzed papers keyed by PMID, per compound for compound-tagged papers.
+
+    Adding a paper whose key is already present replaces the existing entry in place
+    instead of appending a duplicate, so every count and export row is per unique paper.
+    """
+
+    def __init__(self, papers=()):
+        self._papers = {}
+        for paper in papers:
+            self.add(paper)
+
+    @staticmethod
+    def key_for(paper):
+        pmid = paper.get('pmid')
+        if not pmid or pmid == "Unknown":
+            # Records without a PMID are keyed by title so they still de-duplicate
+            pmid = f"title:{paper.get('title', '').strip().lower()}"
+        # Multi-compound results keep one entry per compound and paper
+        compound = paper.get('compound')
+        return (compound.strip().lower(), pmid) if compound else pmid
+
+    def add(self, paper):
+        """Insert or replace a paper; returns True if its PMID was not indexed yet"""
+        key = self.key_for(paper)
+        is_new = key not in self._papers
+        self._papers[key] = paper
+        return is_new
+
+    def get(self, pmid, compound=None):
+        """The indexed paper with this PMID (for this compound, if results are compound-tagged), or None"""
+        return self._papers.get(self.key_for({'pmid': pmid, 'compound': compound}))
+
+    def reorder(self, found):
+        """Sort entries by their position in found, a list of (compound, pmid) pairs (entries not in it go last)"""
+        position = {}
+        for compound, pmid in found:
+            position.setdefault(self.key_for({'pmid': pmid, 'compound': compound}), len(position))
+        ordered = sorted(self._papers.items(), key=lambda item: position.get(item[0], len(position)))
+        self._papers = dict(ordered)
+
+    def papers(self):
+        return list(self._papers.values())
+
+    def __contains__(self, paper):
+        """Whether a paper with the same key (PMID and compound) is indexed"""
+        return self.key_for(paper) in self._papers
+
+    def __len__(self):
+        return len(self._papers)
+
+    def __iter__(self):
+        return iter(self._papers.values())
+
+# Section headers of the analysis format, and the result fields their bullet lists fill
+ANALYSIS_LIST_SECTIONS = {
+    'ADVERSE_EVENTS_LIST': 'adverse_events',
+    'DRUG_INTERACTIONS_LIST': 'drug_interactions',
+    'CONTRAINDICATIONS_LIST': 'contraindications',
+    'SAFETY_SIGNALS_DETECTED': 'other_signals',
+    'KEY_FINDINGS': 'key_findings',
+    'SAFETY_DOMAINS': 'safety_domains',
+    'CLINICAL_SIGNIFICANCE': 'clinical_significance'
+}
+ANALYSIS_COUNT_SECTIONS = {
+    'ADVERSE_EVENTS_COUNT': 'adverse_events_count',
+    'DRUG_INTERACTIONS_COUNT': 'drug_interactions_count',
+    'CONTRAINDICATIONS_COUNT': 'contraindications_count'
+}
+_SECTION_HEADER_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ_")
+
+SERIOUS_AE_KEYWORDS = [
+    "death", "fatal", "mortality", "life-threatening", "hospitalization", 
+    "serious adverse event", "severe", "toxicity", "black box warning",
+    "discontinuation", "withdrawal", "contraindicated"
+]
+
+class SeriousTermScanner:
+    """Aho-Corasick automaton matching every serious term in one pass over the text.
+
+    Matching is case-insensitive and only counts whole words/phrases, so "severe" does
+    not match inside "persevered". Plural forms ("deaths", "serious adverse events",
+    "toxicities") are compiled in too and counted under their base term. Scan time is
+    linear in the text length (plus the number of matches) however many terms are
+    compiled in.
+    """
+
+    def __init__(self, terms):
+        self.terms = sorted({term.strip().lower() for term in terms if term.strip()})
+        # (form, term index) for every term and its plural forms
+        self._forms = [(form, term_index) for term_index, term in enumerate(self.terms) for form in self.inflections(term)]
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        
+        for form_index, (form, _) in enumerate(self._forms):
+            node = 0
+            for char in form:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(form_index)
+        
+        # Breadth-first failure links; each node also inherits the outputs of its failure node
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self._goto[node].items():
+                pending.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    @staticmethod
+    def inflections(term):
+        """The term plus the plural forms of its last word"""
+        forms = [term, term + "s", term + "es"]
+        if term.endswith("y") and term[-2:-1] not in ("", "a", "e", "o", "u"):
+            forms.append(term[:-1] + "ies")
+        return forms
+
+    def find_all(self, text):
+        """Return [(start, end, term)] for every whole-word match, in text order"""
+        text = text.lower()
+        goto, fail, output, forms, terms = self._goto, self._fail, self._output, self._forms, self.terms
+        text_length = len(text)
+        matches = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for form_index in output[node]:
+                form, term_index = forms[form_index]
+                end = position + 1
+                start = end - len(form)
+                if (start == 0 or not text[start - 1].isalnum()) and (end == text_length or not text[end].isalnum()):
+                    matches.append((start, end, terms[term_index]))
+        matches.sort()
+        return matches
+
+    def scan(self, text):
+        """Summary of one scan: distinct terms found, total matches and match positions"""
+        matches = self.find_all(text)
+        term_counts = {}
+        for _, _, term in matches:
+            term_counts[term] = term_counts.get(term, 0) + 1
+        return {
+            'terms': term_counts,
+            'distinct_count': len(term_counts),
+            'match_count': len(matches),
+            'positions': [(start, end) for start, end, _ in matches]
+        }
+
+def load_serious_terms(path=SERIOUS_TERMS_FILE):
+    """Built-in serious terms plus any from a one-term-per-line file ('#' starts a comment)"""
+    terms = list(SERIOUS_AE_KEYWORDS)
+    if path:
+        with open(path, encoding='utf-8') as handle:
+            terms.extend(line.split('#', 1)[0].strip() for line in handle)
+    return terms
+
+SERIOUS_TERM_SCANNER = SeriousTermScanner(load_serious_terms())
+
+def _section_header(line):
+    """Return (SECTION_NAME, inline_text) if the line opens a 'NAME:' section, else None"""
+    stripped = line.strip().lstrip('*#').lstrip()
+    name, colon, rest = stripped.partition(':')
+    name = name.strip('* ')
+    if not colon or not name or not _SECTION_HEADER_CHARS.issuperset(name.upper()):
+        return None
+    return name.upper(), rest.lstrip('* ').strip()
+
+def _leading_int(text):
+    """Parse the digits at the start of text (after whitespace), or None"""
+    text = text.lstrip()
+    end = 0
+    while end < len(text) and text[end].isdigit():
+        end += 1
+    return int(text[:end]) if end else None
+
+def _empty_analysis_fields():
+    fields = {field: 0 for field in ANALYSIS_COUNT_SECTIONS.values()}
+    fields.update({field: [] for field in ANALYSIS_LIST_SECTIONS.values()})
+    fields['regulatory_impact'] = None
+    return fields
+
+def _fields_from_json(payload):
+    """Map a structured (JSON / tool-use) analysis onto the same fields as the text format"""
+    fields = _empty_analysis_fields()
+    for field in ANALYSIS_COUNT_SECTIONS.values():
+        value = payload.get(field)
+        fields[field] = int(value) if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()) else 0
+    aliases = {'other_signals': ('other_signals', 'safety_signals_detected')}
+    for field in ANALYSIS_LIST_SECTIONS.values():
+        for key in aliases.get(field, (field,)):
+            value = payload.get(key)
+            if value:
+                fields[field] = [str(item).strip() for item in value if str(item).strip()] if isinstance(value, list) else [str(value).strip()]
+                break
+    impact = payload.get('regulatory_impact')
+    if isinstance(impact, list):
+        impact = "\n".join(f"- {item}" for item in impact)
+    fields['regulatory_impact'] = impact.strip() if isinstance(impact, str) and impact.strip() else None
+    return fields
+
+def extract_analysis_fields(analysis_text):
+    """Walk a Claude reply once, returning its counts, bullet lists and regulatory text.
+
+    Each line either opens a 'SECTION:' header or belongs to the current section,
+    so the *_COUNT values and '-' bullets are all read in a single scan instead of
+    one regex search per field. A JSON object (e.g. structured tool-use output) is
+    accepted as well.
+    """
+    stripped_text = analysis_text.strip()
+    if stripped_text.startswith('{'):
+        try:
+            payload = json.loads(stripped_text)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            return _fields_from_json(payload)
+    
+    fields = _empty_analysis_fields()
+    seen_counts = set()
+    regulatory_lines = None
+    regulatory_done = False
+    section = None
+    
+    for line in analysis_text.split('\n'):
+        header = _section_header(line)
+        if header is not None:
+            section, inline = header
+            if section in ANALYSIS_COUNT_SECTIONS:
+                count = _leading_int(inline)
+                if count is not None and section not in seen_counts:
+                    fields[ANALYSIS_COUNT_SECTIONS[section]] = count
+                    seen_counts.add(section)
+            if regulatory_lines is not None:
+                regulatory_done = True
+            if section == 'REGULATORY_IMPACT' and regulatory_lines is None:
+                regulatory_lines = [inline]
+                regulatory_done = False
+            continue
+        
+        if section is None:
+            continue
+        if section in ANALYSIS_LIST_SECTIONS:
+            item = line.strip()
+            if item.startswith('-'):
+                fields[ANALYSIS_LIST_SECTIONS[section]].append(item.strip('- ').strip())
+        elif section in ANALYSIS_COUNT_SECTIONS:
+            # Count written on the line after its header
+            if section not in seen_counts and line.strip():
+                count = _leading_int(line)
+                if count is not None:
+                    fields[ANALYSIS_COUNT_SECTIONS[section]] = count
+                seen_counts.add(section)
+        elif section == 'REGULATORY_IMPACT' and not regulatory_done:
+            regulatory_lines.append(line)
+    
+    if regulatory_lines is not None:
+        fields['regulatory_impact'] = '\n'.join(regulatory_lines).strip() or None
+    return fields
+
+# Risk thresholds, applied to whole columns of the analysis table at once by score_risk_levels()
+RISK_THRESHOLDS = {
+    'high_total_signals': 5,
+    'high_contraindications': 2,
+    'high_interactions': 3,
+    'medium_total_signals': 2,
+    'medium_contraindications': 1,
+    'medium_interactions': 1,
+    'serious_terms_high': 3,
+    'serious_terms_medium': 1
+}
+
+def score_risk_levels(ae_counts, interaction_counts, contraindication_counts, serious_counts, thresholds=RISK_THRESHOLDS):
+    """Vectorized risk levels for arrays of per-paper counts.
+
+    Returns (base_levels, risk_levels): the level from the signal counts alone, and the
+    level after upgrades for serious safety terms in the analysis text.
+    """
+    ae_counts = np.asarray(ae_counts, dtype=np.int64)
+    interaction_counts = np.asarray(interaction_counts, dtype=np.int64)
+    contraindication_counts = np.asarray(contraindication_counts, dtype=np.int64)
+    serious_counts = np.asarray(serious_counts, dtype=np.int64)
+    total_signals = ae_counts + interaction_counts + contraindication_counts
+    
+    base_levels = np.select(
+        [
+            (total_signals >= thresholds['high_total_signals'])
+            | (contraindication_counts >= thresholds['high_contraindications'])
+            | (interaction_counts >= thresholds['high_interactions']),
+            (total_signals >= thresholds['medium_total_signals'])
+            | (contraindication_counts >= thresholds['medium_contraindications'])
+            | (interaction_counts >= thresholds['medium_interactions'])
+        ],
+        ["HIGH", "MEDIUM"],
+        default="LOW"
+    )
+    risk_levels = np.select(
+        [
+            serious_counts >= thresholds['serious_terms_high'],
+            (serious_counts >= thresholds['serious_terms_medium']) & (base_levels == "LOW")
+        ],
+        ["HIGH", "MEDIUM"],
+        default=base_levels
+    )
+    return base_levels, risk_levels
+
+def calculate_risk_level(analysis_text, fields=None):
+    """Calculate risk level based on systematic scoring of safety signals"""
+    try:
+        # Extract counts from Claude's analysis
+        if fields is None:
+            fields = extract_analysis_fields(analysis_text)
+        ae_count = fields['adverse_events_count']
+        interaction_count = fields['drug_interactions_count']
+        contraindication_count = fields['contraindications_count']
+        
+        # Calculate risk score
+        total_safety_signals = ae_count + interaction_count + contraindication_count
+        
+        # Check for serious adverse events in text (additional risk factors) in a single scan
+        serious_scan = SERIOUS_TERM_SCANNER.scan(analysis_text)
+        serious_count = serious_scan['distinct_count']
+        
+        # Same scoring as the analysis table, on a single row
+        base_levels, risk_levels = score_risk_levels([ae_count], [interaction_count], [contraindication_count], [serious_count])
+        base_level = str(base_levels[0])
+        risk_level = str(risk_levels[0])
+        
+        if total_safety_signals > 0:
+            risk_rationale = f"{base_level.capitalize()} risk: {ae_count} adverse events, {interaction_count} drug interactions, {contraindication_count} contraindications"
+        else:
+            risk_rationale = "No specific safety signals identified"
+        
+        # Note upgrades for serious events mentioned
+        if risk_level != base_level:
+            risk_rationale += f" (upgraded due to {serious_count} serious safety terms)"
+        
+        return {
+            'risk_level': risk_level,
+            'risk_rationale': risk_rationale,
+            'adverse_events_count': ae_count,
+            'drug_interactions_count': interaction_count,
+            'contraindications_count': contraindication_count,
+            'total_safety_signals': total_safety_signals,
+            'serious_terms_count': serious_count,
+            'serious_terms': serious_scan['terms'],
+            'serious_term_positions': serious_scan['positions']
+        }
+        
+    except Exception as e:
+        return {
+            'risk_level': 'UNKNOWN',
+            'risk_rationale': f'Error calculating risk: {str(e)}',
+            'adverse_events_count': 0,
+            'drug_interactions_count': 0,
+            'contraindications_count': 0,
+            'total_safety_signals': 0,
+            'serious_terms_count': 0,
+            'serious_terms': {},
+            'serious_term_positions': []
+        }
+
+def parse_claude_analysis(analysis_text):
+    """Parse Claude's analysis into structured data with enhanced risk assessment"""
+    try:
+        # One pass over the reply feeds both the lists and the risk scoring
+        fields = extract_analysis_fields(analysis_text)
+        risk_data = calculate_risk_level(analysis_text, fields)
+        
+        adverse_events = fields['adverse_events']
+        drug_interactions = fields['drug_interactions']
+        contraindications = fields['contraindications']
+        other_signals = fields['other_signals']
+        
+        # Combine all safety signals for display
+        all_safety_signals = adverse_events + drug_interactions + contraindications + other_signals
+        
+        # Free-text domains collapse onto the fixed vocabulary from the prompt
+        domain_mask = safety_domain_mask(fields['safety_domains'])
+        
+        return {
+            'risk_level': risk_data['risk_level'],
+            'risk_rationale': risk_data['risk_rationale'],
+            'adverse_events_count': risk_data['adverse_events_count'],
+            'drug_interactions_count': risk_data['drug_interactions_count'],
+            'contraindications_count': risk_data['contraindications_count'],
+            'total_safety_signals': risk_data['total_safety_signals'],
+            'serious_terms_count': risk_data['serious_terms_count'],
+            'serious_terms': risk_data['serious_terms'],
+            'serious_term_positions': risk_data['serious_term_positions'],
+            'adverse_events': adverse_events,
+            'drug_interactions': drug_interactions,
+            'contraindications': contraindications,
+            'safety_signals': all_safety_signals,  # Combined list for backwards compatibility
+            'other_signals': other_signals,
+            'key_findings': fields['key_findings'],
+            'regulatory_impact': fields['regulatory_impact'] or "No specific regulatory action identified",
+            'safety_domains': safety_domain_names(domain_mask),
+            'safety_domain_mask': domain_mask,
+            'full_analysis': analysis_text
+        }
+        
+    except Exception as e:
+        return {
+            'risk_level': 'UNKNOWN',
+            'risk_rationale': 'Analysis parsing error',
+            'adverse_events_count': 0,
+            'drug_interactions_count': 0,
+            'contraindications_count': 0,
+            'total_safety_signals': 0,
+            'serious_terms_count': 0,
+            'serious_terms': {},
+            'serious_term_positions': [],
+            'adverse_events': [],
+            'drug_interactions': [],
+            'contraindications': [],
+            'safety_signals': [],
+            'other_signals': [],
+            'key_findings': [],
+            'regulatory_impact': 'Analysis parsing error',
+            'safety_domains': [],
+            'safety_domain_mask': 0,
+            'full_analysis': analysis_text
+        }
+
+def split_batched_analysis(analysis_text):
+    """Split a multi-abstract reply into {pmid: analysis_text} using its '=== PMID: ... ===' headers.
+
+    Markdown decoration around a header (e.g. '**=== PMID: 333 ===**' or '## === PMID: 333 ===')
+    is ignored.
+    """
+    blocks = {}
+    current_pmid = None
+    current_lines = []
+    for line in analysis_text.split('\n'):
+        stripped = line.strip().strip('*#').strip()
+        if stripped.startswith('===') and stripped.endswith('===') and 'PMID' in stripped.upper():
+            if current_pmid is not None:
+                blocks[current_pmid] = '\n'.join(current_lines).strip()
+            header = stripped.strip('= ').strip()
+            current_pmid = header.split(':', 1)[1] if ':' in header else header.split()[-1]
+            current_pmid = current_pmid.strip().strip('*#').strip()
+            current_lines = []
+        elif current_pmid is not None:
+            current_lines.append(line)
+    if current_pmid is not None:
+        blocks[current_pmid] = '\n'.join(current_lines).strip()
+    
+    # Ignore empty blocks so the paper is re-analyzed on its own
+    return {pmid: text for pmid, text in blocks.items() if text}
+
+def _joined(items):
+    return '; '.join(items or [])
+
+def build_analysis_table(analyzed_papers, thresholds=RISK_THRESHOLDS):
+    """Columnar view of analyzed papers: one row per paper with its counts and risk scores.
+
+    Metrics, filters and exports read from this table, so re-scoring with different
+    thresholds is a single vectorized pass (see rescore_analysis_table).
+    """
+    analyses = [paper.get('analysis', {}) for paper in analyzed_papers]
+    table = pd.DataFrame({
+        'pmid': [paper.get('pmid', '') for paper in analyzed_papers],
+        'title': [paper.get('title', '') for paper in analyzed_papers],
+        'authors': [paper.get('authors', '') for paper in analyzed_papers],
+        'pub_date': [paper.get('pub_date', '') for paper in analyzed_papers],
+        'url': [paper.get('url', '') for paper in analyzed_papers],
+        'compound': [paper.get('compound', '') for paper in analyzed_papers],
+        'adverse_events_count': np.fromiter((a.get('adverse_events_count', 0) for a in analyses), dtype=np.int64, count=len(analyses)),
+        'drug_interactions_count': np.fromiter((a.get('drug_interactions_count', 0) for a in analyses), dtype=np.int64, count=len(analyses)),
+        'contraindications_count': np.fromiter((a.get('contraindications_count', 0) for a in analyses), dtype=np.int64, count=len(analyses)),
+        'serious_terms_count': np.fromiter((a.get('serious_terms_count', 0) for a in analyses), dtype=np.int64, count=len(analyses)),
+        # Papers whose analysis could not be parsed stay UNKNOWN whatever the thresholds
+        'parse_failed': np.fromiter((a.get('risk_level', 'UNKNOWN') == 'UNKNOWN' for a in analyses), dtype=bool, count=len(analyses)),
+        'safety_signals': [_joined(a.get('safety_signals')) for a in analyses],
+        'safety_domain_mask': np.fromiter((analysis_domain_mask(a) for a in analyses), dtype=np.int64, count=len(analyses)),
+        'regulatory_impact': [a.get('regulatory_impact', '') for a in analyses]
+    })
+    return rescore_analysis_table(table, thresholds)
+
+def rescore_analysis_table(table, thresholds=RISK_THRESHOLDS):
+    """Recompute total_safety_signals, risk_level and fda_reporting for every row in place"""
+    table['total_safety_signals'] = table['adverse_events_count'] + table['drug_interactions_count'] + table['contraindications_count']
+    _, risk_levels = score_risk_levels(
+        table['adverse_events_count'].to_numpy(), table['drug_interactions_count'].to_numpy(),
+        table['contraindications_count'].to_numpy(), table['serious_terms_count'].to_numpy(), thresholds
+    )
+    table['risk_level'] = np.where(table['parse_failed'].to_numpy(), "UNKNOWN", risk_levels)
+    
+    # Papers requiring FDA reporting: high risk or a regulatory impact mentioning FDA/reporting
+    regulatory = table['regulatory_impact'].fillna('').astype(str).str.lower()
+    table['fda_reporting'] = (table['risk_level'] == 'HIGH') | regulatory.str.contains('fda', regex=False) | regulatory.str.contains('reporting', regex=False)
+    return table
+
+def summarize_analysis_table(table):
+    """Executive summary metrics, each a single column reduction"""
+    risk_counts = table['risk_level'].value_counts()
+    return {
+        'total_papers': len(table),
+        'high_risk': int(risk_counts.get('HIGH', 0)),
+        'medium_risk': int(risk_counts.get('MEDIUM', 0)),
+        'low_risk': int(risk_counts.get('LOW', 0)),
+        'unknown_risk': int(risk_counts.get('UNKNOWN', 0)),
+        'fda_reporting': int(table['fda_reporting'].sum()),
+        'adverse_events': int(table['adverse_events_count'].sum()),
+        'drug_interactions': int(table['drug_interactions_count'].sum()),
+        'contraindications': int(table['contraindications_count'].sum()),
+        'total_safety_signals': int(table['total_safety_signals'].sum())
+    }
+
+SUMMARY_FIELDS = (
+    'total_papers', 'high_risk', 'medium_risk', 'low_risk', 'unknown_risk', 'fda_reporting',
+    'adverse_events', 'drug_interactions', 'contraindications', 'total_safety_signals'
+)
+
+class SafetyAggregate:
+    """Running totals behind every executive-summary metric and dashboard chart.
+
+    add() folds one analyzed paper into the overall, per-compound and safety-domain
+    totals in O(1) (its domains are one lookup row of SAFETY_DOMAIN_BIT_ROWS), so live
+    dashboards can update as each result arrives. Adding a paper that is already counted (same AnalysisResultIndex key)
+    first subtracts its earlier entry. Risk levels are the ones scored at parse time, which use
+    the default RISK_THRESHOLDS, as the analysis table does.
+    """
+
+    def __init__(self, analyzed_papers=()):
+        self._entries = {}
+        self._totals = [0] * len(SUMMARY_FIELDS)
+        self._compound_totals = {}
+        self.domain_counts = np.zeros(len(SAFETY_DOMAIN_CHOICES), dtype=np.int64)
+        for paper in analyzed_papers:
+            self.add(paper)
+
+    @staticmethod
+    def _contribution(analysis):
+        """One paper's values, in SUMMARY_FIELDS order"""
+        risk_level = analysis.get('risk_level', 'UNKNOWN')
+        regulatory = (analysis.get('regulatory_impact') or '').lower()
+        adverse_events = analysis.get('adverse_events_count', 0)
+        drug_interactions = analysis.get('drug_interactions_count', 0)
+        contraindications = analysis.get('contraindications_count', 0)
+        return (
+            1,
+            int(risk_level == 'HIGH'),
+            int(risk_level == 'MEDIUM'),
+            int(risk_level == 'LOW'),
+            int(risk_level not in ('HIGH', 'MEDIUM', 'LOW')),
+            # High risk or a regulatory impact mentioning FDA/reporting, as in rescore_analysis_table()
+            int(risk_level == 'HIGH' or 'fda' in regulatory or 'reporting' in regulatory),
+            adverse_events,
+            drug_interactions,
+            contraindications,
+            adverse_events + drug_interactions + contraindications
+        )
+
+    def _apply(self, compound_name, contribution, domain_mask, sign):
+        compound_totals = self._compound_totals.setdefault(compound_name, [0] * len(SUMMARY_FIELDS))
+        for i, value in enumerate(contribution):
+            self._totals[i] += sign * value
+            compound_totals[i] += sign * value
+        self.domain_counts += sign * SAFETY_DOMAIN_BIT_ROWS[domain_mask]
+        if not compound_totals[0]:
+            del self._compound_totals[compound_name]
+
+    def add(self, paper):
+        """Count an analyzed paper; returns False if it replaced an earlier entry for the same paper"""
+        analysis = paper.get('analysis', {})
+        entry = (paper.get('compound', ''), self._contribution(analysis), analysis_domain_mask(analysis))
+        key = AnalysisResultIndex.key_for(paper)
+        previous = self._entries.get(key)
+        if previous is not None:
+            self._apply(*previous, -1)
+        self._entries[key] = entry
+        self._apply(*entry, 1)
+        return previous is None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def summary(self):
+        """Executive summary metrics, keyed like SUMMARY_FIELDS"""
+        return dict(zip(SUMMARY_FIELDS, self._totals))
+
+    def risk_counts(self):
+        totals = self.summary()
+        return {'HIGH': totals['high_risk'], 'MEDIUM': totals['medium_risk'], 'LOW': totals['low_risk'], 'UNKNOWN': totals['unknown_risk']}
+
+    def sorted_domains(self):
+        """(domain, paper count) pairs for domains with papers, highest count first"""
+        return [
+            (SAFETY_DOMAIN_CHOICES[i], int(self.domain_counts[i]))
+            for i in np.argsort(-self.domain_counts, kind='stable') if self.domain_counts[i] > 0
+        ]
+
+    def compound_count(self):
+        return len(self._compound_totals)
+
+    def compound_summary(self):
+        """One row per compound with its paper, risk and signal totals"""
+        summary = pd.DataFrame(
+            [[compound_name] + totals for compound_name, totals in self._compound_totals.items()],
+            columns=('compound',) + SUMMARY_FIELDS
+        ).drop(columns='unknown_risk').rename(columns={
+            'total_papers': 'papers'
+        })
+        return summary.sort_values(['high_risk', 'total_safety_signals'], ascending=False, kind='stable').reset_index(drop=True)
+
+# Exports are written chunk by chunk, so memory stays flat however many papers a run has
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_FORMATS = {
+    'parquet': ("Parquet", ".parquet", "application/vnd.apache.parquet"),
+    'arrow': ("Arrow IPC", ".arrow", "application/vnd.apache.arrow.file"),
+    'csv': ("CSV", ".csv", "text/csv"),
+    'jsonl': ("JSON Lines", ".jsonl", "application/x-ndjson")
+}
+EXPORT_LIST_FIELDS = ('safety_domains', 'adverse_events', 'drug_interactions', 'contraindications', 'other_signals', 'key_findings')
+
+def export_format_for_path(path, default='jsonl'):
+    """Export format matching a file name's extension"""
+    for export_format, (_, extension, _) in EXPORT_FORMATS.items():
+        if path.lower().endswith(extension):
+            return export_format
+    return default
+
+def iter_export_chunks(analyzed_papers, table, chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield the full export in DataFrames of up to chunk_size rows.
+
+    Each row is the paper's analysis table row (counts, scores, domain mask) plus its
+    domain names, signal lists, serious terms, risk rationale, abstract and raw analysis
+    text. An empty table still yields one empty chunk, so every format gets its header.
+    """
+    for start in range(0, max(len(table), 1), chunk_size):
+        papers = analyzed_papers[start:start + chunk_size]
+        analyses = [paper.get('analysis', {}) for paper in papers]
+        chunk = table.iloc[start:start + chunk_size].reset_index(drop=True)
+        columns = {field: [list(a.get(field) or []) for a in analyses] for field in EXPORT_LIST_FIELDS if field != 'safety_domains'}
+        columns['safety_domains'] = [safety_domain_names(mask) for mask in chunk['safety_domain_mask']]
+        yield chunk.assign(
+            **columns,
+            serious_terms=[dict(a.get('serious_terms') or {}) for a in analyses],
+            risk_rationale=[a.get('risk_rationale', '') for a in analyses],
+            abstract=[paper.get('abstract', '') for paper in papers],
+            full_analysis=[a.get('full_analysis', '') for a in analyses]
+        )
+
+def _export_arrow_schema(pa, chunk):
+    """Arrow types for the export columns: lists of strings, a term -> count map, ints, bools and text"""
+    fields = []
+    for name, dtype in chunk.dtypes.items():
+        if name in EXPORT_LIST_FIELDS:
+            arrow_type = pa.list_(pa.string())
+        elif name == 'serious_terms':
+            arrow_type = pa.map_(pa.string(), pa.int64())
+        elif pd.api.types.is_bool_dtype(dtype):
+            arrow_type = pa.bool_()
+        elif pd.api.types.is_integer_dtype(dtype):
+            arrow_type = pa.int64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+def _flatten_export_chunk(chunk):
+    """CSV cells: lists joined with '; ' and serious terms as JSON"""
+    return chunk.assign(
+        **{field: chunk[field].map(_joined) for field in EXPORT_LIST_FIELDS},
+        serious_terms=chunk['serious_terms'].map(lambda terms: json.dumps(terms, ensure_ascii=False))
+    )
+
+def write_analysis_export(analyzed_papers, table, output_path, export_format=None, chunk_size=EXPORT_CHUNK_ROWS):
+    """Stream the full typed export of analyzed papers (rows aligned with table) to output_path.
+
+    Parquet gets one row group and Arrow IPC one record batch per chunk; CSV and JSON Lines
+    are appended chunk by chunk. Returns the format written. Parquet and Arrow need pyarrow.
+    """
+    export_format = export_format or export_format_for_path(output_path)
+    chunks = iter_export_chunks(analyzed_papers, table, chunk_size)
+    
+    if export_format in ('parquet', 'arrow'):
+        import pyarrow as pa
+        writer = None
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    schema = _export_arrow_schema(pa, chunk)
+                    if export_format == 'parquet':
+                        import pyarrow.parquet as pq
+                        writer = pq.ParquetWriter(output_path, schema)
+                    else:
+                        writer = pa.ipc.new_file(output_path, schema)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False) if len(chunk) else schema.empty_table())
+        finally:
+            if writer is not None:
+                writer.close()
+    elif export_format in ('csv', 'jsonl'):
+        with open(output_path, 'w', encoding='utf-8', newline='') as handle:
+            for i, chunk in enumerate(chunks):
+                if export_format == 'csv':
+                    _flatten_export_chunk(chunk).to_csv(handle, header=i == 0, index=False)
+                elif len(chunk):
+                    lines = chunk.to_json(orient='records', lines=True, force_ascii=False)
+                    handle.write(lines if lines.endswith('\n') else lines + '\n')
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return export_format
+
+class SurveillanceStore:
+    """SQLite record of incremental surveillance: a watermark and the analyzed papers per compound.
+
+    The watermark is the PubMed entry date ('YYYY/MM/DD') up to which a compound was last
+    scanned successfully; the next run only searches from there on.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(PAPERSAFE_DATA_DIR, "surveillance.sqlite3")
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                compound_key TEXT PRIMARY KEY,
+                compound TEXT NOT NULL,
+                scanned_through TEXT NOT NULL,
+                scanned_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS surveillance_results (
+                compound_key TEXT NOT NULL,
+                pmid TEXT NOT NULL,
+                paper TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                PRIMARY KEY (compound_key, pmid)
+            );
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(compound_name):
+        return compound_name.strip().lower()
+
+    def watermark(self, compound_name):
+        """Entry date the compound was last scanned through, or None if never scanned"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT scanned_through FROM watermarks WHERE compound_key = ?", (self._key(compound_name),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, compound_name, scanned_through):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)",
+                (self._key(compound_name), compound_name.strip(), scanned_through, time.time())
+            )
+            self._conn.commit()
+
+    def known_pmids(self, compound_name):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pmid FROM surveillance_results WHERE compound_key = ?", (self._key(compound_name),)
+            ).fetchall()
+        return {pmid for (pmid,) in rows}
+
+    def add_results(self, compound_name, papers):
+        """Append analyzed papers (with their parsed 'analysis') to the compound's result set"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO surveillance_results VALUES (?, ?, ?, ?)",
+                [(self._key(compound_name), paper['pmid'], json.dumps(paper), now) for paper in papers]
+            )
+            self._conn.commit()
+
+    def results(self, compounds=None):
+        """Stored papers for the given compounds (all compounds if None), newest additions first"""
+        query = "SELECT paper FROM surveillance_results"
+        params = []
+        if compounds is not None:
+            keys = [self._key(compound_name) for compound_name in compounds]
+            query += f" WHERE compound_key IN ({','.join('?' * len(keys))})"
+            params = keys
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY added_at DESC, rowid", params).fetchall()
+        return [json.loads(paper) for (paper,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def publication_year(pub_date):
+    """Year from a PubMed date such as 'Mar 2024' or '2024', or None"""
+    for token in (pub_date or '').split():
+        if len(token) == 4 and token.isdigit():
+            return int(token)
+    return None
+
+def _domain_mask_values(domains):
+    """Every mask value containing any of the domains, so a domain filter can use the domain_mask index"""
+    wanted = safety_domain_mask(domains)
+    return [mask for mask in range(SAFETY_DOMAIN_MASK_COUNT) if mask & wanted]
+
+class ScanHistoryStore:
+    """SQLite history of completed scans, queryable across runs.
+
+    papers holds each PubMed record once; analyses holds one row per scan, compound and
+    paper with indexed compound, PMID, risk level, domain bitmask and publication year
+    columns plus the parsed analysis. Reopening a scan or querying across scans reads
+    only this store - nothing is fetched or analyzed again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(PAPERSAFE_DATA_DIR, "scan_history.sqlite3")
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scans (
+                scan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                label TEXT NOT NULL,
+                compounds TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                paper_count INTEGER NOT NULL,
+                high_risk INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS papers (
+                pmid TEXT PRIMARY KEY,
+                pub_year INTEGER,
+                paper TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS analyses (
+                scan_id INTEGER NOT NULL REFERENCES scans(scan_id),
+                position INTEGER NOT NULL,
+                compound TEXT NOT NULL,
+                compound_key TEXT NOT NULL,
+                pmid TEXT NOT NULL,
+                risk_level TEXT NOT NULL,
+                domain_mask INTEGER NOT NULL,
+                pub_year INTEGER,
+                total_safety_signals INTEGER NOT NULL,
+                analysis TEXT NOT NULL,
+                PRIMARY KEY (scan_id, compound_key, pmid)
+            );
+            CREATE INDEX IF NOT EXISTS analyses_compound ON analyses (compound_key, pub_year);
+            CREATE INDEX IF NOT EXISTS analyses_pmid ON analyses (pmid, compound_key, scan_id);
+            CREATE INDEX IF NOT EXISTS analyses_risk ON analyses (risk_level, pub_year);
+            CREATE INDEX IF NOT EXISTS analyses_domain ON analyses (domain_mask);
+            CREATE INDEX IF NOT EXISTS analyses_year ON analyses (pub_year);
+        """)
+        self._conn.commit()
+
+    def save_scan(self, analyzed_papers, label=None, settings=None):
+        """Record a completed scan's papers and analyses; returns its scan_id"""
+        compounds = list(dict.fromkeys(paper.get('compound', '') for paper in analyzed_papers))
+        paper_rows = []
+        analysis_rows = []
+        for position, paper in enumerate(analyzed_papers):
+            record = {key: value for key, value in paper.items() if key not in ('analysis', 'compound')}
+            analysis = paper.get('analysis', {})
+            pub_year = publication_year(paper.get('pub_date'))
+            compound_name = paper.get('compound', '')
+            # Records without a PMID are keyed by title, as in AnalysisResultIndex
+            pmid = paper.get('pmid')
+            if not pmid or pmid == "Unknown":
+                pmid = f"title:{paper.get('title', '').strip().lower()}"
+            paper_rows.append((pmid, pub_year, json.dumps(record)))
+            analysis_rows.append((
+                position, compound_name, compound_name.strip().lower(), pmid,
+                analysis.get('risk_level', 'UNKNOWN'), analysis_domain_mask(analysis), pub_year,
+                analysis.get('total_safety_signals', 0), json.dumps(analysis)
+            ))
+        high_risk = sum(1 for row in analysis_rows if row[4] == 'HIGH')
+        
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO scans (created_at, label, compounds, settings, paper_count, high_risk) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), label or ', '.join(compounds[:3]) + (f" +{len(compounds) - 3}" if len(compounds) > 3 else ''),
+                 json.dumps(compounds), json.dumps(settings or {}), len(analysis_rows), high_risk)
+            )
+            scan_id = cursor.lastrowid
+            self._conn.executemany("INSERT OR REPLACE INTO papers VALUES (?, ?, ?)", paper_rows)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(scan_id,) + row for row in analysis_rows]
+            )
+            self._conn.commit()
+        return scan_id
+
+    def scans(self, limit=50):
+        """Most recent scans first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT scan_id, created_at, label, compounds, settings, paper_count, high_risk FROM scans ORDER BY scan_id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {'scan_id': scan_id, 'created_at': created_at, 'label': label, 'compounds': json.loads(compounds),
+             'settings': json.loads(settings), 'paper_count': paper_count, 'high_risk': high_risk}
+            for scan_id, created_at, label, compounds, settings, paper_count, high_risk in rows
+        ]
+
+    @staticmethod
+    def _paper(compound_name, paper_json, analysis_json):
+        paper = json.loads(paper_json)
+        paper['compound'] = compound_name
+        paper['analysis'] = json.loads(analysis_json)
+        return paper
+
+    def load_scan(self, scan_id):
+        """A saved scan's analyzed papers, in their original order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT a.compound, p.paper, a.analysis FROM analyses a JOIN papers p ON p.pmid = a.pmid "
+                "WHERE a.scan_id = ? ORDER BY a.position",
+                (scan_id,)
+            ).fetchall()
+        return [self._paper(*row) for row in rows]
+
+    def query(self, compounds=None, drug_class=None, risk_levels=None, domains=None, year_from=None, year_to=None, limit=5000):
+        """Analyzed papers from every saved scan matching all given filters.
+
+        compounds and drug_class (see DRUG_CLASSES) match any synonym; domains match papers
+        touching any of them. Each compound and paper is judged by its most recent analysis
+        only, so it appears at most once; newest publication years first.
+        """
+        conditions = ["a.scan_id = (SELECT MAX(b.scan_id) FROM analyses b WHERE b.pmid = a.pmid AND b.compound_key = a.compound_key)"]
+        params = []
+        compound_keys = set()
+        if compounds:
+            for compound_name in compounds:
+                compound_keys.update(synonym.strip().lower() for synonym in drug_synonyms(compound_name))
+        if drug_class:
+            class_keys = drug_class_members(drug_class)
+            compound_keys = compound_keys & class_keys if compounds else class_keys
+        if compounds or drug_class:
+            conditions.append(f"a.compound_key IN ({','.join('?' * len(compound_keys))})" if compound_keys else "0")
+            params.extend(sorted(compound_keys))
+        if risk_levels:
+            conditions.append(f"a.risk_level IN ({','.join('?' * len(risk_levels))})")
+            params.extend(risk_levels)
+        if domains:
+            mask_values = _domain_mask_values(domains)
+            conditions.append(f"a.domain_mask IN ({','.join('?' * len(mask_values))})")
+            params.extend(mask_values)
+        if year_from is not None:
+            conditions.append("a.pub_year >= ?")
+            params.append(year_from)
+        if year_to is not None:
+            conditions.append("a.pub_year <= ?")
+            params.append(year_to)
+        
+        query = (
+            "SELECT a.compound, p.paper, a.analysis FROM analyses a JOIN papers p ON p.pmid = a.pmid WHERE "
+            + " AND ".join(conditions)
+            + " ORDER BY a.pub_year DESC, a.total_safety_signals DESC LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(query, params + [limit]).fetchall()
+        return [self._paper(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def run_incremental_scan(compounds, anthropic_client, surveillance_store, initial_years_back=25, today=None, full_backfill=False, **scan_options):
+    """Portfolio scan limited to papers that entered PubMed since each compound's watermark.
+
+    Since a watermark every new paper is analyzed. A compound's first run (no watermark)
+    only analyzes the newest max_results papers of the last initial_years_back years unless
+    full_backfill is set, since the whole backfill can be thousands of Claude requests;
+    older papers are then left out for good. PMIDs already in the stored result set are
+    never sent to Claude again. Each compound's new analyses are appended to the store, and
+    its watermark moves to today only when every new PMID esearch returned was analyzed;
+    otherwise (failed search, a paper not fetched, parsed or analyzed) the next run repeats
+    the same window, skipping what was stored. Yields run_portfolio_scan() events.
+    """
+    compounds = list(dict.fromkeys(compound.strip() for compound in compounds if compound.strip()))
+    today = today or datetime.now()
+    scan_through = today.strftime("%Y/%m/%d")
+    initial_start = (today - timedelta(days=initial_years_back * 365)).strftime("%Y/%m/%d")
+    
+    # The window starts on the watermark day itself; the stored PMIDs absorb the overlap
+    watermarks = {compound_name: surveillance_store.watermark(compound_name) for compound_name in compounds}
+    date_ranges = {compound_name: (watermarks[compound_name] or initial_start, scan_through) for compound_name in compounds}
+    skip_pmids = {compound_name: surveillance_store.known_pmids(compound_name) for compound_name in compounds}
+    backfill_limit = None if full_backfill else scan_options.get('max_results', 20)
+    result_limits = {compound_name: None if watermarks[compound_name] else backfill_limit for compound_name in compounds}
+    for compound_name in compounds:
+        if result_limits[compound_name] is not None:
+            yield 'notice', ('info', f"🕰️ First incremental scan of {compound_name}: analyzing its newest {backfill_limit} papers; later scans pick up everything new")
+    
+    new_papers = {compound_name: [] for compound_name in compounds}
+    found_pmids = {compound_name: set() for compound_name in compounds}
+    failed = set()
+    for event, payload in run_portfolio_scan(compounds, anthropic_client, date_ranges=date_ranges, skip_pmids=skip_pmids, result_limits=result_limits, **scan_options):
+        if event == 'found':
+            found_pmids[payload[0]].update(payload[1])
+        elif event == 'analyzed':
+            paper, source = payload
+            if source == 'error':
+                failed.add(paper['compound'])
+            else:
+                new_papers[paper['compound']].append(paper)
+        elif event == 'error':
+            failed.add(payload[0])
+        yield event, payload
+    
+    for compound_name in compounds:
+        surveillance_store.add_results(compound_name, new_papers[compound_name])
+        missing = found_pmids[compound_name].difference(paper['pmid'] for paper in new_papers[compound_name])
+        if missing:
+            yield 'notice', ('warning', f"⏸️ {compound_name}: {len(missing)} papers left unanalyzed; the next incremental scan repeats the window from {date_ranges[compound_name][0]}")
+        elif compound_name not in failed:
+            surveillance_store.set_watermark(compound_name, scan_through)
+
+def scan_compounds(compounds, anthropic_client, progress=None, surveillance_store=None, **scan_options):
+    """Run a full scan and return the analyzed papers, in PubMed order per compound.
+
+    progress(event, payload) receives every run_portfolio_scan() event as it happens;
+    'notice' events are also logged. scan_options are passed to run_portfolio_scan(), or
+    to run_incremental_scan() when a surveillance_store is given, in which case only
+    the newly analyzed papers are returned.
+    """
+    compounds = list(dict.fromkeys(compound.strip() for compound in compounds if compound.strip()))
+    found_by_compound = {}
+    analyzed_papers = AnalysisResultIndex()
+    if surveillance_store is not None:
+        scan_options.setdefault('initial_years_back', scan_options.pop('max_years_back', 25))
+        events = run_incremental_scan(compounds, anthropic_client, surveillance_store, **scan_options)
+    else:
+        events = run_portfolio_scan(compounds, anthropic_client, **scan_options)
+    for event, payload in events:
+        if event == 'notice':
+            log_notify(*payload)
+        elif event == 'found':
+            found_by_compound[payload[0]] = payload[1]
+        elif event == 'analyzed':
+            analyzed_papers.add(payload[0])
+        elif event == 'error':
+            report_pubmed_error(payload[1], log_notify)
+        if progress is not None:
+            progress(event, payload)
+    
+    analyzed_papers.reorder([(compound, pmid) for compound in compounds for pmid in found_by_compound.get(compound, [])])
+    return analyzed_papers.papers()